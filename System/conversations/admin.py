@@ -9,7 +9,7 @@ from .models import (
     User, Agent, Admin,
     Customer, CustomerTag, CustomerNote,
     Ticket, TicketTransferLog, TicketStateLog,
-    Message, MessageDeliveryLog, MessageSearchIndex,
+    Message, MessageDeliveryLog,
     GlobalTemplate, AgentTemplate, AutoReplyTrigger,
     ResponseTimeTracking, AgentDelayEvent,
     AgentKPI, AgentKPIMonthly, CustomerSatisfaction,
@@ -76,18 +76,22 @@ class TicketAdmin(admin.ModelAdmin):
     list_filter = ['status', 'priority', 'category', 'is_delayed']
     search_fields = ['ticket_number', 'customer__name']
     readonly_fields = ['created_at', 'updated_at']
+    # ✅ العلاقات القابلة لـ NULL لا يتبعها select_related() التلقائي في القائمة
+    list_select_related = ['customer', 'assigned_agent__user']
 
 
 @admin.register(TicketTransferLog)
 class TicketTransferLogAdmin(admin.ModelAdmin):
     list_display = ['ticket', 'from_agent', 'to_agent', 'transferred_by', 'created_at']
     search_fields = ['ticket__ticket_number']
+    list_select_related = ['ticket', 'from_agent__user', 'to_agent__user', 'transferred_by']
 
 
 @admin.register(TicketStateLog)
 class TicketStateLogAdmin(admin.ModelAdmin):
     list_display = ['ticket', 'old_state', 'new_state', 'changed_by', 'created_at']
     search_fields = ['ticket__ticket_number']
+    list_select_related = ['ticket', 'changed_by']
 
 
 # ============================================================================
@@ -107,12 +111,6 @@ class MessageDeliveryLogAdmin(admin.ModelAdmin):
     list_filter = ['delivery_status']
 
 
-@admin.register(MessageSearchIndex)
-class MessageSearchIndexAdmin(admin.ModelAdmin):
-    list_display = ['message', 'customer', 'created_at']
-    search_fields = ['search_text']
-
-
 # ============================================================================
 # TEMPLATES
 # ============================================================================
@@ -146,6 +144,7 @@ class AutoReplyTriggerAdmin(admin.ModelAdmin):
 class ResponseTimeTrackingAdmin(admin.ModelAdmin):
     list_display = ['ticket', 'agent', 'response_time_seconds', 'is_delayed', 'created_at']
     list_filter = ['is_delayed']
+    list_select_related = ['ticket', 'agent__user']
 
 
 @admin.register(AgentDelayEvent)
@@ -176,18 +175,35 @@ class AgentKPIMonthlyAdmin(admin.ModelAdmin):
 class CustomerSatisfactionAdmin(admin.ModelAdmin):
     list_display = ['ticket', 'agent', 'rating', 'created_at']
     list_filter = ['rating']
+    list_select_related = ['ticket', 'agent__user']
 
 
 # ============================================================================
 # ACTIVITY LOG
 # ============================================================================
 
+def _is_changelist(request):
+    """
+    هل الطلب لصفحة القائمة (وليس صفحة التعديل)؟
+    """
+    match = getattr(request, 'resolver_match', None)
+    return bool(match and match.url_name and match.url_name.endswith('_changelist'))
+
+
 @admin.register(ActivityLog)
 class ActivityLogAdmin(admin.ModelAdmin):
     list_display = ['user', 'action', 'entity_type', 'entity_id', 'created_at']
     list_filter = ['action', 'entity_type']
     search_fields = ['user__username', 'action']
     readonly_fields = ['created_at']
+    list_select_related = ['user']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # ✅ القائمة لا تعرض الحقول النصية/JSON الكبيرة
+        if _is_changelist(request):
+            queryset = queryset.defer('old_value', 'new_value', 'user_agent')
+        return queryset
 
 
 @admin.register(LoginAttempt)
@@ -197,3 +213,9 @@ class LoginAttemptAdmin(admin.ModelAdmin):
     search_fields = ['username', 'ip_address']
     readonly_fields = ['attempt_time']
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if _is_changelist(request):
+            queryset = queryset.defer('user_agent')
+        return queryset
+
@@ -35,9 +35,10 @@ class CustomUserBackend(BaseBackend):
     def get_user(self, user_id):
         """
         الحصول على المستخدم من ID
+        ✅ مع ملف agent/admin في نفس الاستعلام (يُستخدم في كل طلب عبر request.user)
         """
         try:
-            return User.objects.get(pk=user_id)
+            return User.objects.select_related('agent', 'admin').get(pk=user_id)
         except User.DoesNotExist:
             return None
 
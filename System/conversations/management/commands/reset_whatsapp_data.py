@@ -15,7 +15,6 @@ from django.db import transaction
 from conversations.models import (
     Message,
     MessageDeliveryLog,
-    MessageSearchIndex,
     Ticket,
     TicketTransferLog,
     TicketStateLog,
@@ -44,9 +43,8 @@ class Command(BaseCommand):
 
         # Delete message-related tables first
         msg_logs_deleted, _ = MessageDeliveryLog.objects.all().delete()
-        search_idx_deleted, _ = MessageSearchIndex.objects.all().delete()
         messages_deleted, _ = Message.objects.all().delete()
-        self.stdout.write(f'🗑️  Deleted: {msg_logs_deleted} delivery logs, {search_idx_deleted} search indices, {messages_deleted} messages')
+        self.stdout.write(f'🗑️  Deleted: {msg_logs_deleted} delivery logs, {messages_deleted} messages')
 
         # Delete tickets and related logs
         transfers_deleted, _ = TicketTransferLog.objects.all().delete()
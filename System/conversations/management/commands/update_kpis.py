@@ -12,7 +12,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, timedelta
 from conversations.models import Agent
-from conversations.utils import calculate_agent_kpi
+from conversations.utils import calculate_kpis_bulk
 
 
 class Command(BaseCommand):
@@ -63,7 +63,7 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f'❌ الموظف #{agent_id} غير موجود'))
                 return
         else:
-            agents = Agent.objects.all()
+            agents = Agent.objects.select_related('user')
         
         # بدء التحديث
         self.stdout.write(self.style.SUCCESS(f'🔄 بدء تحديث KPIs لـ {agents.count()} موظف...'))
@@ -73,27 +73,29 @@ class Command(BaseCommand):
         total_updated = 0
         total_errors = 0
         
+        # ✅ حساب كل الموظفين وكل الأيام دفعة واحدة (GROUP BY + upsert)
+        try:
+            results = calculate_kpis_bulk(agents, dates)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'❌ خطأ في حساب KPIs: {str(e)}'))
+            return
+        
         for agent in agents:
             self.stdout.write(f'\n👤 {agent.user.full_name}')
             
             for date in dates:
-                try:
-                    kpi_data = calculate_agent_kpi(agent, date)
-                    
-                    if kpi_data['total_tickets'] > 0:
-                        self.stdout.write(
-                            f'  ✅ {date}: '
-                            f'{kpi_data["total_tickets"]} تذاكر، '
-                            f'{kpi_data["closed_tickets"]} مغلقة، '
-                            f'KPI: {kpi_data["overall_kpi_score"]:.1f}%'
-                        )
-                        total_updated += 1
-                    else:
-                        self.stdout.write(f'  ⚪ {date}: لا توجد تذاكر')
-                        
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'  ❌ {date}: خطأ - {str(e)}'))
-                    total_errors += 1
+                kpi_data = results[(agent.id, date)]
+                
+                if kpi_data['total_tickets'] > 0:
+                    self.stdout.write(
+                        f'  ✅ {date}: '
+                        f'{kpi_data["total_tickets"]} تذاكر، '
+                        f'{kpi_data["closed_tickets"]} مغلقة، '
+                        f'KPI: {kpi_data["overall_kpi_score"]:.1f}%'
+                    )
+                    total_updated += 1
+                else:
+                    self.stdout.write(f'  ⚪ {date}: لا توجد تذاكر')
         
         # النتيجة النهائية
         self.stdout.write('\n' + '=' * 70)
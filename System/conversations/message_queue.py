@@ -15,7 +15,7 @@ import logging
 import time
 from typing import Dict, Any, Optional, List
 from django.utils import timezone
-from django.db import transaction, OperationalError
+from django.db import transaction, OperationalError, IntegrityError
 from datetime import timedelta
 import sqlite3
 
@@ -63,7 +63,7 @@ class MessageQueue:
         self._sent_messages_count = 0
         self._last_reset_time = time.time()
     
-    def generate_message_hash(self, ticket_id: int, message_text: str, sender_id: int) -> str:
+    def generate_message_hash(self, ticket_id: int, message_text: str, sender_id: int) -> bytes:
         """
         توليد Hash فريد للرسالة لمنع التكرار
         
@@ -73,33 +73,10 @@ class MessageQueue:
             sender_id: رقم المرسل
         
         Returns:
-            SHA256 hash
+            SHA256 digest (32 بايت خام بدلاً من 64 حرف hex)
         """
         unique_string = f"{ticket_id}:{message_text}:{sender_id}:{timezone.now().strftime('%Y%m%d%H%M')}"
-        return hashlib.sha256(unique_string.encode()).hexdigest()
-    
-    def check_duplicate(self, message_hash: str, minutes: int = 5) -> bool:
-        """
-        التحقق من وجود رسالة مكررة في آخر X دقائق
-        
-        Args:
-            message_hash: الـ hash المطلوب
-            minutes: عدد الدقائق للبحث (افتراضي 5)
-        
-        Returns:
-            True إذا وجدت رسالة مكررة
-        """
-        cutoff_time = timezone.now() - timedelta(minutes=minutes)
-        
-        duplicate = Message.objects.filter(
-            message_hash=message_hash,
-            created_at__gte=cutoff_time
-        ).exists()
-        
-        if duplicate:
-            logger.warning(f"⚠️  Duplicate message detected: {message_hash[:16]}...")
-        
-        return duplicate
+        return hashlib.sha256(unique_string.encode()).digest()
     
     @transaction.atomic
     def enqueue(
@@ -167,32 +144,36 @@ class MessageQueue:
             # توليد Hash للرسالة
             message_hash = self.generate_message_hash(ticket_id, message_text, user.id)
             
-            # التحقق من التكرار
-            if self.check_duplicate(message_hash, minutes=5):
-                logger.warning(f"Duplicate message rejected for ticket {ticket_id}")
+            # حفظ الرسالة بحالة 'pending' مع retry للـ database lock
+            # ✅ منع التكرار عبر القيد uq_msg_hash_notnull بدلاً من SELECT قبل الإدراج
+            def create_message():
+                with transaction.atomic():
+                    return Message.objects.create(
+                        ticket=ticket,
+                        sender=user,
+                        sender_type='agent' if user.role == 'agent' else 'admin',
+                        direction='outgoing',
+                        message_text=message_text,
+                        message_type=message_type,
+                        media_url=media_url,
+                        mime_type=mime_type,
+                        delivery_status='pending',
+                        message_hash=message_hash,
+                        retry_count=0
+                    )
+
+            try:
+                message = retry_db_operation(create_message)
+            except IntegrityError:
+                # مكررة فقط إذا كان الـ hash موجوداً فعلاً - باقي أخطاء القيود (FK / NOT NULL) تُعاد كما هي
+                if not Message.objects.filter(message_hash=message_hash).exists():
+                    raise
+                logger.warning(f"Duplicate message rejected for ticket {ticket_id}: {message_hash.hex()[:16]}...")
                 return {
                     'success': False,
                     'error': 'Duplicate message detected',
                     'duplicate': True
                 }
-            
-            # حفظ الرسالة بحالة 'pending' مع retry للـ database lock
-            def create_message():
-                return Message.objects.create(
-                    ticket=ticket,
-                    sender=user,
-                    sender_type='agent' if user.role == 'agent' else 'admin',
-                    direction='outgoing',
-                    message_text=message_text,
-                    message_type=message_type,
-                    media_url=media_url,
-                    mime_type=mime_type,
-                    delivery_status='pending',
-                    message_hash=message_hash,
-                    retry_count=0
-                )
-
-            message = retry_db_operation(create_message)
 
             logger.info(f"[QUEUED] Message queued: {message.id} for ticket {ticket_id}")
 
@@ -6,6 +6,8 @@ Custom Middleware for Khalifa Pharmacy
 from django.utils.deprecation import MiddlewareMixin
 from django.utils import timezone
 
+from .utils import start_activity_log_buffer, flush_activity_log_buffer
+
 
 class PermanentSessionMiddleware(MiddlewareMixin):
     """
@@ -49,3 +51,18 @@ class UserActivityMiddleware(MiddlewareMixin):
         
         return None
 
+
+class ActivityLogBufferMiddleware(MiddlewareMixin):
+    """
+    Middleware لتجميع سجلات النشاط (ActivityLog) خلال الطلب
+    ونقلها عند انتهائه إلى الطابور المشترك الذي يُحفظ بـ bulk_create
+    خارج مسار الطلب بدلاً من INSERT لكل سجل
+    """
+    
+    def process_request(self, request):
+        start_activity_log_buffer()
+        return None
+    
+    def process_response(self, request, response):
+        flush_activity_log_buffer()
+        return response
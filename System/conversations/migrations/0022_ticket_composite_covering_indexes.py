@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0021_agent_perm_complaint_agent_perm_consultation_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='tickets_status_fbbf05_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='tickets_assigne_a21dd9_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='tickets_assigne_483f5f_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['assigned_agent', 'status', '-created_at'], include=('priority', 'category', 'last_message_at'), name='tix_assigned_status_ctime'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['current_agent', 'status', '-created_at'], include=('priority', 'category', 'last_message_at'), name='tix_current_status_ctime'),
+        ),
+    ]
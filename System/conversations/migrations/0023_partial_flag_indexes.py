@@ -0,0 +1,77 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0022_ticket_composite_covering_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='agent',
+            name='agents_is_onli_350001_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='agenttemplate',
+            name='agent_templ_is_acti_dd994f_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='autoreplytrigger',
+            name='auto_reply__is_acti_075480_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='globaltemplate',
+            name='global_temp_is_acti_472ae8_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_is_read_6a69c0_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='tickets_is_dela_8f4213_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='user',
+            name='users_is_acti_847b48_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='user',
+            name='users_is_onli_f24b46_idx',
+        ),
+        migrations.AddIndex(
+            model_name='agent',
+            index=models.Index(condition=models.Q(('is_online', True)), fields=['status'], name='agent_online_partial'),
+        ),
+        migrations.AddIndex(
+            model_name='agenttemplate',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['agent'], name='atpl_active_partial'),
+        ),
+        migrations.AddIndex(
+            model_name='autoreplytrigger',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['trigger_keyword'], name='trigger_active_partial'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(condition=models.Q(('is_blocked', True)), fields=['phone_number'], name='cust_blocked_partial'),
+        ),
+        migrations.AddIndex(
+            model_name='globaltemplate',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category'], name='gtpl_active_partial'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['ticket', 'created_at'], name='msg_unread_partial'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_delayed', True)), fields=['created_at'], name='tix_delayed_partial'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_online', True)), fields=['role'], name='users_online_partial'),
+        ),
+    ]
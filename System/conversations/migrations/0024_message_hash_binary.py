@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+
+
+def hex_to_digest(apps, schema_editor):
+    """تحويل الـ hash المخزن كنص hex إلى digest خام (32 بايت)"""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE messages SET message_hash_bin = decode(message_hash, 'hex') "
+            "WHERE message_hash IS NOT NULL"
+        )
+        return
+
+    Message = apps.get_model('conversations', 'Message')
+    rows = list(Message.objects.filter(message_hash__isnull=False).values_list('id', 'message_hash'))
+    for pk, hex_hash in rows:
+        try:
+            digest = bytes.fromhex(hex_hash)
+        except ValueError:
+            continue
+        Message.objects.filter(pk=pk).update(message_hash_bin=digest)
+
+
+def digest_to_hex(apps, schema_editor):
+    """عكس التحويل: digest خام -> نص hex"""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE messages SET message_hash = encode(message_hash_bin, 'hex') "
+            "WHERE message_hash_bin IS NOT NULL"
+        )
+        return
+
+    Message = apps.get_model('conversations', 'Message')
+    rows = list(Message.objects.filter(message_hash_bin__isnull=False).values_list('id', 'message_hash_bin'))
+    for pk, digest in rows:
+        Message.objects.filter(pk=pk).update(message_hash=bytes(digest).hex())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0023_partial_flag_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='message_hash_bin',
+            field=models.BinaryField(blank=True, max_length=32, null=True),
+        ),
+        migrations.RunPython(hex_to_digest, digest_to_hex),
+        migrations.RemoveField(
+            model_name='message',
+            name='message_hash',
+        ),
+        migrations.RenameField(
+            model_name='message',
+            old_name='message_hash_bin',
+            new_name='message_hash',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='message_hash',
+            field=models.BinaryField(blank=True, db_index=True, max_length=32, null=True),
+        ),
+    ]
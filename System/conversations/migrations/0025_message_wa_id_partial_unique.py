@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0024_message_hash_binary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_whatsap_4d16c3_idx',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='whatsapp_message_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('whatsapp_message_id__isnull', False)), fields=('whatsapp_message_id',), name='uq_wa_msg_id_notnull'),
+        ),
+    ]
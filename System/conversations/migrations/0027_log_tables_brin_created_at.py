@@ -0,0 +1,80 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:38
+
+from django.db import migrations
+
+
+# ✅ جداول السجلات تُكتب بترتيب زمني فقط، لذلك BRIN على created_at
+# أصغر بكثير من B-tree ويخدم استعلامات النطاق الزمني بنفس الكفاءة
+# على القواعد الأخرى نعيد إنشاء فهرس B-tree عادي
+BRIN_TABLES = [
+    'activity_log',
+    'ticket_states_log',
+    'message_delivery_log',
+    'ticket_transfers_log',
+    'agent_delay_events',
+    'response_time_tracking',
+    'agent_break_sessions',
+]
+
+
+def create_created_at_indexes(apps, schema_editor):
+    quote = schema_editor.quote_name
+    is_postgres = schema_editor.connection.vendor == 'postgresql'
+    for table in BRIN_TABLES:
+        name = quote(f'{table}_ctime_brin')
+        if is_postgres:
+            schema_editor.execute(
+                f'CREATE INDEX {name} ON {quote(table)} USING brin (created_at) '
+                f'WITH (pages_per_range = 128)'
+            )
+        else:
+            schema_editor.execute(f'CREATE INDEX {name} ON {quote(table)} (created_at)')
+
+
+def drop_created_at_indexes(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for table in BRIN_TABLES:
+        name = quote(f'{table}_ctime_brin')
+        if schema_editor.connection.vendor == 'mysql':
+            schema_editor.execute(f'DROP INDEX {name} ON {quote(table)}')
+        else:
+            schema_editor.execute(f'DROP INDEX {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0025_message_wa_id_partial_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='activitylog',
+            name='activity_lo_created_8906e2_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='agentbreaksession',
+            name='agent_break_created_2afb7f_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='agentdelayevent',
+            name='agent_delay_created_2aec6b_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='messagedeliverylog',
+            name='message_del_created_702ada_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='responsetimetracking',
+            name='response_ti_created_18926b_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticketstatelog',
+            name='ticket_stat_created_69a14b_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tickettransferlog',
+            name='ticket_tran_created_88f804_idx',
+        ),
+        migrations.RunPython(create_created_at_indexes, drop_created_at_indexes),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:41
+
+from django.db import migrations
+
+
+# ✅ البحث النصي على جدول الرسائل مباشرة بدلاً من جدول message_search_index
+# PostgreSQL: فهرس GIN تعبيري على to_tsvector('simple', message_text)
+# يطابق الـ lookup "fts" في models.py
+# باقي القواعد: MessageQuerySet.search يستخدم icontains
+def add_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS msg_text_fts_gin ON messages "
+        "USING gin (to_tsvector('simple', coalesce(message_text, '')))"
+    )
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS msg_text_fts_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0027_log_tables_brin_created_at'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='MessageSearchIndex',
+        ),
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0029_message_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_ticket__a98e1c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['ticket', 'created_at'], name='msg_ticket_ctime'),
+        ),
+    ]
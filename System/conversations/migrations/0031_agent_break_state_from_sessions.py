@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:43
+
+from django.db import migrations, models
+
+
+def open_sessions_from_agent_flags(apps, schema_editor):
+    """
+    نقل حالة الاستراحة الحالية من Agent إلى جلسات مفتوحة في AgentBreakSession
+    وإغلاق أي جلسات مفتوحة مكررة قبل إضافة القيد
+    """
+    Agent = apps.get_model('conversations', 'Agent')
+    AgentBreakSession = apps.get_model('conversations', 'AgentBreakSession')
+
+    for agent in Agent.objects.filter(is_on_break=True):
+        if not AgentBreakSession.objects.filter(agent=agent, break_end_time__isnull=True).exists():
+            AgentBreakSession.objects.create(
+                agent=agent,
+                break_start_time=agent.break_started_at or agent.updated_at
+            )
+
+    # جلسات قديمة مفتوحة لموظفين ليسوا في استراحة
+    stale = AgentBreakSession.objects.filter(break_end_time__isnull=True).exclude(
+        agent__in=Agent.objects.filter(is_on_break=True)
+    )
+    for session in stale:
+        session.break_end_time = session.break_start_time
+        session.break_duration_seconds = 0
+        session.save(update_fields=['break_end_time', 'break_duration_seconds'])
+
+
+def agent_flags_from_open_sessions(apps, schema_editor):
+    Agent = apps.get_model('conversations', 'Agent')
+    AgentBreakSession = apps.get_model('conversations', 'AgentBreakSession')
+
+    for session in AgentBreakSession.objects.filter(break_end_time__isnull=True):
+        Agent.objects.filter(pk=session.agent_id).update(
+            is_on_break=True,
+            break_started_at=session.break_start_time
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0030_message_ticket_ctime_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_sessions_from_agent_flags, agent_flags_from_open_sessions),
+        migrations.RemoveField(
+            model_name='agent',
+            name='break_started_at',
+        ),
+        migrations.RemoveField(
+            model_name='agent',
+            name='is_on_break',
+        ),
+        migrations.RemoveField(
+            model_name='agent',
+            name='total_break_minutes_today',
+        ),
+        migrations.AddConstraint(
+            model_name='agentbreaksession',
+            constraint=models.UniqueConstraint(condition=models.Q(('break_end_time__isnull', True)), fields=('agent',), name='uq_agent_open_break'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:43
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_has_real_transfer(apps, schema_editor):
+    Ticket = apps.get_model('conversations', 'Ticket')
+    TicketTransferLog = apps.get_model('conversations', 'TicketTransferLog')
+
+    real_transfers = TicketTransferLog.objects.filter(
+        from_agent__isnull=False,
+        to_agent__isnull=False
+    ).exclude(
+        from_agent=F('to_agent')
+    ).values('ticket_id')
+    Ticket.objects.filter(id__in=real_transfers).update(has_real_transfer=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0031_agent_break_state_from_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='has_real_transfer',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_has_real_transfer, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0032_ticket_has_real_transfer'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='delivery_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='direction',
+            field=models.CharField(choices=[('incoming', 'Incoming'), ('outgoing', 'Outgoing')], default='outgoing', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sender_type',
+            field=models.CharField(choices=[('customer', 'Customer'), ('agent', 'Agent'), ('admin', 'Admin'), ('system', 'System')], max_length=10),
+        ),
+    ]
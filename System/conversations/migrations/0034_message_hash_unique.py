@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:46
+
+from django.db import migrations, models
+
+
+def clear_duplicate_hashes(apps, schema_editor):
+    """إزالة الـ hash من النسخ المكررة (مع الإبقاء على أقدم رسالة) قبل إضافة القيد"""
+    Message = apps.get_model('conversations', 'Message')
+    seen = set()
+    duplicates = []
+    rows = Message.objects.filter(message_hash__isnull=False).order_by('id').values_list('id', 'message_hash')
+    for pk, digest in rows:
+        digest = bytes(digest)
+        if digest in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(digest)
+    if duplicates:
+        Message.objects.filter(id__in=duplicates).update(message_hash=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0033_tighten_message_enum_widths'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_sender__1fa575_idx',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='message_hash',
+            field=models.BinaryField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender_type', 'created_at'], name='msg_sender_ctime'),
+        ),
+        migrations.RunPython(clear_duplicate_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('message_hash__isnull', False)), fields=('message_hash',), name='uq_msg_hash_notnull'),
+        ),
+    ]
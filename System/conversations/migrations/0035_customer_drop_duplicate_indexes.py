@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:48
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0034_message_hash_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='customer',
+            name='customers_phone_n_7d2329_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='customer',
+            name='customers_wa_id_cb464d_idx',
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0035_customer_drop_duplicate_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='activitylog',
+            name='activity_lo_user_id_ef3d5a_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='agentbreaksession',
+            name='agent_break_agent_i_1f08b0_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='agentdelayevent',
+            name='agent_delay_agent_i_94cc83_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='customernote',
+            name='customer_no_custome_b06835_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='customersatisfaction',
+            name='customer_sa_agent_i_38ce96_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='messagedeliverylog',
+            name='message_del_message_a8469e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='responsetimetracking',
+            name='response_ti_agent_i_2372a4_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='tickets_custome_321035_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticketstatelog',
+            name='ticket_stat_ticket__7d3037_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tickettransferlog',
+            name='ticket_tran_ticket__fbde5a_idx',
+        ),
+        migrations.AlterField(
+            model_name='agentkpi',
+            name='agent',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_kpis', to='conversations.agent'),
+        ),
+        migrations.AlterField(
+            model_name='agentkpimonthly',
+            name='agent',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='monthly_kpis', to='conversations.agent'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='ticket',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='conversations.ticket'),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='assigned_agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assigned_tickets', to='conversations.agent'),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='current_agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='current_tickets', to='conversations.agent'),
+        ),
+    ]
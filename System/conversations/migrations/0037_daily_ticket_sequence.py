@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0036_drop_redundant_fk_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTicketSequence',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('counter', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'daily_ticket_sequence',
+            },
+        ),
+    ]
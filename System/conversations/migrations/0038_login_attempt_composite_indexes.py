@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-15 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0037_daily_ticket_sequence'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='loginattempt',
+            name='login_attem_usernam_7d95c4_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='loginattempt',
+            name='login_attem_ip_addr_0a65f5_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='loginattempt',
+            name='login_attem_success_e73d81_idx',
+        ),
+        migrations.AddIndex(
+            model_name='loginattempt',
+            index=models.Index(fields=['username', '-attempt_time'], name='login_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='loginattempt',
+            index=models.Index(fields=['ip_address', '-attempt_time'], name='login_ip_time'),
+        ),
+        migrations.AddIndex(
+            model_name='loginattempt',
+            index=models.Index(condition=models.Q(('success', False)), fields=['username', 'attempt_time'], name='failed_by_user_time'),
+        ),
+    ]
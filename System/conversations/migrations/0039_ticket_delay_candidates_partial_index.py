@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-15 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0038_login_attempt_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_delayed', False), ('status', 'open')), fields=['last_customer_message_at'], name='tix_open_undelayed_cmsg'),
+        ),
+    ]
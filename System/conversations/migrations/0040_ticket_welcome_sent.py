@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def mark_welcomed_tickets(apps, schema_editor):
+    """تعليم التذاكر التي أُرسلت لها رسالة ترحيب سابقاً"""
+    Ticket = apps.get_model('conversations', 'Ticket')
+    Message = apps.get_model('conversations', 'Message')
+    welcome = Message.objects.filter(
+        ticket=OuterRef('pk'),
+        sender_type='agent',
+        message_text__contains='مرحباً بك في صيدليات خليفة'
+    )
+    Ticket.objects.filter(Exists(welcome)).update(welcome_sent=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0039_ticket_delay_candidates_partial_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='welcome_sent',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_welcomed_tickets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_customer_message_count(apps, schema_editor):
+    """حساب عدد رسائل العميل الحالية لكل تذكرة"""
+    Ticket = apps.get_model('conversations', 'Ticket')
+    Message = apps.get_model('conversations', 'Message')
+    customer_messages = Message.objects.filter(
+        ticket=OuterRef('pk'),
+        sender_type='customer'
+    ).order_by().values('ticket').annotate(total=Count('id')).values('total')
+    Ticket.objects.update(
+        customer_message_count=Coalesce(Subquery(customer_messages), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0040_ticket_welcome_sent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='customer_message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_customer_message_count, migrations.RunPython.noop),
+    ]
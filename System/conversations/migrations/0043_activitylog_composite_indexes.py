@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0041_ticket_customer_message_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['entity_type', 'entity_id', 'action', 'created_at'], name='actlog_entity_action_time'),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['user', 'action', 'created_at'], name='actlog_user_action_time'),
+        ),
+    ]
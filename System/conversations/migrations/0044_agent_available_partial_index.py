@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0043_activitylog_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agent',
+            index=models.Index(condition=models.Q(('is_online', True), ('status', 'available')), fields=['current_active_tickets', 'max_capacity'], name='agent_avail_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations
+
+
+# ✅ فهارس GIN trigram على UPPER(col::text) - نفس التعبير الذي يولده Django لـ icontains
+# على PostgreSQL (UPPER(col::text) LIKE UPPER('%x%'))، فيستخدمها المخطط مباشرة في بحث
+# العملاء والتذاكر بدلاً من المسح الكامل
+# PostgreSQL فقط - باقي القواعد تستمر بالبحث العادي
+UPPER_TRIGRAM_INDEXES = [
+    ('cust_name_utrgm', 'customers', 'name'),
+    ('cust_phone_utrgm', 'customers', 'phone_number'),
+    ('cust_email_utrgm', 'customers', 'email'),
+    ('tix_number_utrgm', 'tickets', 'ticket_number'),
+]
+
+
+def create_upper_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in UPPER_TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+        )
+
+
+def drop_upper_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in UPPER_TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0044_agent_available_partial_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_upper_trigram_indexes, drop_upper_trigram_indexes),
+    ]
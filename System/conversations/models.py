@@ -6,8 +6,8 @@ Django Models - 22 جدول
 المجموعات:
 1. User Management (3 models)
 2. Customer & Contact (3 models)
-3. Ticket Management (3 models)
-4. Messages (3 models)
+3. Ticket Management (4 models)
+4. Messages (2 models)
 5. Templates (3 models)
 6. Delay Tracking (2 models)
 7. KPI & Performance (3 models)
@@ -15,11 +15,16 @@ Django Models - 22 جدول
 9. Authentication (1 model)
 """
 
-from django.db import models
-from django.db.models import F
+from django.db import models, connections, NotSupportedError
+from django.db.models import F, Q, Case, When, Value, Exists, OuterRef, Subquery, Sum, Prefetch
+from django.db.models.functions import Greatest, Substr
 from django.contrib.auth.hashers import make_password, check_password
 from django.utils import timezone
+from django.utils.functional import cached_property
+from datetime import timedelta
 from decimal import Decimal
+import re
+import time
 
 
 # ============================================================================
@@ -63,8 +68,8 @@ class User(models.Model):
         db_table = 'users'
         indexes = [
             models.Index(fields=['role']),
-            models.Index(fields=['is_active']),
-            models.Index(fields=['is_online']),
+            # ✅ فهرس جزئي: المستخدمين المتصلين فقط
+            models.Index(fields=['role'], condition=Q(is_online=True), name='users_online_partial'),
         ]
     
     def __str__(self):
@@ -75,8 +80,15 @@ class User(models.Model):
         self.password_hash = make_password(raw_password)
     
     def check_password(self, raw_password):
-        """التحقق من كلمة المرور"""
-        return check_password(raw_password, self.password_hash)
+        """
+        التحقق من كلمة المرور
+        ✅ إعادة التشفير تلقائياً إذا تغيّر الـ hasher المفضل (مثلاً PBKDF2 -> Argon2)
+        """
+        def setter(raw_password):
+            self.set_password(raw_password)
+            User.objects.filter(pk=self.pk).update(password_hash=self.password_hash)
+
+        return check_password(raw_password, self.password_hash, setter)
 
     @property
     def is_authenticated(self):
@@ -101,9 +113,130 @@ class User(models.Model):
         return None
 
 
+class AgentQuerySet(models.QuerySet):
+    """
+    استعلامات الموظفين
+    """
+
+    def not_on_break(self):
+        """
+        استبعاد الموظفين الذين لديهم جلسة استراحة مفتوحة
+        """
+        open_break = AgentBreakSession.objects.filter(agent=OuterRef('pk'), break_end_time__isnull=True)
+        return self.filter(~Exists(open_break))
+
+    def with_break_state(self):
+        """
+        تحميل جلسة الاستراحة المفتوحة + مجموع استراحات اليوم المنتهية مسبقاً
+        (بدون N+1 عند عرض القوائم)
+        """
+        today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        closed_today = AgentBreakSession.objects.filter(
+            agent=OuterRef('pk'),
+            break_start_time__gte=today_start,
+            break_end_time__isnull=False
+        ).values('agent').annotate(total=Sum('break_duration_seconds')).values('total')
+
+        return self.prefetch_related(
+            Prefetch(
+                'break_sessions',
+                queryset=AgentBreakSession.objects.filter(break_end_time__isnull=True),
+                to_attr='open_break_sessions'
+            )
+        ).annotate(closed_break_seconds_today=Subquery(closed_today))
+
+    def with_availability(self):
+        """
+        حساب السعة المتاحة وحالة الإتاحة في قاعدة البيانات
+        (تسمح بالتصفية والترتيب: filter(is_available=True).order_by('-available_capacity'))
+        """
+        return self.annotate(
+            available_capacity=F('max_capacity') - F('current_active_tickets'),
+            is_available=Case(
+                When(
+                    is_online=True,
+                    status='available',
+                    current_active_tickets__lt=F('max_capacity'),
+                    then=Value(True)
+                ),
+                default=Value(False),
+                output_field=models.BooleanField()
+            )
+        )
+
+    def available(self):
+        """
+        الموظفون المتاحون لاستقبال تذاكر جديدة
+
+        ✅ التصفية على الأعمدة مباشرة (وليس على CASE الخاص بـ is_available) حتى يطابق
+        شرط WHERE الفهرس الجزئي agent_avail_idx - الـ annotation يبقى في SELECT فقط
+        """
+        return self.with_availability().filter(
+            is_online=True,
+            status='available',
+            current_active_tickets__lt=F('max_capacity'),
+        )
+
+    def add_active_tickets(self, deltas):
+        """
+        زيادة عداد التذاكر النشطة لعدة موظفين في UPDATE واحد
+        مع تحديث الحالة إلى busy عند الوصول للحد الأقصى (مثل Agent.adjust_active_tickets)
+
+        Args:
+            deltas: dict {agent_id: مقدار الزيادة}
+        """
+        if not deltas:
+            return 0
+        delta = Case(
+            *[When(pk=pk, then=Value(count)) for pk, count in deltas.items()],
+            default=Value(0),
+            output_field=models.IntegerField()
+        )
+        return self.filter(pk__in=deltas.keys()).update(
+            current_active_tickets=F('current_active_tickets') + delta,
+            status=Case(
+                When(current_active_tickets__gte=F('max_capacity') - delta, then=Value('busy')),
+                default=F('status'),
+            ),
+        )
+
+    def release_active_tickets(self, counts):
+        """
+        إنقاص عداد التذاكر النشطة لعدة موظفين في UPDATE واحد
+        مع إعادة busy إلى available عند النزول تحت الحد الأقصى (مثل Agent.adjust_active_tickets)
+
+        Args:
+            counts: dict {agent_id: عدد التذاكر المُغلقة/المنقولة}
+        """
+        if not counts:
+            return 0
+        delta = Case(
+            *[When(pk=pk, then=Value(count)) for pk, count in counts.items()],
+            default=Value(0),
+            output_field=models.IntegerField()
+        )
+        return self.filter(pk__in=counts.keys()).update(
+            current_active_tickets=Greatest(F('current_active_tickets') - delta, Value(0)),
+            status=Case(
+                When(status='busy', current_active_tickets__lt=F('max_capacity') + delta, then=Value('available')),
+                default=F('status'),
+            ),
+        )
+
+
+class AgentManager(models.Manager.from_queryset(AgentQuerySet)):
+    """
+    ✅ يحمّل user مسبقاً (يستخدمه __str__) لتجنب استعلام لكل صف
+    """
+    def get_queryset(self):
+        return super().get_queryset().select_related('user')
+
+
 class Agent(models.Model):
     """
     بيانات الموظفين (Agents)
+
+    ✅ حالة الاستراحة مشتقة من AgentBreakSession (مصدر الحقيقة الوحيد)
     """
     STATUS_CHOICES = [
         ('available', 'Available'),
@@ -118,11 +251,6 @@ class Agent(models.Model):
     is_online = models.BooleanField(default=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='offline')
 
-    # Break Tracking
-    is_on_break = models.BooleanField(default=False)  # هل الموظف في استراحة؟
-    break_started_at = models.DateTimeField(null=True, blank=True)  # متى بدأت الاستراحة
-    total_break_minutes_today = models.IntegerField(default=0)  # إجمالي دقائق الاستراحة اليوم
-
     # Counters
     total_messages_sent = models.IntegerField(default=0)
     total_messages_received = models.IntegerField(default=0)
@@ -137,18 +265,129 @@ class Agent(models.Model):
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = AgentManager()
     
     class Meta:
         db_table = 'agents'
         indexes = [
             models.Index(fields=['status']),
-            models.Index(fields=['is_online']),
             models.Index(fields=['current_active_tickets']),
+            # ✅ فهرس جزئي: الموظفين المتصلين فقط
+            models.Index(fields=['status'], condition=Q(is_online=True), name='agent_online_partial'),
+            # ✅ فهرس جزئي: المرشحون لاستقبال تذاكر (available / claim_available_agent)
+            models.Index(
+                fields=['current_active_tickets', 'max_capacity'],
+                condition=Q(is_online=True, status='available'),
+                name='agent_avail_idx'
+            ),
         ]
     
     def __str__(self):
         return f"Agent: {self.user.full_name}"
 
+    # ==================== Break Tracking ====================
+
+    @cached_property
+    def current_break(self):
+        """
+        جلسة الاستراحة المفتوحة حالياً (أو None)
+        """
+        if hasattr(self, 'open_break_sessions'):
+            return self.open_break_sessions[0] if self.open_break_sessions else None
+        return self.break_sessions.filter(break_end_time__isnull=True).first()
+
+    @property
+    def is_on_break(self):
+        """هل الموظف في استراحة؟"""
+        return self.current_break is not None
+
+    @property
+    def break_started_at(self):
+        """متى بدأت الاستراحة الحالية"""
+        current = self.current_break
+        return current.break_start_time if current else None
+
+    @property
+    def total_break_minutes_today(self):
+        """
+        إجمالي دقائق الاستراحة اليوم (الجلسات المنتهية + الجلسة الحالية)
+        """
+        today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        if hasattr(self, 'closed_break_seconds_today'):
+            # محسوب مسبقاً عبر with_break_state()
+            seconds = self.closed_break_seconds_today or 0
+        else:
+            seconds = self.break_sessions.filter(
+                break_start_time__gte=today_start,
+                break_end_time__isnull=False
+            ).aggregate(total=Sum('break_duration_seconds'))['total'] or 0
+
+        current = self.current_break
+        if current and current.break_start_time >= today_start:
+            seconds += int((timezone.now() - current.break_start_time).total_seconds())
+
+        return int(seconds / 60)
+
+    def start_break(self):
+        """
+        بدء استراحة جديدة (إنشاء جلسة مفتوحة)
+        """
+        session = AgentBreakSession.objects.create(agent=self, break_start_time=timezone.now())
+        self.__dict__['current_break'] = session
+        return session
+
+    def end_break(self):
+        """
+        إنهاء الاستراحة الحالية وحساب مدتها
+
+        Returns:
+            AgentBreakSession المنتهية أو None إذا لم يكن في استراحة
+        """
+        session = self.current_break
+        if session is None:
+            return None
+
+        now = timezone.now()
+        session.break_end_time = now
+        session.break_duration_seconds = int((now - session.break_start_time).total_seconds())
+        session.save(update_fields=['break_end_time', 'break_duration_seconds'])
+        self.__dict__['current_break'] = None
+        return session
+
+    def adjust_active_tickets(self, delta=1):
+        """
+        تعديل عداد التذاكر النشطة ذرياً (UPDATE ... SET x = x + delta)
+        مع تحديث الحالة busy/available في نفس الاستعلام
+
+        Args:
+            delta: مقدار التغيير (موجب للزيادة، سالب للنقصان)
+        """
+        if delta >= 0:
+            # الوصول للحد الأقصى => busy
+            new_status = Case(
+                When(current_active_tickets__gte=F('max_capacity') - delta, then=Value('busy')),
+                default=F('status'),
+            )
+        else:
+            # النزول تحت الحد الأقصى => available (فقط إذا كان busy)
+            new_status = Case(
+                When(status='busy', current_active_tickets__lt=F('max_capacity') - delta, then=Value('available')),
+                default=F('status'),
+            )
+
+        Agent.objects.filter(pk=self.pk).update(
+            current_active_tickets=Greatest(F('current_active_tickets') + delta, Value(0)),
+            status=new_status,
+        )
+
+        # تحديث النسخة الموجودة في الذاكرة بدون استعلام إضافي
+        self.current_active_tickets = max(0, self.current_active_tickets + delta)
+        if delta >= 0 and self.current_active_tickets >= self.max_capacity:
+            self.status = 'busy'
+        elif delta < 0 and self.status == 'busy' and self.current_active_tickets < self.max_capacity:
+            self.status = 'available'
+
 
 class Admin(models.Model):
     """
@@ -212,14 +451,35 @@ class Customer(models.Model):
     class Meta:
         db_table = 'customers'
         indexes = [
-            models.Index(fields=['phone_number']),
-            models.Index(fields=['wa_id']),
+            # phone_number و wa_id مفهرسان عبر unique=True (لا حاجة لفهرس مكرر)
             models.Index(fields=['customer_type']),
+            # ✅ فهرس جزئي: العملاء المحظورين فقط
+            models.Index(fields=['phone_number'], condition=Q(is_blocked=True), name='cust_blocked_partial'),
         ]
     
     def __str__(self):
         return f"{self.name or self.phone_number}"
 
+    def increment_tickets_count(self):
+        """
+        زيادة عداد التذاكر ذرياً وتحديث آخر تواصل
+        """
+        now = timezone.now()
+        Customer.objects.filter(pk=self.pk).update(
+            total_tickets_count=F('total_tickets_count') + 1,
+            last_contact_date=now,
+        )
+        self.total_tickets_count += 1
+        self.last_contact_date = now
+
+
+class CustomerTagManager(models.Manager):
+    """
+    ✅ يحمّل customer مسبقاً (يستخدمه __str__)
+    """
+    def get_queryset(self):
+        return super().get_queryset().select_related('customer')
+
 
 class CustomerTag(models.Model):
     """
@@ -229,6 +489,8 @@ class CustomerTag(models.Model):
     tag = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = CustomerTagManager()
+
     class Meta:
         db_table = 'customer_tags'
         unique_together = [['customer', 'tag']]
@@ -256,7 +518,6 @@ class CustomerNote(models.Model):
     class Meta:
         db_table = 'customer_notes'
         indexes = [
-            models.Index(fields=['customer']),
             models.Index(fields=['created_at']),
         ]
     
@@ -265,7 +526,7 @@ class CustomerNote(models.Model):
 
 
 # ============================================================================
-# GROUP 3: TICKET MANAGEMENT (3 Models)
+# GROUP 3: TICKET MANAGEMENT (4 Models)
 # ============================================================================
 
 class Ticket(models.Model):
@@ -285,6 +546,15 @@ class Ticket(models.Model):
         ('follow_up', 'Follow Up'),
         ('general', 'General'),
     ]
+
+    # ✅ ترجمة الأنواع للعربية (ثابت على مستوى الكلاس بدلاً من بنائه مع كل استدعاء)
+    CATEGORY_ARABIC = {
+        'medicine_order': 'ادوية',
+        'complaint': 'شكوى',
+        'consultation': 'استشارة',
+        'follow_up': 'متابعة',
+        'general': 'عام',
+    }
     
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -295,8 +565,9 @@ class Ticket(models.Model):
     
     ticket_number = models.CharField(max_length=20, unique=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='tickets')
-    assigned_agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_tickets')
-    current_agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='current_tickets')
+    # db_index=False: الفهارس المركبة tix_assigned_status_ctime / tix_current_status_ctime تبدأ بالعمود نفسه
+    assigned_agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_tickets', db_index=False)
+    current_agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='current_tickets', db_index=False)
     
     # Status & Category
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
@@ -322,6 +593,9 @@ class Ticket(models.Model):
     response_time_seconds = models.IntegerField(null=True, blank=True)
     handling_time_seconds = models.IntegerField(null=True, blank=True)
     messages_count = models.IntegerField(default=0)
+    customer_message_count = models.IntegerField(default=0)  # ✅ رسائل العميل فقط (بدلاً من COUNT عند كل رسالة واردة)
+    has_real_transfer = models.BooleanField(default=False)  # ✅ نقل فعلي بين موظفين مختلفين (يُحدّث من TicketTransferLog.save)
+    welcome_sent = models.BooleanField(default=False)  # ✅ تم إرسال رسالة الترحيب (بدلاً من البحث بـ LIKE في نص الرسائل)
     
     # Closure Info
     closed_by_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='closed_tickets')
@@ -332,12 +606,29 @@ class Ticket(models.Model):
     class Meta:
         db_table = 'tickets'
         indexes = [
-            models.Index(fields=['status']),
-            models.Index(fields=['assigned_agent']),
-            models.Index(fields=['customer']),
             models.Index(fields=['created_at']),
-            models.Index(fields=['is_delayed']),
-            models.Index(fields=['assigned_agent', 'status']),
+            # ✅ فهرس جزئي: التذاكر المتأخرة فقط
+            models.Index(fields=['created_at'], condition=Q(is_delayed=True), name='tix_delayed_partial'),
+            # ✅ فهرس جزئي: مرشحو التأخير (مفتوحة وغير متأخرة) - انظر utils.bulk_update_delay_status
+            models.Index(
+                fields=['last_customer_message_at'],
+                condition=Q(status='open', is_delayed=False),
+                name='tix_open_undelayed_cmsg',
+            ),
+            # ✅ فهارس مركبة لقائمة تذاكر الموظف (مرتبة بدون sort)
+            # include يجعلها covering على PostgreSQL ويتم تجاهله على باقي القواعد
+            models.Index(
+                fields=['assigned_agent', 'status', '-created_at'],
+                include=['priority', 'category', 'last_message_at'],
+                name='tix_assigned_status_ctime',
+            ),
+            models.Index(
+                fields=['current_agent', 'status', '-created_at'],
+                include=['priority', 'category', 'last_message_at'],
+                name='tix_current_status_ctime',
+            ),
+            # ✅ تذاكر عميل محدد (?customer= في قائمة التذاكر ومحادثة العميل) مرتبة بدون sort
+            models.Index(fields=['customer', '-created_at'], name='tix_customer_ctime'),
         ]
     
     def __str__(self):
@@ -347,29 +638,35 @@ class Ticket(models.Model):
         """
         عرض نوع التذكرة بالعربية
         """
-        category_map = {
-            'medicine_order': 'ادوية',
-            'complaint': 'شكوى',
-            'consultation': 'استشارة',
-            'follow_up': 'متابعة',
-            'general': 'عام',
-        }
-        return category_map.get(self.category, self.category)
+        return self.CATEGORY_ARABIC.get(self.category, self.category)
     
     get_category_arabic.short_description = 'النوع'
-    
-    @property
-    def has_real_transfer(self):
+
+    def increment_messages_count(self, from_customer=False, count=1, **timestamps):
         """
-        Check if ticket has real transfers between different agents
-        (excluding transfers from None/system)
+        زيادة عداد الرسائل ذرياً مع تحديث حقول الوقت الممررة
+        (مثل last_message_at / last_customer_message_at)
+
+        from_customer: زيادة customer_message_count أيضاً في نفس الـ UPDATE
+        count: عدد الرسائل (أكثر من 1 عند الإدراج دفعة واحدة)
         """
-        return self.transfers.filter(
-            from_agent__isnull=False,
-            to_agent__isnull=False
-        ).exclude(
-            from_agent=F('to_agent')
-        ).exists()
+        counters = {'messages_count': F('messages_count') + count}
+        if from_customer:
+            counters['customer_message_count'] = F('customer_message_count') + count
+        Ticket.objects.filter(pk=self.pk).update(**counters, **timestamps)
+        self.messages_count += count
+        if from_customer:
+            self.customer_message_count += count
+        for field, value in timestamps.items():
+            setattr(self, field, value)
+
+
+class TicketTransferLogManager(models.Manager):
+    """
+    ✅ يحمّل ticket مسبقاً (يستخدمه __str__)
+    """
+    def get_queryset(self):
+        return super().get_queryset().select_related('ticket')
 
 
 class TicketTransferLog(models.Model):
@@ -383,16 +680,30 @@ class TicketTransferLog(models.Model):
     reason = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TicketTransferLogManager()
+
     class Meta:
         db_table = 'ticket_transfers_log'
-        indexes = [
-            models.Index(fields=['ticket']),
-            models.Index(fields=['created_at']),
-        ]
+        # ✅ فهرس BRIN على created_at (PostgreSQL) - انظر migration 0027
 
     def __str__(self):
         return f"Transfer: Ticket #{self.ticket.ticket_number}"
 
+    @property
+    def is_real_transfer(self):
+        """نقل بين موظفين مختلفين (ليس من النظام ولا لنفس الموظف)"""
+        return bool(self.from_agent_id and self.to_agent_id and self.from_agent_id != self.to_agent_id)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        # ✅ تحديث العلم المخزن في التذكرة (مرة واحدة فقط)
+        if self.is_real_transfer:
+            Ticket.objects.filter(pk=self.ticket_id, has_real_transfer=False).update(has_real_transfer=True)
+            # مزامنة نسخة التذكرة في الذاكرة حتى لا يعيد save() لاحق القيمة القديمة
+            if TicketTransferLog.ticket.is_cached(self):
+                self.ticket.has_real_transfer = True
+
 
 class TicketStateLog(models.Model):
     """
@@ -407,19 +718,97 @@ class TicketStateLog(models.Model):
 
     class Meta:
         db_table = 'ticket_states_log'
-        indexes = [
-            models.Index(fields=['ticket']),
-            models.Index(fields=['created_at']),
-        ]
+        # ✅ فهرس BRIN على created_at (PostgreSQL) - انظر migration 0027
 
     def __str__(self):
         return f"{self.old_state} → {self.new_state}"
 
 
+class DailyTicketSequence(models.Model):
+    """
+    عداد أرقام التذاكر اليومي (صف واحد لكل يوم)
+    يُزاد ذرياً عند توليد رقم تذكرة جديد - انظر utils.generate_ticket_number
+    """
+    date = models.DateField(primary_key=True)
+    counter = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'daily_ticket_sequence'
+
+    def __str__(self):
+        return f"{self.date}: {self.counter}"
+
+
 # ============================================================================
-# GROUP 4: MESSAGES (3 Models)
+# GROUP 4: MESSAGES (2 Models)
 # ============================================================================
 
+@models.TextField.register_lookup
+class FullTextMatch(models.Lookup):
+    """
+    بحث نصي كامل (PostgreSQL فقط):
+    to_tsvector('simple', col) @@ to_tsquery('simple', value)
+    value نص tsquery جاهز (انظر MessageQuerySet.search)
+    يطابق فهرس GIN التعبيري msg_text_fts_gin - انظر migration 0029
+    """
+    lookup_name = 'fts'
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError('The "fts" lookup is only supported on PostgreSQL.')
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        sql = f"to_tsvector('simple', coalesce({lhs}, '')) @@ to_tsquery('simple', {rhs})"
+        return sql, lhs_params + rhs_params
+
+
+class MessageQuerySet(models.QuerySet):
+    """
+    استعلامات الرسائل
+    """
+
+    def search(self, text):
+        """
+        بحث نصي في الرسائل
+        PostgreSQL: full-text عبر فهرس GIN - كل كلمة كبادئة (paracet يطابق paracetamol،
+        وبداية الرقم تطابق الرقم كاملاً) لكن ليس من منتصف الكلمة
+        باقي القواعد: icontains
+        """
+        if connections[self.db].vendor == 'postgresql':
+            # الكلمات فقط (بدون رموز tsquery مثل & | ! :) - كل كلمة بادئة: word:*
+            words = re.findall(r'\w+', text)
+            if words:
+                return self.filter(message_text__fts=' & '.join(f'{word}:*' for word in words))
+        return self.filter(message_text__icontains=text)
+
+    def for_list(self, preview_length=100):
+        """
+        أعمدة قوائم المحادثات فقط + معاينة مختصرة للنص (preview)
+        بدلاً من تحميل message_text / error_message كاملة
+        """
+        return self.only(
+            'id', 'ticket_id', 'sender_type', 'message_type', 'delivery_status', 'created_at'
+        ).annotate(preview=Substr('message_text', 1, preview_length))
+
+    def with_sender_name(self):
+        """
+        اسم المرسل محسوب في قاعدة البيانات (sender_name)
+        العميل: الاسم أو رقم الهاتف / الموظف: الاسم الكامل / النظام: 'النظام'
+        """
+        has_customer_name = Q(ticket__customer__name__isnull=False) & ~Q(ticket__customer__name='')
+        return self.annotate(
+            sender_name=Case(
+                When(Q(sender_type='customer') & has_customer_name, then=F('ticket__customer__name')),
+                When(sender_type='customer', then=F('ticket__customer__phone_number')),
+                When(sender_type='agent', sender__isnull=False, then=F('sender__full_name')),
+                When(sender_type='system', then=Value('النظام')),
+                default=Value('Unknown'),
+                output_field=models.CharField()
+            )
+        )
+
+
 class Message(models.Model):
     """
     الرسائل
@@ -458,21 +847,21 @@ class Message(models.Model):
         ('outgoing', 'Outgoing'),  # من الموظف
     ]
 
-    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='messages')
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='messages', db_index=False)  # مغطى بـ msg_ticket_ctime
     sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
-    sender_type = models.CharField(max_length=50, choices=SENDER_TYPE_CHOICES)
-    direction = models.CharField(max_length=50, choices=DIRECTION_CHOICES, default='outgoing')
+    sender_type = models.CharField(max_length=10, choices=SENDER_TYPE_CHOICES)
+    direction = models.CharField(max_length=10, choices=DIRECTION_CHOICES, default='outgoing')
     message_text = models.TextField(null=True, blank=True)
     message_type = models.CharField(max_length=50, choices=MESSAGE_TYPE_CHOICES, default='text')
     media_url = models.CharField(max_length=500, null=True, blank=True)
     mime_type = models.CharField(max_length=100, null=True, blank=True)
 
     # WhatsApp Integration (المرحلة 2)
-    whatsapp_message_id = models.CharField(max_length=100, null=True, blank=True, unique=True)
-    delivery_status = models.CharField(max_length=50, choices=WHATSAPP_STATUS_CHOICES, default='pending')  # ✅ الافتراضي pending
+    whatsapp_message_id = models.CharField(max_length=100, null=True, blank=True)  # unique جزئي في Meta.constraints
+    delivery_status = models.CharField(max_length=20, choices=WHATSAPP_STATUS_CHOICES, default='pending')  # ✅ الافتراضي pending
     
     # ✅ Deduplication & Queue Management
-    message_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)  # SHA256 hash لمنع التكرار
+    message_hash = models.BinaryField(max_length=32, null=True, blank=True)  # SHA256 digest (32 بايت) لمنع التكرار - unique جزئي في Meta
     retry_count = models.IntegerField(default=0)  # عدد محاولات الإرسال
     last_retry_at = models.DateTimeField(null=True, blank=True)  # آخر محاولة
     error_message = models.TextField(null=True, blank=True)  # رسالة الخطأ
@@ -488,14 +877,37 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = MessageQuerySet.as_manager()
+
     class Meta:
         db_table = 'messages'
+        # ملاحظة: لم يتم تقسيم الجدول (PARTITION BY RANGE created_at) لأن ذلك يتطلب
+        # مفتاح أساسي مركب (id, created_at) غير مدعوم في Django 4.2، ويمنع المفتاح
+        # الأجنبي من message_delivery_log وقيد unique على whatsapp_message_id.
+        # استعلامات النطاق الزمني تعتمد على فهرس created_at الحالي.
         indexes = [
-            models.Index(fields=['ticket']),
-            models.Index(fields=['sender_type']),
+            # ✅ رسائل نوع مرسل معين مرتبة زمنياً (يغني عن فهرس sender_type المنفرد)
+            models.Index(fields=['sender_type', 'created_at'], name='msg_sender_ctime'),
             models.Index(fields=['created_at']),
-            models.Index(fields=['whatsapp_message_id']),
-            models.Index(fields=['is_read']),
+            # ✅ محادثة التذكرة مرتبة زمنياً بدون sort
+            models.Index(fields=['ticket', 'created_at'], name='msg_ticket_ctime'),
+            # ✅ فهرس جزئي: الرسائل غير المقروءة لكل تذكرة
+            models.Index(fields=['ticket', 'created_at'], condition=Q(is_read=False), name='msg_unread_partial'),
+        ]
+        # ✅ فهرس GIN على to_tsvector(message_text) (PostgreSQL) - انظر migration 0029
+        constraints = [
+            # ✅ unique جزئي على القيم غير الفارغة فقط (يغني عن الفهرس العادي)
+            models.UniqueConstraint(
+                fields=['whatsapp_message_id'],
+                condition=Q(whatsapp_message_id__isnull=False),
+                name='uq_wa_msg_id_notnull',
+            ),
+            # ✅ منع التكرار على مستوى قاعدة البيانات بدلاً من استعلام SELECT قبل كل INSERT
+            models.UniqueConstraint(
+                fields=['message_hash'],
+                condition=Q(message_hash__isnull=False),
+                name='uq_msg_hash_notnull',
+            ),
         ]
 
     def __str__(self):
@@ -521,34 +933,12 @@ class MessageDeliveryLog(models.Model):
 
     class Meta:
         db_table = 'message_delivery_log'
-        indexes = [
-            models.Index(fields=['message']),
-            models.Index(fields=['created_at']),
-        ]
+        # ✅ فهرس BRIN على created_at (PostgreSQL) - انظر migration 0027
 
     def __str__(self):
         return f"{self.delivery_status}"
 
 
-class MessageSearchIndex(models.Model):
-    """
-    فهرس البحث في الرسائل
-    """
-    message = models.ForeignKey(Message, on_delete=models.CASCADE)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
-    search_text = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
-
-    class Meta:
-        db_table = 'message_search_index'
-        indexes = [
-            models.Index(fields=['customer']),
-        ]
-
-    def __str__(self):
-        return f"Search index for message #{self.message.id}"
-
-
 # ============================================================================
 # GROUP 5: TEMPLATES & QUICK REPLIES (3 Models)
 # ============================================================================
@@ -578,15 +968,23 @@ class GlobalTemplate(models.Model):
     class Meta:
         db_table = 'global_templates'
         indexes = [
-            models.Index(fields=['is_active']),
             models.Index(fields=['category']),
             models.Index(fields=['priority']),
+            models.Index(fields=['category'], condition=Q(is_active=True), name='gtpl_active_partial'),
         ]
 
     def __str__(self):
         return self.name
 
 
+class AgentTemplateManager(models.Manager):
+    """
+    ✅ يحمّل agent و user مسبقاً (يستخدمهما __str__)
+    """
+    def get_queryset(self):
+        return super().get_queryset().select_related('agent__user')
+
+
 class AgentTemplate(models.Model):
     """
     قوالب الموظفين (خاصة بكل موظف)
@@ -602,11 +1000,13 @@ class AgentTemplate(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = AgentTemplateManager()
+
     class Meta:
         db_table = 'agent_templates'
         unique_together = [['agent', 'name']]
         indexes = [
-            models.Index(fields=['is_active']),
+            models.Index(fields=['agent'], condition=Q(is_active=True), name='atpl_active_partial'),
         ]
 
     def __str__(self):
@@ -637,8 +1037,8 @@ class AutoReplyTrigger(models.Model):
     class Meta:
         db_table = 'auto_reply_triggers'
         indexes = [
-            models.Index(fields=['is_active']),
             models.Index(fields=['trigger_keyword']),
+            models.Index(fields=['trigger_keyword'], condition=Q(is_active=True), name='trigger_active_partial'),
         ]
 
     def __str__(self):
@@ -664,10 +1064,9 @@ class ResponseTimeTracking(models.Model):
     class Meta:
         db_table = 'response_time_tracking'
         indexes = [
-            models.Index(fields=['agent']),
             models.Index(fields=['is_delayed']),
-            models.Index(fields=['created_at']),
         ]
+        # ✅ فهرس BRIN على created_at (PostgreSQL) - انظر migration 0027
 
     def __str__(self):
         return f"Response tracking for Ticket #{self.ticket.ticket_number}"
@@ -687,10 +1086,7 @@ class AgentDelayEvent(models.Model):
 
     class Meta:
         db_table = 'agent_delay_events'
-        indexes = [
-            models.Index(fields=['agent']),
-            models.Index(fields=['created_at']),
-        ]
+        # ✅ فهرس BRIN على created_at (PostgreSQL) - انظر migration 0027
 
     def __str__(self):
         return f"Delay event for {self.agent.user.full_name}"
@@ -714,9 +1110,16 @@ class AgentBreakSession(models.Model):
     class Meta:
         db_table = 'agent_break_sessions'
         indexes = [
-            models.Index(fields=['agent']),
             models.Index(fields=['break_start_time']),
-            models.Index(fields=['created_at']),
+        ]
+        # ✅ فهرس BRIN على created_at (PostgreSQL) - انظر migration 0027
+        constraints = [
+            # ✅ جلسة استراحة مفتوحة واحدة فقط لكل موظف
+            models.UniqueConstraint(
+                fields=['agent'],
+                condition=Q(break_end_time__isnull=True),
+                name='uq_agent_open_break',
+            ),
         ]
 
     def __str__(self):
@@ -731,7 +1134,7 @@ class AgentKPI(models.Model):
     """
     مؤشرات أداء الموظفين (يومي)
     """
-    agent = models.ForeignKey(Agent, on_delete=models.CASCADE, related_name='daily_kpis')
+    agent = models.ForeignKey(Agent, on_delete=models.CASCADE, related_name='daily_kpis', db_index=False)  # مغطى بـ unique_together
     kpi_date = models.DateField()
 
     # Metrics
@@ -771,7 +1174,7 @@ class AgentKPIMonthly(models.Model):
     """
     مؤشرات أداء الموظفين (شهري)
     """
-    agent = models.ForeignKey(Agent, on_delete=models.CASCADE, related_name='monthly_kpis')
+    agent = models.ForeignKey(Agent, on_delete=models.CASCADE, related_name='monthly_kpis', db_index=False)  # مغطى بـ unique_together
     month = models.DateField()  # First day of month
 
     # Metrics
@@ -815,7 +1218,6 @@ class CustomerSatisfaction(models.Model):
     class Meta:
         db_table = 'customer_satisfaction'
         indexes = [
-            models.Index(fields=['agent']),
             models.Index(fields=['rating']),
         ]
 
@@ -844,13 +1246,17 @@ class ActivityLog(models.Model):
     class Meta:
         db_table = 'activity_log'
         indexes = [
-            models.Index(fields=['user']),
             models.Index(fields=['action']),
-            models.Index(fields=['created_at']),
+            # ✅ مراقبة الموظفين (activity_list): استراحات/خروج إجباري لكيان + نطاق زمني
+            models.Index(fields=['entity_type', 'entity_id', 'action', 'created_at'], name='actlog_entity_action_time'),
+            # ✅ دخول/خروج مستخدم + نطاق زمني
+            models.Index(fields=['user', 'action', 'created_at'], name='actlog_user_action_time'),
         ]
+        # ✅ فهرس BRIN على created_at (PostgreSQL) - انظر migration 0027
 
     def __str__(self):
-        return f"{self.action} by {self.user.username if self.user else 'System'}"
+        # user_id بدلاً من self.user لتجنب استعلام عند غياب المستخدم
+        return f"{self.action} by {self.user.username if self.user_id else 'System'}"
 
 
 # ============================================================================
@@ -870,15 +1276,76 @@ class LoginAttempt(models.Model):
     class Meta:
         db_table = 'login_attempts'
         indexes = [
-            models.Index(fields=['username']),
-            models.Index(fields=['ip_address']),
+            # ✅ فحص Brute Force: آخر المحاولات لمستخدم / IP مرتبة زمنياً
+            models.Index(fields=['username', '-attempt_time'], name='login_user_time'),
+            models.Index(fields=['ip_address', '-attempt_time'], name='login_ip_time'),
+            # ✅ فهرس جزئي: المحاولات الفاشلة فقط (استعلام القفل بعد 5 محاولات)
+            models.Index(fields=['username', 'attempt_time'], condition=Q(success=False), name='failed_by_user_time'),
             models.Index(fields=['attempt_time']),
-            models.Index(fields=['success']),
         ]
 
+    _STATUS_LABEL = {True: 'Success', False: 'Failed'}
+
     def __str__(self):
-        status = "Success" if self.success else "Failed"
-        return f"{status} login attempt: {self.username}"
+        return f"{self._STATUS_LABEL[self.success]} login attempt: {self.username}"
+
+    # ✅ مع REDIS_URL: عدّاد مشترك بين كل العمليات (login_fail:<username>) يُزاد بـ INCR ذري
+    # وينتهي بعد نافذة القفل - بدون استعلام COUNT في كل محاولة دخول
+    # بدونه (LocMemCache لكل عملية) العد من قاعدة البيانات: عدّاد لكل عملية يسمح بمحاولات أكثر من الحد
+    LOCKOUT_WINDOW_MINUTES = 15
+
+    @staticmethod
+    def _failed_count_key(username):
+        return f'login_fail:{username}'
+
+    @staticmethod
+    def _uses_shared_cache():
+        from django.conf import settings
+        return bool(getattr(settings, 'REDIS_URL', ''))
+
+    @classmethod
+    def recent_failed_count(cls, username, minutes=LOCKOUT_WINDOW_MINUTES):
+        """
+        عدد المحاولات الفاشلة للمستخدم خلال آخر X دقيقة
+        ✅ من عدّاد Redis إن كان مضبوطاً (النافذة = LOCKOUT_WINDOW_MINUTES من أول فشل)
+        ✅ وإلا COUNT واحد يستخدم الفهرس الجزئي failed_by_user_time
+        """
+        if cls._uses_shared_cache():
+            from django.core.cache import cache
+            return cache.get(cls._failed_count_key(username), 0)
+
+        window_start = timezone.now() - timedelta(minutes=minutes)
+        return cls.objects.filter(
+            username=username,
+            success=False,
+            attempt_time__gte=window_start
+        ).count()
+
+    @classmethod
+    def record(cls, username, ip_address, user_agent, success):
+        """
+        تسجيل محاولة دخول (للتدقيق) مع تحديث عدّاد الفشل في Redis إن كان مضبوطاً
+        """
+        attempt = cls.objects.create(
+            username=username,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            success=success
+        )
+        if cls._uses_shared_cache():
+            from django.core.cache import cache
+            key = cls._failed_count_key(username)
+            if success:
+                cache.delete(key)
+            else:
+                # add لا يكتب إذا كان المفتاح موجوداً - المهلة تبدأ من أول فشل
+                cache.add(key, 0, cls.LOCKOUT_WINDOW_MINUTES * 60)
+                try:
+                    cache.incr(key)
+                except ValueError:
+                    # انتهت مهلة المفتاح بين add و incr
+                    cache.set(key, 1, cls.LOCKOUT_WINDOW_MINUTES * 60)
+        return attempt
 
 
 # ============================================================================
@@ -935,23 +1402,62 @@ class SystemSettings(models.Model):
     def __str__(self):
         return f"System Settings (Updated: {self.updated_at})"
     
+    CACHE_KEY = 'system_settings'
+    # ✅ مدة قصيرة: save() يمسح الـ cache في العملية الحالية فقط ما لم يكن REDIS_URL مضبوطاً
+    # فالعمليات الأخرى ترى التعديل خلال دقيقة على الأكثر
+    CACHE_TIMEOUT = 60  # ثانية
+    PROCESS_CACHE_TTL = 30  # ثانية
+    _process_cache = (None, 0.0)  # (settings, expires_at)
+    
     @classmethod
     def get_settings(cls):
         """
         الحصول على الإعدادات (Singleton Pattern)
         
+        ✅ نسخة في ذاكرة العملية لمدة PROCESS_CACHE_TTL ثم الـ Cache - يتم مسحهما عند الحفظ
+        
         Returns:
             SystemSettings object
         """
-        settings, created = cls.objects.get_or_create(id=1)
+        from django.core.cache import cache
+        
+        settings, expires_at = cls._process_cache
+        if settings is not None and time.monotonic() < expires_at:
+            return settings
+        
+        settings = cache.get(cls.CACHE_KEY)
+        if settings is None:
+            settings, created = cls.objects.get_or_create(id=1)
+            cache.set(cls.CACHE_KEY, settings, cls.CACHE_TIMEOUT)
+        cls._process_cache = (settings, time.monotonic() + cls.PROCESS_CACHE_TTL)
         return settings
     
     def save(self, *args, **kwargs):
         """
         تأكد من وجود سجل واحد فقط (Singleton)
         """
+        from django.core.cache import cache
+        
         self.id = 1
+        # ✅ لا كتابة ولا مسح للـ cache إذا لم يتغير أي حقل (إعادة إرسال نفس النموذج)
+        if not self._has_changes():
+            return
         super().save(*args, **kwargs)
+        cache.delete(self.CACHE_KEY)
+        SystemSettings._process_cache = (None, 0.0)
+
+    def _has_changes(self):
+        """
+        مقارنة القيم الحالية بالسجل المحفوظ (عدا updated_at)
+        """
+        current = type(self).objects.filter(id=self.id).first()
+        if current is None:
+            return True
+        return any(
+            getattr(current, field.attname) != getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.name != 'updated_at'
+        )
     
     def delete(self, *args, **kwargs):
         """
@@ -0,0 +1,25 @@
+"""
+Renderers
+محوّلات استجابات DRF
+
+✅ ترميز JSON عبر orjson (C) بدلاً من json القياسي - أسرع على الردود العربية الكبيرة
+"""
+
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer يستخدم orjson للترميز
+
+    التواريخ وباقي الأنواع غير الأساسية تمر على JSONEncoder الخاص بـ DRF
+    للحفاظ على نفس شكل المخرجات.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=JSONEncoder().default, option=self.options)
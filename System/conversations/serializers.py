@@ -6,32 +6,76 @@ Django REST Framework Serializers
 المجموعات:
 1. User Management (3 serializers)
 2. Customer & Contact (3 serializers)
-3. Ticket Management (3 serializers)
+3. Ticket Management (5 serializers)
 4. Messages (3 serializers)
 5. Templates (3 serializers)
 6. Delay Tracking (2 serializers)
-7. KPI & Performance (3 serializers)
+7. KPI & Performance (4 serializers)
 8. Activity Log (1 serializer)
 9. Authentication (1 serializer)
 """
 
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
 from .models import (
     User, Agent, Admin,
     Customer, CustomerTag, CustomerNote,
     Ticket, TicketTransferLog, TicketStateLog,
-    Message, MessageDeliveryLog, MessageSearchIndex,
+    Message, MessageDeliveryLog,
     GlobalTemplate, AgentTemplate, AutoReplyTrigger,
     ResponseTimeTracking, AgentDelayEvent,
     AgentKPI, AgentKPIMonthly, CustomerSatisfaction,
     ActivityLog, LoginAttempt, SystemSettings
 )
+from .utils import NON_DIGITS_RE
+
+
+def _serialization_now(serializer):
+    """
+    وقت ثابت لكل عملية serialization (يُحسب مرة واحدة ويُحفظ في الـ context)
+    بدلاً من استدعاء timezone.now() لكل صف في القوائم
+    """
+    context = serializer.context
+    now = context.get('_now')
+    if now is None:
+        now = timezone.now()
+        context['_now'] = now
+    return now
 
 
 # ============================================================================
 # GROUP 1: USER MANAGEMENT SERIALIZERS (3)
 # ============================================================================
 
+class RoleCheckedPKField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField لمستخدم بدور محدد (agent / admin)
+
+    ✅ يتحقق من الدور في Python بعد جلب المستخدم بالمفتاح الأساسي،
+    ويحفظ المستخدمين في الـ context لتجنب تكرار الاستعلام عند many=True
+    """
+    default_error_messages = {
+        'wrong_role': 'المستخدم "{pk_value}" ليس بدور {role}.',
+    }
+
+    def __init__(self, role, **kwargs):
+        self.role = role
+        kwargs.setdefault('queryset', User.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        users = self.context.setdefault('_users_by_pk', {})
+        key = str(data)
+        if key not in users:
+            users[key] = super().to_internal_value(data)
+        user = users[key]
+        if user.role != self.role:
+            self.fail('wrong_role', pk_value=data, role=self.role)
+        return user
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Serializer للمستخدمين (Admin + Agent)
@@ -71,10 +115,13 @@ class UserSerializer(serializers.ModelSerializer):
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         
+        # ✅ تحديث الأعمدة المتغيرة فقط بدلاً من إعادة كتابة الصف كاملاً
+        update_fields = list(validated_data.keys()) + ['updated_at']
         if password:
             instance.set_password(password)
+            update_fields.append('password_hash')
         
-        instance.save()
+        instance.save(update_fields=update_fields)
         return instance
 
 
@@ -83,15 +130,15 @@ class AgentSerializer(serializers.ModelSerializer):
     Serializer للموظفين
     """
     user = UserSerializer(read_only=True)
-    user_id = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.filter(role='agent'),
+    user_id = RoleCheckedPKField(
+        role='agent',
         source='user',
         write_only=True
     )
     
-    # Computed fields
-    available_capacity = serializers.SerializerMethodField()
-    is_available = serializers.SerializerMethodField()
+    # Computed fields (محسوبة في قاعدة البيانات عبر AgentQuerySet.with_availability)
+    available_capacity = serializers.IntegerField(read_only=True)
+    is_available = serializers.BooleanField(read_only=True)
     
     class Meta:
         model = Agent
@@ -108,21 +155,35 @@ class AgentSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
     
-    def get_available_capacity(self, obj):
+    @classmethod
+    def setup_eager_loading(cls, queryset):
         """
-        حساب السعة المتاحة
+        تحميل user وحالة الاستراحة مسبقاً لتجنب N+1 في القوائم
         """
-        return obj.max_capacity - obj.current_active_tickets
-    
-    def get_is_available(self, obj):
+        return queryset.select_related('user').with_break_state().with_availability()
+
+    @staticmethod
+    def _set_availability(obj):
         """
-        هل الموظف متاح لاستقبال تذاكر جديدة؟
+        حساب السعة والإتاحة في Python للكائنات غير المحمّلة عبر with_availability()
+        (مثل: الإنشاء، التعديل، user.agent)
         """
-        return (
+        obj.available_capacity = obj.max_capacity - obj.current_active_tickets
+        obj.is_available = (
             obj.is_online and 
             obj.status == 'available' and 
             obj.current_active_tickets < obj.max_capacity
         )
+    
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        self._set_availability(instance)
+        return instance
+    
+    def to_representation(self, instance):
+        if not hasattr(instance, 'is_available'):
+            self._set_availability(instance)
+        return super().to_representation(instance)
 
 
 class AdminSerializer(serializers.ModelSerializer):
@@ -130,8 +191,8 @@ class AdminSerializer(serializers.ModelSerializer):
     Serializer للمديرين
     """
     user = UserSerializer(read_only=True)
-    user_id = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.filter(role='admin'),
+    user_id = RoleCheckedPKField(
+        role='admin',
         source='user',
         write_only=True
     )
@@ -182,8 +243,8 @@ class CustomerSerializer(serializers.ModelSerializer):
     tags = CustomerTagSerializer(many=True, read_only=True)
     notes = CustomerNoteSerializer(many=True, read_only=True)
 
-    # Computed fields
-    tags_list = serializers.SerializerMethodField()
+    # ✅ قائمة التصنيفات كنص - من نفس العلاقة المحملة مسبقاً (tags) بدون استعلام إضافي
+    tags_list = serializers.SlugRelatedField(source='tags', slug_field='tag', many=True, read_only=True)
 
     # wa_id optional - سيتم توليده تلقائياً من phone_number
     wa_id = serializers.CharField(required=False, allow_blank=True)
@@ -201,18 +262,19 @@ class CustomerSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
     
-    def get_tags_list(self, obj):
+    @classmethod
+    def setup_eager_loading(cls, queryset):
         """
-        قائمة التصنيفات كنص
+        تحميل التصنيفات مسبقاً لتجنب N+1 في القوائم
         """
-        return [tag.tag for tag in obj.tags.all()]
-    
+        return queryset.prefetch_related('tags')
+
     def validate_phone_number(self, value):
         """
         التحقق من صحة رقم الهاتف
         """
         # إزالة المسافات والرموز
-        cleaned = ''.join(filter(str.isdigit, value))
+        cleaned = NON_DIGITS_RE.sub('', value)
 
         # إزالة 0 من البداية إذا كانت موجودة
         if cleaned.startswith('0'):
@@ -249,9 +311,18 @@ class CustomerSerializer(serializers.ModelSerializer):
 
         return super().create(validated_data)
 
+    def update(self, instance, validated_data):
+        """
+        تحديث بيانات العميل - الأعمدة المتغيرة فقط
+        """
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data.keys()) + ['updated_at'])
+        return instance
+
 
 # ============================================================================
-# GROUP 3: TICKET MANAGEMENT SERIALIZERS (3)
+# GROUP 3: TICKET MANAGEMENT SERIALIZERS (5)
 # ============================================================================
 
 class TicketStateLogSerializer(serializers.ModelSerializer):
@@ -298,8 +369,8 @@ class TicketSerializer(serializers.ModelSerializer):
     closed_by_name = serializers.CharField(source='closed_by_user.full_name', read_only=True)
     
     # Nested serializers
-    state_logs = TicketStateLogSerializer(many=True, read_only=True)
-    transfer_logs = TicketTransferLogSerializer(many=True, read_only=True)
+    state_logs = TicketStateLogSerializer(source='state_changes', many=True, read_only=True)
+    transfer_logs = TicketTransferLogSerializer(source='transfers', many=True, read_only=True)
     
     # Computed fields
     is_overdue = serializers.SerializerMethodField()
@@ -328,6 +399,15 @@ class TicketSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
     
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        تحميل العلاقات المعروضة (customer + الموظفين + مغلق التذكرة) مسبقاً لتجنب N+1
+        """
+        return queryset.select_related(
+            'customer', 'assigned_agent__user', 'current_agent__user', 'closed_by_user'
+        )
+
     def get_is_overdue(self, obj):
         """
         هل التذكرة متأخرة؟
@@ -339,12 +419,111 @@ class TicketSerializer(serializers.ModelSerializer):
         الوقت منذ آخر رسالة (بالدقائق)
         """
         if obj.last_message_at:
-            from django.utils import timezone
-            delta = timezone.now() - obj.last_message_at
+            delta = _serialization_now(self) - obj.last_message_at
             return int(delta.total_seconds() / 60)
         return None
 
 
+class TicketListSerializer(serializers.Serializer):
+    """
+    Serializer لقوائم التذاكر - يقرأ من قواميس .values() بدلاً من بناء كائنات
+    Ticket + Customer + Agent + User لكل صف
+    المخرجات مطابقة لـ TicketSerializer بدون السجلات المتداخلة و time_since_last_message
+    """
+    VALUE_FIELDS = (
+        'id', 'ticket_number', 'customer', 'assigned_agent', 'current_agent', 'closed_by_user',
+        'status', 'category', 'priority',
+        'is_delayed', 'delay_started_at', 'total_delay_minutes', 'delay_count',
+        'created_at', 'first_response_at', 'last_message_at',
+        'last_customer_message_at', 'last_agent_message_at', 'closed_at',
+        'category_selected_at',
+        'response_time_seconds', 'handling_time_seconds', 'messages_count',
+        'closure_reason', 'updated_at'
+    )
+
+    # TicketSerializer لا يُخرج اسم العلاقة عندما تكون فارغة - نفس السلوك هنا
+    OPTIONAL_RELATION_NAMES = (
+        ('assigned_agent', 'assigned_agent_name'),
+        ('current_agent', 'current_agent_name'),
+        ('closed_by_user', 'closed_by_name'),
+    )
+
+    id = serializers.IntegerField()
+    ticket_number = serializers.CharField()
+    customer = serializers.IntegerField()
+    customer_name = serializers.CharField()
+    customer_phone = serializers.CharField()
+    assigned_agent = serializers.IntegerField()
+    assigned_agent_name = serializers.CharField()
+    current_agent = serializers.IntegerField()
+    current_agent_name = serializers.CharField()
+    closed_by_user = serializers.IntegerField()
+    closed_by_name = serializers.CharField()
+    status = serializers.CharField()
+    category = serializers.CharField()
+    priority = serializers.CharField()
+    is_delayed = serializers.BooleanField()
+    delay_started_at = serializers.DateTimeField()
+    total_delay_minutes = serializers.IntegerField()
+    delay_count = serializers.IntegerField()
+    created_at = serializers.DateTimeField()
+    first_response_at = serializers.DateTimeField()
+    last_message_at = serializers.DateTimeField()
+    last_customer_message_at = serializers.DateTimeField()
+    last_agent_message_at = serializers.DateTimeField()
+    closed_at = serializers.DateTimeField()
+    category_selected_at = serializers.DateTimeField()
+    response_time_seconds = serializers.IntegerField()
+    handling_time_seconds = serializers.IntegerField()
+    messages_count = serializers.IntegerField()
+    closure_reason = serializers.CharField()
+    updated_at = serializers.DateTimeField()
+    is_overdue = serializers.BooleanField(source='is_delayed')
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        لا تحميل مسبق - العلاقات المعروضة تُقرأ بـ join داخل values()
+        """
+        return queryset
+
+    @classmethod
+    def values(cls, queryset):
+        """
+        تحويل الـ queryset إلى قواميس بالحقول المعروضة فقط (أسماء العميل والموظفين بـ join)
+        """
+        return queryset.values(
+            *cls.VALUE_FIELDS,
+            customer_name=F('customer__name'),
+            customer_phone=F('customer__phone_number'),
+            assigned_agent_name=F('assigned_agent__user__full_name'),
+            current_agent_name=F('current_agent__user__full_name'),
+            closed_by_name=F('closed_by_user__full_name'),
+        )
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for relation, name in self.OPTIONAL_RELATION_NAMES:
+            if data[relation] is None:
+                del data[name]
+        return data
+
+
+class TicketDetailSerializer(TicketSerializer):
+    """
+    Serializer لتفاصيل التذكرة وإنشائها وتعديلها - بدون سجلات الحالة والنقل
+    (السجلات من GET /api/tickets/{id}/history/ فقط)
+    """
+    state_logs = None
+    transfer_logs = None
+
+    class Meta(TicketSerializer.Meta):
+        fields = [
+            field for field in TicketSerializer.Meta.fields
+            if field not in ('state_logs', 'transfer_logs')
+        ]
+
+
 # ============================================================================
 # GROUP 4: MESSAGE SERIALIZERS (3)
 # ============================================================================
@@ -359,21 +538,12 @@ class MessageDeliveryLogSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class MessageSearchIndexSerializer(serializers.ModelSerializer):
-    """
-    Serializer لفهرس البحث في الرسائل
-    """
-    class Meta:
-        model = MessageSearchIndex
-        fields = ['id', 'message', 'customer', 'search_text', 'created_at']
-        read_only_fields = ['id', 'created_at']
-
-
 class MessageSerializer(serializers.ModelSerializer):
     """
     Serializer للرسائل
     """
-    sender_name = serializers.SerializerMethodField()
+    # محسوب في قاعدة البيانات عبر MessageQuerySet.with_sender_name
+    sender_name = serializers.CharField(read_only=True)
     delivery_log = MessageDeliveryLogSerializer(read_only=True)
     image = serializers.ImageField(write_only=True, required=False, allow_null=True)
 
@@ -394,13 +564,34 @@ class MessageSerializer(serializers.ModelSerializer):
             'read_at', 'created_at', 'updated_at', 'media_url', 'mime_type',
             'sender', 'sender_type'  # حقول مُدارة من الـ backend
         ]
+
+    # حقول لا تُرجع إلا عند طلبها صراحة: ?include=time_ago
+    OPTIONAL_FIELDS = ('time_ago',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        query_params = getattr(request, 'query_params', {})
+        include = set(filter(None, query_params.get('include', '').split(',')))
+        for field_name in self.OPTIONAL_FIELDS:
+            if field_name not in include:
+                self.fields.pop(field_name, None)
     
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        تحميل العميل والمرسل مسبقاً (يستخدمهما sender_name) لتجنب N+1
+        """
+        return queryset.select_related('ticket__customer', 'sender').with_sender_name()
+
     def validate_image(self, value):
         """
         التحقق من الصورة المرفوعة
         """
-        if value and value.size > 5 * 1024 * 1024:  # 5MB
-            raise serializers.ValidationError('حجم الصورة يجب أن يكون أقل من 5 ميجابايت')
+        # حماية إضافية - QuotaUploadHandler يوقف الرفع قبل الوصول لهنا
+        max_size = settings.FILE_UPLOAD_MAX_SIZE
+        if value and value.size > max_size:
+            raise serializers.ValidationError(f'حجم الصورة يجب أن يكون أقل من {max_size // (1024 * 1024)} ميجابايت')
         return value
     
     def validate(self, data):
@@ -423,7 +614,14 @@ class MessageSerializer(serializers.ModelSerializer):
         
         return super().create(validated_data)
 
-    def get_sender_name(self, obj):
+    def to_representation(self, instance):
+        if not hasattr(instance, 'sender_name'):
+            # كائن غير محمّل عبر with_sender_name() (مثل: الرسالة المنشأة للتو)
+            instance.sender_name = self._compute_sender_name(instance)
+        return super().to_representation(instance)
+
+    @staticmethod
+    def _compute_sender_name(obj):
         """
         اسم المرسل
         """
@@ -439,8 +637,7 @@ class MessageSerializer(serializers.ModelSerializer):
         """
         الوقت منذ إرسال الرسالة (بالدقائق)
         """
-        from django.utils import timezone
-        delta = timezone.now() - obj.created_at
+        delta = _serialization_now(self) - obj.created_at
         minutes = int(delta.total_seconds() / 60)
 
         if minutes < 1:
@@ -547,7 +744,7 @@ class AgentDelayEventSerializer(serializers.ModelSerializer):
 
 
 # ============================================================================
-# GROUP 7: KPI & PERFORMANCE SERIALIZERS (3)
+# GROUP 7: KPI & PERFORMANCE SERIALIZERS (4)
 # ============================================================================
 
 class AgentKPISerializer(serializers.ModelSerializer):
@@ -569,6 +766,55 @@ class AgentKPISerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        تحميل الموظف مسبقاً (agent_name) لتجنب N+1
+        """
+        return queryset.select_related('agent__user')
+
+
+class AgentKPIListSerializer(serializers.Serializer):
+    """
+    Serializer لقوائم مؤشرات الأداء اليومية - يقرأ من قواميس .values()
+    بدلاً من بناء كائنات AgentKPI كاملة
+    """
+    VALUE_FIELDS = (
+        'id', 'agent', 'kpi_date', 'total_tickets',
+        'closed_tickets', 'avg_response_time_seconds', 'messages_sent',
+        'messages_received', 'delay_count',
+        'total_break_time_seconds', 'break_count',
+        'customer_satisfaction_score',
+        'first_response_rate', 'resolution_rate', 'overall_kpi_score',
+        'created_at', 'updated_at'
+    )
+
+    id = serializers.IntegerField()
+    agent = serializers.IntegerField()
+    agent_name = serializers.CharField()
+    kpi_date = serializers.DateField()
+    total_tickets = serializers.IntegerField()
+    closed_tickets = serializers.IntegerField()
+    avg_response_time_seconds = serializers.IntegerField(allow_null=True)
+    messages_sent = serializers.IntegerField()
+    messages_received = serializers.IntegerField()
+    delay_count = serializers.IntegerField()
+    total_break_time_seconds = serializers.IntegerField()
+    break_count = serializers.IntegerField()
+    customer_satisfaction_score = serializers.DecimalField(max_digits=3, decimal_places=2, allow_null=True)
+    first_response_rate = serializers.DecimalField(max_digits=5, decimal_places=2, allow_null=True)
+    resolution_rate = serializers.DecimalField(max_digits=5, decimal_places=2, allow_null=True)
+    overall_kpi_score = serializers.DecimalField(max_digits=5, decimal_places=2, allow_null=True)
+    created_at = serializers.DateTimeField()
+    updated_at = serializers.DateTimeField()
+
+    @classmethod
+    def values(cls, queryset):
+        """
+        تحويل الـ queryset إلى قواميس بالحقول المطلوبة فقط (join واحد لاسم الموظف)
+        """
+        return queryset.values(*cls.VALUE_FIELDS, agent_name=F('agent__user__full_name'))
+
 
 class AgentKPIMonthlySerializer(serializers.ModelSerializer):
     """
@@ -586,6 +832,13 @@ class AgentKPIMonthlySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        تحميل الموظف مسبقاً (agent_name) لتجنب N+1
+        """
+        return queryset.select_related('agent__user')
+
 
 class CustomerSatisfactionSerializer(serializers.ModelSerializer):
     """
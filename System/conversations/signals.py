@@ -7,7 +7,7 @@ from django.dispatch import receiver
 from django.db.models import Count, Q
 from django.contrib.auth import get_user_model
 from .models import Ticket, Message, Agent, Customer
-from .utils import calculate_agent_kpi
+from .utils import schedule_agent_kpi_recalculation
 
 User = get_user_model()
 
@@ -48,11 +48,7 @@ def update_kpi_on_ticket_save(sender, instance, created, **kwargs):
 
     # تحديث KPI للموظف المعين
     if instance.assigned_agent:
-        try:
-            calculate_agent_kpi(instance.assigned_agent)
-        except Exception as e:
-            # تجاهل الأخطاء لعدم التأثير على العملية الأساسية
-            pass
+        schedule_agent_kpi_recalculation(instance.assigned_agent)
 
 
 @receiver(post_delete, sender=Ticket)
@@ -90,11 +86,7 @@ def update_kpi_on_message_save(sender, instance, created, **kwargs):
 
     # فقط عند إرسال رسالة جديدة من الموظف
     if created and instance.sender_type == 'agent' and instance.ticket.assigned_agent:
-        try:
-            calculate_agent_kpi(instance.ticket.assigned_agent)
-        except Exception as e:
-            # تجاهل الأخطاء لعدم التأثير على العملية الأساسية
-            pass
+        schedule_agent_kpi_recalculation(instance.ticket.assigned_agent)
 
 
 @receiver(post_save, sender=User)
@@ -0,0 +1,43 @@
+"""
+Upload Handlers
+معالجات رفع الملفات
+
+✅ إيقاف رفع الملف فور تجاوزه الحد الأقصى بدلاً من استقباله كاملاً ثم رفضه
+"""
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+
+class QuotaUploadHandler(FileUploadHandler):
+    """
+    يحسب حجم كل ملف مرفوع ويوقف الرفع عند تجاوز أي ملف FILE_UPLOAD_MAX_SIZE
+
+    يجب أن يكون أول معالج في FILE_UPLOAD_HANDLERS ليمنع باقي المعالجات
+    من حفظ البيانات الزائدة في الذاكرة أو على القرص.
+
+    ✅ عند التجاوز يُعلَّم الطلب بـ upload_quota_exceeded - الملف يُسقط من request.FILES
+    لذلك يجب على الـ view فحص العلامة وإرجاع 400 بدلاً من المتابعة بدون الملف
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.file_size = 0
+        self.quota = getattr(settings, 'FILE_UPLOAD_MAX_SIZE', 5 * 1024 * 1024)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        # الحد لكل ملف وليس لمجموع ملفات الطلب
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        if self.file_size > self.quota:
+            if self.request is not None:
+                self.request.upload_quota_exceeded = True
+            # بدون connection_reset: باقي الجسم يُقرأ ويُهمل (لا يُخزن) حتى يصل رد 400 للعميل
+            raise StopUpload(connection_reset=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
@@ -13,14 +13,33 @@ Utility Functions
 
 from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction, IntegrityError
+from django.db.models import Avg, Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+import atexit
+import collections
+import heapq
+import logging
 import re
+import threading
 from datetime import datetime, timedelta
 
+from .models import (
+    Customer, Agent, Ticket, TicketTransferLog, TicketStateLog, DailyTicketSequence,
+    Message, AgentBreakSession, AgentKPI, CustomerSatisfaction,
+    ActivityLog, SystemSettings
+)
+
 
 # ============================================================================
 # 1. PHONE NUMBER NORMALIZATION
 # ============================================================================
 
+# ✅ Regex مُجمّع مرة واحدة لحذف كل ما ليس رقماً
+NON_DIGITS_RE = re.compile(r'[^\d]')
+
+
 def normalize_phone_number(phone):
     """
     تطبيع رقم الهاتف إلى الصيغة الموحدة: 20XXXXXXXXXX
@@ -41,7 +60,7 @@ def normalize_phone_number(phone):
     if '@' in phone:
         phone = phone.split('@')[0]
 
-    cleaned = re.sub(r'[^\d]', '', phone)
+    cleaned = NON_DIGITS_RE.sub('', phone)
 
     if cleaned.startswith('00'):
         cleaned = cleaned[2:]
@@ -63,6 +82,37 @@ def normalize_phone_number(phone):
     return cleaned
 
 
+CUSTOMER_WA_ID_CACHE_TIMEOUT = 3600  # ساعة
+
+
+def get_customer_by_wa_id(wa_id):
+    """
+    البحث عن العميل بـ wa_id مع Cache لرقم العميل (cust:wa:<wa_id>)
+
+    عند وجود الرقم في الـ Cache يتم البحث بالمفتاح الأساسي بدلاً من فهرس wa_id.
+    يتم التحقق من أن wa_id لم يتغير قبل إرجاع النتيجة.
+
+    Returns:
+        Customer أو None إذا لم يوجد
+    """
+
+    if not wa_id:
+        return None
+
+    cache_key = f'cust:wa:{wa_id}'
+    customer_id = cache.get(cache_key)
+    if customer_id is not None:
+        customer = Customer.objects.filter(pk=customer_id).first()
+        if customer is not None and customer.wa_id == wa_id:
+            return customer
+        cache.delete(cache_key)
+
+    customer = Customer.objects.filter(wa_id=wa_id).first()
+    if customer is not None:
+        cache.set(cache_key, customer.id, CUSTOMER_WA_ID_CACHE_TIMEOUT)
+    return customer
+
+
 # ============================================================================
 # 2. TICKET NUMBER GENERATION
 # ============================================================================
@@ -73,25 +123,31 @@ def generate_ticket_number():
     Format: TKT-YYYYMMDD-XXXX
     
     Example: TKT-20251030-0001
+
+    ✅ يعتمد على عداد يومي (DailyTicketSequence) يُزاد بـ UPDATE ذري
+    بدلاً من البحث عن آخر تذكرة بـ startswith (يمنع تكرار الرقم عند التزامن)
     """
-    from .models import Ticket
     
     # الحصول على التاريخ الحالي
     today = timezone.now().date()
     date_str = today.strftime('%Y%m%d')
-    
-    # البحث عن آخر تذكرة في نفس اليوم
     prefix = f'TKT-{date_str}-'
-    last_ticket = Ticket.objects.filter(
-        ticket_number__startswith=prefix
-    ).order_by('-ticket_number').first()
     
-    if last_ticket:
-        # استخراج الرقم التسلسلي
-        last_number = int(last_ticket.ticket_number.split('-')[-1])
-        new_number = last_number + 1
-    else:
-        new_number = 1
+    with transaction.atomic():
+        # UPDATE يقفل صف اليوم حتى نهاية الـ transaction
+        updated = DailyTicketSequence.objects.filter(date=today).update(counter=F('counter') + 1)
+        
+        if not updated:
+            # أول تذكرة في اليوم: بدء العداد من آخر رقم موجود (إن وجد)
+            start = _last_ticket_number_for_prefix(prefix)
+            try:
+                with transaction.atomic():
+                    DailyTicketSequence.objects.create(date=today, counter=start + 1)
+            except IntegrityError:
+                # طلب آخر أنشأ صف اليوم في نفس اللحظة
+                DailyTicketSequence.objects.filter(date=today).update(counter=F('counter') + 1)
+        
+        new_number = DailyTicketSequence.objects.values_list('counter', flat=True).get(date=today)
     
     # تنسيق الرقم (4 أرقام)
     ticket_number = f'{prefix}{new_number:04d}'
@@ -99,10 +155,146 @@ def generate_ticket_number():
     return ticket_number
 
 
+def _last_ticket_number_for_prefix(prefix):
+    """
+    آخر رقم تسلسلي مستخدم لبادئة اليوم (يُستدعى مرة واحدة يومياً لبدء العداد)
+    """
+
+    last_ticket_number = Ticket.objects.filter(
+        ticket_number__startswith=prefix
+    ).order_by('-ticket_number').values_list('ticket_number', flat=True).first()
+
+    if not last_ticket_number:
+        return 0
+    try:
+        return int(last_ticket_number.split('-')[-1])
+    except ValueError:
+        return 0
+
+
 # ============================================================================
 # 3. ACTIVITY LOGGING
 # ============================================================================
 
+# ✅ تجميع سجلات النشاط خلال الطلب (انظر ActivityLogBufferMiddleware) ثم نقلها
+# إلى طابور مشترك على مستوى العملية يُحفظ بـ bulk_create خارج مسار الطلب:
+# عند امتلائه أو بعد ACTIVITY_LOG_FLUSH_SECONDS أو عند إيقاف العملية
+_activity_log_buffer = threading.local()
+_activity_log_queue = collections.deque()
+_activity_log_lock = threading.Lock()
+_activity_log_timer = None
+ACTIVITY_LOG_BATCH_SIZE = 1000
+ACTIVITY_LOG_FLUSH_SECONDS = 2
+
+# ✅ عمليات أمنية تُحفظ فوراً (ترتيب سجل التدقيق مهم) - الباقي يمر عبر الطابور
+SYNC_ACTIVITY_ACTIONS = frozenset({'login', 'logout', 'force_logout', 'reset_password'})
+
+
+def start_activity_log_buffer():
+    """
+    بدء تجميع سجلات النشاط للـ thread الحالي بدلاً من حفظ كل سجل فوراً
+    """
+    _activity_log_buffer.entries = []
+
+
+def flush_activity_log_buffer():
+    """
+    نقل سجلات النشاط المجمعة للطلب إلى الطابور المشترك وإيقاف التجميع
+
+    Returns:
+        int: عدد السجلات المنقولة
+    """
+
+    entries = getattr(_activity_log_buffer, 'entries', None)
+    _activity_log_buffer.entries = None
+    if not entries:
+        return 0
+
+    _enqueue_activity_logs(entries)
+    return len(entries)
+
+
+def _enqueue_activity_logs(entries):
+    """
+    إضافة سجلات إلى الطابور المشترك - يُحفظ فوراً إذا امتلأ وإلا بعد مهلة قصيرة
+    """
+    global _activity_log_timer
+
+    with _activity_log_lock:
+        _activity_log_queue.extend(entries)
+        is_full = len(_activity_log_queue) >= ACTIVITY_LOG_BATCH_SIZE
+        if not is_full and _activity_log_timer is None:
+            _activity_log_timer = threading.Timer(ACTIVITY_LOG_FLUSH_SECONDS, _flush_activity_log_queue_in_background)
+            _activity_log_timer.daemon = True
+            _activity_log_timer.start()
+
+    if is_full:
+        flush_activity_log_queue()
+
+
+def flush_activity_log_queue():
+    """
+    حفظ كل السجلات في الطابور المشترك بـ bulk_create
+
+    Returns:
+        int: عدد السجلات المحفوظة
+    """
+    global _activity_log_timer
+
+    with _activity_log_lock:
+        entries = list(_activity_log_queue)
+        _activity_log_queue.clear()
+        if _activity_log_timer is not None:
+            _activity_log_timer.cancel()
+            _activity_log_timer = None
+
+    if not entries:
+        return 0
+
+    ActivityLog.objects.bulk_create(entries, batch_size=ACTIVITY_LOG_BATCH_SIZE)
+    return len(entries)
+
+
+def _flush_activity_log_queue_in_background():
+    """
+    الحفظ المؤجل من thread المؤقت - يغلق اتصال قاعدة البيانات الخاص به بعد الانتهاء
+    """
+    try:
+        flush_activity_log_queue()
+    except Exception:
+        logging.getLogger(__name__).exception('Failed to flush activity log queue')
+    finally:
+        connections.close_all()
+
+
+# حفظ ما تبقى في الطابور عند إيقاف العملية
+atexit.register(flush_activity_log_queue)
+
+
+USER_AGENT_MAX_LENGTH = 255
+
+
+def get_client_info(request):
+    """
+    IP و User Agent للطلب - تُحسب مرة واحدة وتُحفظ على الطلب
+    (يعيد استخدامها log_activity وتسجيل محاولات الدخول في نفس الطلب)
+
+    Returns:
+        tuple: (ip_address, user_agent)
+    """
+    request = getattr(request, '_request', request)  # DRF Request => HttpRequest
+    info = getattr(request, '_client_info', None)
+    if info is None:
+        meta = request.META
+        x_forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            ip_address = x_forwarded_for.split(',', 1)[0]
+        else:
+            ip_address = meta.get('REMOTE_ADDR')
+        info = request._client_info = (ip_address, meta.get('HTTP_USER_AGENT', '')[:USER_AGENT_MAX_LENGTH])
+    return info
+
+
 def log_activity(user, action, entity_type, entity_id, old_value=None, new_value=None, request=None):
     """
     تسجيل نشاط المستخدم
@@ -116,23 +308,14 @@ def log_activity(user, action, entity_type, entity_id, old_value=None, new_value
         new_value: القيمة الجديدة (للتحديثات)
         request: Django request object (للحصول على IP و User Agent)
     """
-    from .models import ActivityLog
     
     ip_address = None
     user_agent = None
     
     if request:
-        # الحصول على IP Address
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip_address = x_forwarded_for.split(',')[0]
-        else:
-            ip_address = request.META.get('REMOTE_ADDR')
-        
-        # الحصول على User Agent
-        user_agent = request.META.get('HTTP_USER_AGENT', '')[:255]
+        ip_address, user_agent = get_client_info(request)
     
-    ActivityLog.objects.create(
+    entry = ActivityLog(
         user=user,
         action=action,
         entity_type=entity_type,
@@ -142,12 +325,44 @@ def log_activity(user, action, entity_type, entity_id, old_value=None, new_value
         ip_address=ip_address,
         user_agent=user_agent
     )
+    
+    # العمليات الأمنية: حفظ فوري
+    if action in SYNC_ACTIVITY_ACTIONS:
+        entry.save()
+        return
+
+    # ✅ التسجيل بعد نجاح المعاملة فقط (فوري إن لم تكن هناك معاملة مفتوحة)
+    # حتى لا يُسجَّل نشاط لعملية تم التراجع عنها
+    transaction.on_commit(lambda: _buffer_activity_log(entry))
+
+
+def _buffer_activity_log(entry):
+    """
+    إضافة سجل مؤجل إلى مخزن الطلب الحالي أو إلى الطابور المشترك
+    """
+    # داخل طلب HTTP: يُحفظ مع باقي سجلات الطلب في نهايته
+    entries = getattr(_activity_log_buffer, 'entries', None)
+    if entries is not None:
+        entries.append(entry)
+    else:
+        # خارج الطلب (أوامر الإدارة / threads): الطابور المشترك بدلاً من INSERT فوري
+        _enqueue_activity_logs([entry])
 
 
 # ============================================================================
 # 4. KPI CALCULATION
 # ============================================================================
 
+# القيم التي يعيد الحساب كتابتها
+KPI_METRIC_FIELDS = (
+    'total_tickets', 'closed_tickets', 'avg_response_time_seconds',
+    'messages_sent', 'messages_received', 'delay_count',
+    'total_break_time_seconds', 'break_count',
+    'customer_satisfaction_score', 'first_response_rate',
+    'resolution_rate', 'overall_kpi_score',
+)
+
+
 def calculate_agent_kpi(agent, date=None):
     """
     حساب مؤشرات الأداء للموظف
@@ -159,67 +374,89 @@ def calculate_agent_kpi(agent, date=None):
     Returns:
         dict: KPI metrics
     """
-    from .models import Ticket, Message, CustomerSatisfaction, AgentKPI, AgentBreakSession
-    from django.db.models import Avg, Count, Q, Sum
 
     if date is None:
-        date = timezone.now().date()
+        date = timezone.localdate()
 
-    # الحصول على التذاكر في هذا اليوم
-    tickets = Ticket.objects.filter(
+    # ✅ مؤشرات التذاكر في هذا اليوم - استعلام واحد بعدّ شرطي
+    ticket_stats = Ticket.objects.filter(
         assigned_agent=agent,
         created_at__date=date
+    ).aggregate(
+        total=Count('id'),
+        closed=Count('id', filter=Q(status='closed')),
+        delayed=Count('id', filter=Q(delay_count__gt=0)),
+        with_response=Count('id', filter=Q(first_response_at__isnull=False)),
+        avg_response=Avg('response_time_seconds'),  # Avg يتجاهل القيم الفارغة
     )
 
-    total_tickets = tickets.count()
-    closed_tickets = tickets.filter(status='closed').count()
-
-    # حساب متوسط وقت الاستجابة
-    avg_response_time = tickets.filter(
-        response_time_seconds__isnull=False
-    ).aggregate(Avg('response_time_seconds'))['response_time_seconds__avg'] or 0
-
-    # عدد الرسائل
-    messages_sent = Message.objects.filter(
-        ticket__assigned_agent=agent,
-        sender_type='agent',
-        sender_id=agent.user.id,
+    # متوسط رضا العملاء
+    satisfaction_stats = CustomerSatisfaction.objects.filter(
+        agent=agent,
         created_at__date=date
-    ).count()
+    ).aggregate(avg_rating=Avg('rating'))
 
-    messages_received = Message.objects.filter(
+    # ✅ عدد الرسائل المرسلة والمستقبلة - استعلام واحد
+    message_stats = Message.objects.filter(
         ticket__assigned_agent=agent,
-        sender_type='customer',
         created_at__date=date
-    ).count()
-
-    # عدد التأخيرات
-    delay_count = tickets.filter(delay_count__gt=0).count()
-
-    # متوسط رضا العملاء
-    satisfaction = CustomerSatisfaction.objects.filter(
-        agent=agent,
-        created_at__date=date
-    ).aggregate(Avg('rating'))['rating__avg'] or 0
+    ).aggregate(
+        sent=Count('id', filter=Q(sender_type='agent', sender_id=agent.user_id)),
+        received=Count('id', filter=Q(sender_type='customer')),
+    )
 
-    # ✅ حساب إجمالي وقت الاستراحة في هذا اليوم
-    break_sessions = AgentBreakSession.objects.filter(
+    # ✅ إجمالي وقت الاستراحة وعدد مراتها في هذا اليوم - استعلام واحد
+    break_stats = AgentBreakSession.objects.filter(
         agent=agent,
         break_start_time__date=date,
         break_duration_seconds__isnull=False
+    ).aggregate(
+        total=Sum('break_duration_seconds'),
+        count=Count('id'),
+    )
+
+    kpi_data = _build_kpi_metrics(ticket_stats, message_stats, break_stats, satisfaction_stats)
+
+    # ✅ حفظ أو تحديث KPI في استعلام واحد (INSERT ... ON CONFLICT DO UPDATE)
+    _upsert_agent_kpis([AgentKPI(agent=agent, kpi_date=date, **kpi_data)])
+
+    return kpi_data
+
+
+def _upsert_agent_kpis(rows, batch_size=None):
+    """
+    حفظ صفوف KPI بـ upsert واحد على أي قاعدة مدعومة
+
+    PostgreSQL / SQLite: ON CONFLICT (agent_id, kpi_date) DO UPDATE
+    MySQL لا يقبل تحديد الأعمدة (NotSupportedError) - ON DUPLICATE KEY UPDATE
+    يعتمد على المفتاح الفريد (agent, kpi_date) نفسه
+    """
+    features = connections[router.db_for_write(AgentKPI)].features
+    AgentKPI.objects.bulk_create(
+        rows,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['agent', 'kpi_date'] if features.supports_update_conflicts_with_target else None,
+        update_fields=list(KPI_METRIC_FIELDS) + ['updated_at'],
     )
 
-    total_break_time_seconds = break_sessions.aggregate(
-        total=Sum('break_duration_seconds')
-    )['total'] or 0
 
-    break_count = break_sessions.count()
+def _build_kpi_metrics(ticket_stats, message_stats, break_stats, satisfaction_stats):
+    """
+    حساب قيم KPI النهائية من نتائج التجميع (مشترك بين الحساب الفردي والجماعي)
+    """
+    total_tickets = ticket_stats.get('total') or 0
+    closed_tickets = ticket_stats.get('closed') or 0
+
+    avg_response_time = ticket_stats.get('avg_response') or 0
+
+    # متوسط رضا العملاء
+    satisfaction = satisfaction_stats.get('avg_rating') or 0
 
     # حساب معدلات الأداء
     first_response_rate = 0
     if total_tickets > 0:
-        tickets_with_response = tickets.filter(first_response_at__isnull=False).count()
-        first_response_rate = (tickets_with_response / total_tickets) * 100
+        first_response_rate = (ticket_stats['with_response'] / total_tickets) * 100
 
     resolution_rate = 0
     if total_tickets > 0:
@@ -228,35 +465,15 @@ def calculate_agent_kpi(agent, date=None):
     # حساب KPI Score الإجمالي (حسب الإجابة س1)
     overall_kpi_score = (first_response_rate + resolution_rate + (satisfaction * 20)) / 3
 
-    # حفظ أو تحديث KPI
-    kpi, created = AgentKPI.objects.update_or_create(
-        agent=agent,
-        kpi_date=date,
-        defaults={
-            'total_tickets': total_tickets,
-            'closed_tickets': closed_tickets,
-            'avg_response_time_seconds': int(avg_response_time),
-            'messages_sent': messages_sent,
-            'messages_received': messages_received,
-            'delay_count': delay_count,
-            'total_break_time_seconds': total_break_time_seconds,  # ✅ إضافة وقت الاستراحة
-            'break_count': break_count,  # ✅ إضافة عدد مرات الاستراحة
-            'customer_satisfaction_score': satisfaction,
-            'first_response_rate': first_response_rate,
-            'resolution_rate': resolution_rate,
-            'overall_kpi_score': overall_kpi_score,
-        }
-    )
-    
     return {
         'total_tickets': total_tickets,
         'closed_tickets': closed_tickets,
         'avg_response_time_seconds': int(avg_response_time),
-        'messages_sent': messages_sent,
-        'messages_received': messages_received,
-        'delay_count': delay_count,
-        'total_break_time_seconds': total_break_time_seconds,  # ✅ إضافة وقت الاستراحة
-        'break_count': break_count,  # ✅ إضافة عدد مرات الاستراحة
+        'messages_sent': message_stats.get('sent') or 0,
+        'messages_received': message_stats.get('received') or 0,
+        'delay_count': ticket_stats.get('delayed') or 0,
+        'total_break_time_seconds': break_stats.get('total') or 0,  # ✅ إضافة وقت الاستراحة
+        'break_count': break_stats.get('count') or 0,  # ✅ إضافة عدد مرات الاستراحة
         'customer_satisfaction_score': satisfaction,
         'first_response_rate': first_response_rate,
         'resolution_rate': resolution_rate,
@@ -264,6 +481,179 @@ def calculate_agent_kpi(agent, date=None):
     }
 
 
+def calculate_kpis_bulk(agents, dates):
+    """
+    حساب KPI لعدة موظفين وعدة أيام دفعة واحدة
+
+    ✅ بدلاً من استدعاء calculate_agent_kpi لكل موظف/يوم (~5 استعلامات لكل مرة):
+    استعلام GROUP BY (موظف، يوم) لكل من التذاكر والرسائل والاستراحات،
+    ثم حفظ كل الصفوف بـ bulk_create واحد (upsert)
+
+    Args:
+        agents: قائمة/QuerySet من Agent
+        dates: قائمة التواريخ
+
+    Returns:
+        dict: {(agent_id, date): KPI metrics}
+    """
+    agents = list(agents)
+    dates = sorted(set(dates))
+    if not agents or not dates:
+        return {}
+
+    agent_ids = [agent.id for agent in agents]
+    date_range = (dates[0], dates[-1])
+
+    ticket_stats = {
+        (row['assigned_agent_id'], row['day']): row
+        for row in Ticket.objects.filter(
+            assigned_agent_id__in=agent_ids,
+            created_at__date__range=date_range
+        ).annotate(day=TruncDate('created_at')).values('assigned_agent_id', 'day').annotate(
+            total=Count('id'),
+            closed=Count('id', filter=Q(status='closed')),
+            delayed=Count('id', filter=Q(delay_count__gt=0)),
+            with_response=Count('id', filter=Q(first_response_at__isnull=False)),
+            avg_response=Avg('response_time_seconds'),
+        ).order_by()
+    }
+
+    message_stats = {
+        (row['ticket__assigned_agent_id'], row['day']): row
+        for row in Message.objects.filter(
+            ticket__assigned_agent_id__in=agent_ids,
+            created_at__date__range=date_range
+        ).annotate(day=TruncDate('created_at')).values('ticket__assigned_agent_id', 'day').annotate(
+            sent=Count('id', filter=Q(sender_type='agent', sender_id=F('ticket__assigned_agent__user_id'))),
+            received=Count('id', filter=Q(sender_type='customer')),
+        ).order_by()
+    }
+
+    break_stats = {
+        (row['agent_id'], row['day']): row
+        for row in AgentBreakSession.objects.filter(
+            agent_id__in=agent_ids,
+            break_start_time__date__range=date_range,
+            break_duration_seconds__isnull=False
+        ).annotate(day=TruncDate('break_start_time')).values('agent_id', 'day').annotate(
+            total=Sum('break_duration_seconds'),
+            count=Count('id'),
+        ).order_by()
+    }
+
+    satisfaction_stats = {
+        (row['agent_id'], row['day']): row
+        for row in CustomerSatisfaction.objects.filter(
+            agent_id__in=agent_ids,
+            created_at__date__range=date_range
+        ).annotate(day=TruncDate('created_at')).values('agent_id', 'day').annotate(
+            avg_rating=Avg('rating'),
+        ).order_by()
+    }
+
+    results = {}
+    rows = []
+    for agent_id in agent_ids:
+        for date in dates:
+            key = (agent_id, date)
+            kpi_data = _build_kpi_metrics(
+                ticket_stats.get(key, {}),
+                message_stats.get(key, {}),
+                break_stats.get(key, {}),
+                satisfaction_stats.get(key, {}),
+            )
+            results[key] = kpi_data
+            rows.append(AgentKPI(agent_id=agent_id, kpi_date=date, **kpi_data))
+
+    # ✅ upsert واحد لكل الصفوف
+    _upsert_agent_kpis(rows, batch_size=500)
+
+    return results
+
+
+KPI_RECALC_INTERVAL_SECONDS = 60  # أقصى معدل لإعادة حساب KPI لنفس الموظف (لكل عملية)
+
+# ✅ الموظفون الذين تغيرت بياناتهم منذ آخر حساب - يُحسبون معاً بـ calculate_kpis_bulk
+# من thread مؤقت واحد للعملية بعد KPI_RECALC_INTERVAL_SECONDS أو عند إيقاف العملية
+_kpi_recalc_pending = set()
+_kpi_recalc_lock = threading.Lock()
+_kpi_recalc_timer = None
+
+
+def schedule_agent_kpi_recalculation(agent):
+    """
+    جدولة إعادة حساب KPI للموظف بعد نجاح الـ transaction
+
+    بدلاً من إعادة الحساب مع كل رسالة/تذكرة، يُضاف الموظف لمجموعة معلقة
+    وتُحسب كل المجموعة مرة واحدة بعد KPI_RECALC_INTERVAL_SECONDS - أي دفعة تغييرات
+    لنفس الموظف خلال الفترة تنتج حساباً واحداً (KPI متأخرة حتى دقيقة).
+
+    ✅ التسجيل يتم بعد الـ commit فقط - الـ rollback لا يترك شيئاً معلقاً
+    ✅ الحساب نفسه يتم في thread المؤقت - الطلب لا ينتظره
+    """
+
+    if agent is None:
+        return False
+
+    agent_id = agent.id
+    transaction.on_commit(lambda: _enqueue_kpi_recalculation(agent_id))
+    return True
+
+
+def _enqueue_kpi_recalculation(agent_id):
+    """
+    إضافة موظف للمجموعة المعلقة وتشغيل المؤقت المشترك إذا لم يكن يعمل
+    """
+    global _kpi_recalc_timer
+
+    with _kpi_recalc_lock:
+        _kpi_recalc_pending.add(agent_id)
+        if _kpi_recalc_timer is None:
+            _kpi_recalc_timer = threading.Timer(KPI_RECALC_INTERVAL_SECONDS, _flush_kpi_recalc_queue_in_background)
+            _kpi_recalc_timer.daemon = True
+            _kpi_recalc_timer.start()
+
+
+def flush_kpi_recalc_queue():
+    """
+    حساب KPI اليوم لكل الموظفين المعلقين دفعة واحدة
+
+    Returns:
+        int: عدد الموظفين الذين أعيد حسابهم
+    """
+    global _kpi_recalc_timer
+
+    with _kpi_recalc_lock:
+        agent_ids = list(_kpi_recalc_pending)
+        _kpi_recalc_pending.clear()
+        if _kpi_recalc_timer is not None:
+            _kpi_recalc_timer.cancel()
+            _kpi_recalc_timer = None
+
+    if not agent_ids:
+        return 0
+
+    calculate_kpis_bulk(Agent.objects.filter(pk__in=agent_ids), [timezone.localdate()])
+    return len(agent_ids)
+
+
+def _flush_kpi_recalc_queue_in_background():
+    """
+    الحساب المؤجل من thread المؤقت - يغلق اتصال قاعدة البيانات الخاص به بعد الانتهاء
+    """
+    try:
+        flush_kpi_recalc_queue()
+    except Exception:
+        # لا تأثير على العملية الأساسية - التغيير التالي أو update_kpis يلتقط التحديث
+        logging.getLogger(__name__).exception('Failed to recalculate agent KPIs')
+    finally:
+        connections.close_all()
+
+
+# حساب ما تبقى معلقاً عند إيقاف العملية (أوامر الإدارة / run_delay_tracker.py)
+atexit.register(flush_kpi_recalc_queue)
+
+
 # ============================================================================
 # 5. DELAY DETECTION
 # ============================================================================
@@ -290,7 +680,6 @@ def check_ticket_delay(ticket):
         return False
 
     # ✅ استخدام delay_threshold من SystemSettings
-    from .models import SystemSettings
     system_settings = SystemSettings.get_settings()
     delay_threshold = system_settings.delay_threshold_minutes
     
@@ -309,7 +698,6 @@ def update_ticket_delay_status(ticket):
     Args:
         ticket: Ticket object
     """
-    from .models import TicketStateLog
     
     is_delayed = check_ticket_delay(ticket)
     
@@ -317,8 +705,13 @@ def update_ticket_delay_status(ticket):
         # التذكرة أصبحت متأخرة
         ticket.is_delayed = True
         ticket.delay_started_at = timezone.now()
+        # ✅ زيادة ذرية لعداد التأخير
+        Ticket.objects.filter(pk=ticket.pk).update(
+            is_delayed=True,
+            delay_started_at=ticket.delay_started_at,
+            delay_count=F('delay_count') + 1
+        )
         ticket.delay_count += 1
-        ticket.save(update_fields=['is_delayed', 'delay_started_at', 'delay_count'])
         
         # تسجيل تغيير الحالة
         TicketStateLog.objects.create(
@@ -331,14 +724,23 @@ def update_ticket_delay_status(ticket):
     
     elif not is_delayed and ticket.is_delayed:
         # التذكرة لم تعد متأخرة (الموظف رد)
+        now = timezone.now()
+        delay_minutes = 0
         if ticket.delay_started_at:
             # حساب مدة التأخير
-            delay_duration = timezone.now() - ticket.delay_started_at
-            ticket.total_delay_minutes += int(delay_duration.total_seconds() / 60)
+            delay_minutes = int((now - ticket.delay_started_at).total_seconds() / 60)
         
+        # ✅ UPDATE ضيق واحد مع إضافة ذرية لمدة التأخير بدلاً من save() لكل الأعمدة
+        Ticket.objects.filter(pk=ticket.pk).update(
+            is_delayed=False,
+            delay_started_at=None,
+            total_delay_minutes=F('total_delay_minutes') + delay_minutes,
+            updated_at=now
+        )
+        ticket.total_delay_minutes += delay_minutes
         ticket.is_delayed = False
         ticket.delay_started_at = None
-        ticket.save()
+        ticket.updated_at = now
         
         # تسجيل تغيير الحالة
         TicketStateLog.objects.create(
@@ -350,6 +752,86 @@ def update_ticket_delay_status(ticket):
         )
 
 
+def bulk_update_delay_status(queryset=None):
+    """
+    تحديث حالة التأخير لمجموعة تذاكر مفتوحة بعدد ثابت من الاستعلامات
+    (نفس شروط check_ticket_delay لكن مُقيّمة في SQL بدلاً من حلقة Python)
+
+    ✅ شرط "أصبحت متأخرة" يستخدم الفهرس الجزئي tix_open_undelayed_cmsg
+
+    Args:
+        queryset: تذاكر للفحص (افتراضياً كل التذاكر المفتوحة)
+
+    Returns:
+        tuple: (عدد التذاكر التي أصبحت متأخرة, عدد التي لم تعد متأخرة)
+    """
+    if queryset is None:
+        queryset = Ticket.objects.all()
+    # ✅ إلغاء select_related القادم من المستدعي - لا يجتمع مع only() أدناه (FieldError)
+    queryset = queryset.select_related(None).filter(status='open')
+
+    now = timezone.now()
+    delay_threshold = SystemSettings.get_settings().delay_threshold_minutes
+    delay_condition = Q(
+        last_customer_message_at__isnull=False,
+        last_customer_message_at__lt=now - timedelta(minutes=delay_threshold),
+    ) & (
+        Q(last_agent_message_at__isnull=True) |
+        Q(last_agent_message_at__lte=F('last_customer_message_at'))
+    )
+
+    with transaction.atomic():
+        # التذاكر التي أصبحت متأخرة: UPDATE واحد + bulk_create للسجلات
+        newly_delayed = list(
+            queryset.filter(delay_condition, is_delayed=False).values_list('id', 'status')
+        )
+        if newly_delayed:
+            Ticket.objects.filter(pk__in=[pk for pk, _ in newly_delayed], is_delayed=False).update(
+                is_delayed=True,
+                delay_started_at=now,
+                delay_count=F('delay_count') + 1
+            )
+            TicketStateLog.objects.bulk_create([
+                TicketStateLog(
+                    ticket_id=pk,
+                    changed_by=None,  # تلقائي
+                    old_state=ticket_status,
+                    new_state='delayed',
+                    reason='تأخر الرد لأكثر من 3 دقائق'
+                )
+                for pk, ticket_status in newly_delayed
+            ])
+
+        # التذاكر التي لم تعد متأخرة (الموظف رد): مدة التأخير تُحسب لكل تذكرة ثم bulk_update
+        no_longer_delayed = list(
+            queryset.filter(is_delayed=True).exclude(delay_condition)
+            .only('id', 'status', 'delay_started_at', 'total_delay_minutes', 'is_delayed')
+        )
+        if no_longer_delayed:
+            for ticket in no_longer_delayed:
+                if ticket.delay_started_at:
+                    ticket.total_delay_minutes += int((now - ticket.delay_started_at).total_seconds() / 60)
+                ticket.is_delayed = False
+                ticket.delay_started_at = None
+                ticket.updated_at = now
+            Ticket.objects.bulk_update(
+                no_longer_delayed,
+                ['is_delayed', 'delay_started_at', 'total_delay_minutes', 'updated_at']
+            )
+            TicketStateLog.objects.bulk_create([
+                TicketStateLog(
+                    ticket_id=ticket.pk,
+                    changed_by=None,  # تلقائي
+                    old_state='delayed',
+                    new_state=ticket.status,
+                    reason='الموظف رد على الرسالة'
+                )
+                for ticket in no_longer_delayed
+            ])
+
+    return len(newly_delayed), len(no_longer_delayed)
+
+
 # ============================================================================
 # 6. AUTO-ASSIGNMENT ALGORITHM
 # ============================================================================
@@ -358,26 +840,36 @@ def get_available_agent():
     """
     الحصول على موظف متاح باستخدام خوارزمية Least Loaded (حسب الإجابة س6)
 
-    ✅ التحديث: استبعاد الموظفين في استراحة (is_on_break=True)
+    ✅ التحديث: استبعاد الموظفين في استراحة (جلسة استراحة مفتوحة)
 
     Returns:
         Agent object أو None
     """
-    from .models import Agent
-    from django.db.models import F
 
-    # البحث عن موظف متاح (ليس في استراحة)
-    available_agents = Agent.objects.filter(
-        is_online=True,
-        status='available',
-        is_on_break=False,  # ✅ استبعاد الموظفين في استراحة
-        current_active_tickets__lt=F('max_capacity')
-    ).order_by('current_active_tickets')
+    # البحث عن موظف متاح (ليس في استراحة) - استعلام واحد
+    return Agent.objects.available().not_on_break().order_by('current_active_tickets').first()  # ✅ استبعاد الموظفين في استراحة
 
-    if available_agents.exists():
-        return available_agents.first()
 
-    return None
+def claim_available_agent():
+    """
+    حجز موظف متاح ذرياً: اختيار الأقل حملاً مع قفل صفه وزيادة عداد تذاكره في نفس المعاملة
+
+    ✅ SELECT ... FOR UPDATE SKIP LOCKED يمنع تجاوز max_capacity عند وصول عدة رسائل
+    بالتزامن (كل طلب يتخطى الموظف المقفول من طلب آخر بدلاً من انتظاره)
+
+    Returns:
+        Agent object (بعد زيادة current_active_tickets) أو None
+    """
+    with transaction.atomic():
+        agent = (
+            Agent.objects.available().not_on_break()
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('current_active_tickets')
+            .first()
+        )
+        if agent:
+            agent.adjust_active_tickets(1)
+    return agent
 
 
 def assign_ticket_to_agent(ticket, agent):
@@ -390,22 +882,91 @@ def assign_ticket_to_agent(ticket, agent):
     """
     ticket.assigned_agent = agent
     ticket.current_agent = agent
-    ticket.save()
-    
-    # تحديث عدد التذاكر النشطة للموظف
-    agent.current_active_tickets += 1
-    
-    # تحديث حالة الموظف (حسب الإجابة س7: تلقائي)
-    if agent.current_active_tickets >= agent.max_capacity:
-        agent.status = 'busy'
+    ticket.save(update_fields=['assigned_agent', 'current_agent', 'updated_at'])
     
-    agent.save()
+    # تحديث عدد التذاكر النشطة للموظف + الحالة (حسب الإجابة س7: تلقائي)
+    # ✅ ذرياً بدون read-modify-write
+    agent.adjust_active_tickets(1)
+
+
+def redistribute_agent_tickets(agent, transferred_by, reason):
+    """
+    إعادة توزيع التذاكر المفتوحة لموظف على الموظفين المتاحين (Least Loaded)
+
+    ✅ عدد ثابت من الاستعلامات مهما كان عدد التذاكر: تحميل المتاحين مرة واحدة
+    والتوزيع في الذاكرة (heap حسب الحمل) ثم bulk_update + bulk_create + UPDATE واحد للعدادات
+
+    Args:
+        agent: الموظف الذي تُنقل تذاكره
+        transferred_by: المستخدم المنفذ للنقل
+        reason: سبب النقل (يُحفظ في TicketTransferLog)
+
+    Returns:
+        int: عدد التذاكر المنقولة
+    """
+    # ✅ فقط المعرف والموظف الحالي - باقي الأعمدة لا تُقرأ ولا تُكتب هنا
+    tickets = list(Ticket.objects.filter(current_agent=agent, status='open').only('id', 'current_agent').order_by('id'))
+    if not tickets:
+        return 0
+
+    candidates = list(
+        Agent.objects.available().not_on_break().exclude(pk=agent.pk)
+        .order_by('current_active_tickets')
+    )
+    heap = [(candidate.current_active_tickets, index) for index, candidate in enumerate(candidates)]
+    heapq.heapify(heap)
+
+    now = timezone.now()
+    moved = []
+    transfer_logs = []
+    deltas = {}
+    for ticket in tickets:
+        if not heap:
+            break
+        load, index = heapq.heappop(heap)
+        new_agent = candidates[index]
+
+        ticket.current_agent = new_agent
+        ticket.has_real_transfer = True  # ✅ bulk_create لا يستدعي TicketTransferLog.save
+        ticket.updated_at = now
+        moved.append(ticket)
+        transfer_logs.append(TicketTransferLog(
+            ticket=ticket,
+            from_agent=agent,
+            to_agent=new_agent,
+            transferred_by=transferred_by,
+            reason=reason
+        ))
+        deltas[new_agent.pk] = deltas.get(new_agent.pk, 0) + 1
+
+        if load + 1 < new_agent.max_capacity:
+            heapq.heappush(heap, (load + 1, index))
+
+    if not moved:
+        return 0
+
+    with transaction.atomic():
+        Ticket.objects.bulk_update(moved, ['current_agent', 'has_real_transfer', 'updated_at'])
+        TicketTransferLog.objects.bulk_create(transfer_logs)
+        Agent.objects.add_active_tickets(deltas)
+
+    return len(moved)
 
 
 # ============================================================================
 # 6. WELCOME MESSAGE & DROPDOWN MENU
 # ============================================================================
 
+def get_ticket_for_webhook(ticket_id):
+    """
+    ✅ تحميل التذكرة بأحدث حالة مع العلاقات التي يحتاجها مسار الترحيب/القائمة
+    (assigned_agent.user لمرسل الرد، customer، current_agent.user) في استعلام واحد
+    """
+    return Ticket.objects.select_related(
+        'assigned_agent__user', 'customer', 'current_agent__user'
+    ).get(pk=ticket_id)
+
+
 def send_welcome_message(customer, ticket=None):
     """
     إرسال رسالة ترحيب مع قائمة منسدلة للعميل الجديد
@@ -420,14 +981,10 @@ def send_welcome_message(customer, ticket=None):
     try:
         from .whatsapp_driver import get_whatsapp_driver
         from .message_queue import get_message_queue
-        from .models import Message, Ticket
-        from django.utils import timezone
-        import logging
         
         logger = logging.getLogger(__name__)
         
         # رسالة الترحيب
-        from .models import SystemSettings
         system_settings = SystemSettings.get_settings()
         welcome_text = system_settings.welcome_message
         
@@ -443,24 +1000,25 @@ def send_welcome_message(customer, ticket=None):
             return False
         
         # ✅ التحقق من عدم إرسال رسالة ترحيب مكررة
-        existing_welcome = Message.objects.filter(
-            ticket=ticket,
-            sender_type='agent',
-            message_text__contains='مرحباً بك في صيدليات خليفة'
-        ).first()
-        
-        if existing_welcome:
+        # حجز welcome_sent بـ UPDATE شرطي في قاعدة البيانات: عملية واحدة فقط (من أي worker) تنجح
+        claimed = Ticket.objects.filter(pk=ticket.pk, welcome_sent=False).update(welcome_sent=True)
+        if not claimed:
             logger.info(f"Welcome message already sent for ticket {ticket.ticket_number} - skipping")
             return True  # نرجع True لأن الرسالة موجودة بالفعل
         
-        # الحصول على driver
-        driver = get_whatsapp_driver()
-        
-        # إرسال الرسالة عبر النظام
-        result = driver.send_text_message(
-            phone=customer.wa_id,
-            message=welcome_text
-        )
+        try:
+            # الحصول على driver
+            driver = get_whatsapp_driver()
+            
+            # إرسال الرسالة عبر النظام
+            result = driver.send_text_message(
+                phone=customer.wa_id,
+                message=welcome_text
+            )
+        except Exception:
+            # ✅ فك الحجز حتى تُعاد المحاولة مع الرسالة التالية
+            Ticket.objects.filter(pk=ticket.pk).update(welcome_sent=False)
+            raise
         
         # حفظ الرسالة في قاعدة البيانات إذا تم الإرسال بنجاح
         if result.get('success', False):
@@ -477,12 +1035,14 @@ def send_welcome_message(customer, ticket=None):
             
             # تحديث آخر رسالة في التذكرة (بدون تحديث last_agent_message_at لأنها رسالة ترحيب تلقائية)
             ticket.last_message_at = timezone.now()
+            ticket.welcome_sent = True
             ticket.save(update_fields=['last_message_at'])
             
             logger.info(f"Welcome message sent and saved to database - Customer: {customer.phone_number}, Message ID: {welcome_message.id}")
             return True
         else:
             logger.warning(f"Welcome message sending failed for {customer.phone_number}: {result}")
+            Ticket.objects.filter(pk=ticket.pk).update(welcome_sent=False)
             return False
         
     except Exception as e:
@@ -490,53 +1050,14 @@ def send_welcome_message(customer, ticket=None):
         return False
 
 
-def handle_menu_selection(customer, message_text, ticket):
-    """
-    معالجة اختيار العميل من القائمة المنسدلة
-    
-    Args:
-        customer: كائن العميل
-        message_text: نص الرسالة
-        ticket: التذكرة الحالية
-    
-    Returns:
-        dict: نتيجة المعالجة مع رسالة الرد
-    """
-    try:
-        from .whatsapp_driver import get_whatsapp_driver
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        driver = get_whatsapp_driver()
-        
-        # تنظيف النص واستخراج الرقم
-        selection = message_text.strip()
-        
-        # معالجة الاختيارات
-        if selection in ['1', '١', 'شكوى', 'شكوي', 'استفسار']:
-            # شكوى أو استفسار
-            ticket.category = 'complaint'
-            ticket.priority = 'high'
-            ticket.category_selected_at = timezone.now()  # ✅ تسجيل وقت اختيار الفئة
-            ticket.save(update_fields=['category', 'priority', 'category_selected_at'])
-            logger.info(f"✅ Ticket {ticket.ticket_number} category updated to 'complaint' for customer {customer.phone_number}")
-
-            response_text = """✅ تم تسجيل طلبك كشكوى/استفسار
+MENU_COMPLAINT_TEXT = """✅ تم تسجيل طلبك كشكوى/استفسار
 
 🔍 سيتم تحويلك لموظف متخصص للتعامل مع شكواك
 ⏰ وقت الاستجابة المتوقع: خلال 3 دقائق
 
 يرجى وصف مشكلتك بالتفصيل ليتمكن فريقنا من مساعدتك بأفضل شكل ممكن 📝"""
 
-        elif selection in ['2', '٢', 'ادوية', 'أدوية', 'دواء']:
-            # طلب أدوية
-            ticket.category = 'medicine_order'
-            ticket.priority = 'medium'
-            ticket.category_selected_at = timezone.now()  # ✅ تسجيل وقت اختيار الفئة
-            ticket.save(update_fields=['category', 'priority', 'category_selected_at'])
-            logger.info(f"✅ Ticket {ticket.ticket_number} category updated to 'medicine_order' for customer {customer.phone_number}")
-
-            response_text = """💊 تم تسجيل طلبك لطلب أدوية
+MENU_MEDICINE_ORDER_TEXT = """💊 تم تسجيل طلبك لطلب أدوية
 
 📋 يرجى إرسال:
 • صورة من الروشتة الطبية
@@ -545,15 +1066,7 @@ def handle_menu_selection(customer, message_text, ticket):
 
 🚚 خدمة التوصيل متوفرة خلال ساعة واحدة داخل النطاق المحدد"""
 
-        elif selection in ['3', '٣', 'متابعة', 'متابعه', 'طلب سابق']:
-            # متابعة طلب سابق
-            ticket.category = 'follow_up'
-            ticket.priority = 'low'
-            ticket.category_selected_at = timezone.now()  # ✅ تسجيل وقت اختيار الفئة
-            ticket.save(update_fields=['category', 'priority', 'category_selected_at'])
-            logger.info(f"✅ Ticket {ticket.ticket_number} category updated to 'follow_up' for customer {customer.phone_number}")
-            
-            response_text = """📋 تم تسجيل طلبك لمتابعة طلب سابق
+MENU_FOLLOW_UP_TEXT = """📋 تم تسجيل طلبك لمتابعة طلب سابق
 
 🔍 يرجى تزويدنا بـ:
 • رقم الطلب السابق
@@ -561,21 +1074,59 @@ def handle_menu_selection(customer, message_text, ticket):
 • أو وصف مختصر للطلب
 
 سيتم البحث في سجلاتك وتزويدك بآخر التحديثات 📊"""
-            
-        else:
-            # اختيار غير صحيح
-            response_text = """❌ عذراً، الاختيار غير صحيح
+
+MENU_INVALID_SELECTION_TEXT = """❌ عذراً، الاختيار غير صحيح
 يرجى الاختيار من الخيارات التالية:
 1 شكوى أو استفسار
 2 طلب أدوية
 3 متابعة طلب سابق
 يرجى الرد برقم الخيار المطلوب (1، 2، أو 3) 📝"""
-            
+
+# ✅ خيارات القائمة: الرد المكتوب -> (category, priority, نص الرد)
+MENU_OPTIONS = {
+    **dict.fromkeys(['1', '١', 'شكوى', 'شكوي', 'استفسار'], ('complaint', 'high', MENU_COMPLAINT_TEXT)),
+    **dict.fromkeys(['2', '٢', 'ادوية', 'أدوية', 'دواء'], ('medicine_order', 'medium', MENU_MEDICINE_ORDER_TEXT)),
+    **dict.fromkeys(['3', '٣', 'متابعة', 'متابعه', 'طلب سابق'], ('follow_up', 'low', MENU_FOLLOW_UP_TEXT)),
+}
+
+
+def handle_menu_selection(customer, message_text, ticket):
+    """
+    معالجة اختيار العميل من القائمة المنسدلة
+    
+    Args:
+        customer: كائن العميل
+        message_text: نص الرسالة
+        ticket: التذكرة الحالية
+    
+    Returns:
+        dict: نتيجة المعالجة مع رسالة الرد
+    """
+    try:
+        from .whatsapp_driver import get_whatsapp_driver
+        
+        logger = logging.getLogger(__name__)
+        driver = get_whatsapp_driver()
+        
+        # تنظيف النص واستخراج الرقم
+        selection = message_text.strip()
+        
+        # معالجة الاختيارات (بحث واحد في قاموس الخيارات)
+        option = MENU_OPTIONS.get(selection)
+        if option is None:
+            # اختيار غير صحيح
             return {
                 'success': False,
                 'message': 'invalid_selection',
-                'response_text': response_text
+                'response_text': MENU_INVALID_SELECTION_TEXT
             }
+
+        category, priority, response_text = option
+        ticket.category = category
+        ticket.priority = priority
+        ticket.category_selected_at = timezone.now()  # ✅ تسجيل وقت اختيار الفئة
+        ticket.save(update_fields=['category', 'priority', 'category_selected_at'])
+        logger.info(f"✅ Ticket {ticket.ticket_number} category updated to '{category}' for customer {customer.phone_number}")
         
         # إرسال رسالة الرد
         result = driver.send_text_message(
@@ -585,8 +1136,6 @@ def handle_menu_selection(customer, message_text, ticket):
         
         # حفظ رسالة الرد في قاعدة البيانات إذا تم الإرسال بنجاح
         if result.get('success', False):
-            from .models import Message
-            
             response_message = Message.objects.create(
                 ticket=ticket,
                 sender=ticket.assigned_agent.user if ticket.assigned_agent else None,
@@ -635,8 +1184,6 @@ def should_send_welcome_message(customer, message_text, current_ticket=None):
     Returns:
         bool: True إذا كان يجب إرسال رسالة الترحيب
     """
-    import logging
-    from .models import Message
     logger = logging.getLogger(__name__)
     
     try:
@@ -649,11 +1196,8 @@ def should_send_welcome_message(customer, message_text, current_ticket=None):
                 logger.info(f"Ticket {current_ticket.ticket_number} already classified - skipping welcome message")
                 return False
             
-            # ✅ التحقق من عدد رسائل العميل في التذكرة الحالية
-            customer_messages_count = Message.objects.filter(
-                ticket=current_ticket, 
-                sender_type='customer'
-            ).count()
+            # ✅ عدد رسائل العميل في التذكرة الحالية (عداد يُزاد مع كل رسالة واردة)
+            customer_messages_count = current_ticket.customer_message_count
             
             logger.info(f"Customer {customer.phone_number} has {customer_messages_count} message(s) in ticket {current_ticket.ticket_number}")
             
@@ -21,7 +21,14 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth import authenticate, login as django_login, logout as django_logout
 from django.utils import timezone
-from django.db.models import Q, Count, Avg, F
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
+from django.views.decorators.http import conditional_page
+from django.db import transaction
+from django.db.models import Q, Count, Avg, F, Case, When, Min, Max, Window, IntegerField
+from django.db.models.functions import Lag
+from collections import Counter, defaultdict
+import logging
 from datetime import datetime, timedelta
 
 from .models import *
@@ -29,6 +36,42 @@ from .serializers import *
 from .permissions import *
 from .utils import *
 
+# ✅ مجموعات الأدوار ثابتة على مستوى الوحدة (بحث O(1) بدون إنشاء قائمة في كل طلب)
+SUPERVISOR_ROLES = frozenset({'admin', 'manager', 'supervisor', 'agent_supervisor'})
+VALID_CREATE_ROLES = frozenset({'agent', 'admin', 'qa', 'supervisor', 'manager', 'agent_supervisor'})
+
+# صيغة عرض أوقات الدخول/الخروج/الاستراحة في مراقبة الموظفين
+ACTIVITY_TIME_FORMAT = '%I:%M %p'
+
+# ✅ شارة الحالة في status_list حسب (is_online, status) - جدول ثابت بدلاً من التفرع لكل صف
+OFFLINE_STATUS_BADGE = ('Offline', 'badge-offline')
+AGENT_STATUS_BADGES = {
+    (True, status_value): ('Online', 'badge-online') if status_value == 'available' else ('Busy', 'badge-busy')
+    for status_value, _ in Agent.STATUS_CHOICES
+}
+
+
+def _agent_state_payload(agent):
+    """
+    حالة الموظف المختصرة لردود الإجراءات (بدلاً من AgentSerializer الكامل)
+    """
+    return {
+        'id': agent.id,
+        'is_online': agent.is_online,
+        'status': agent.status,
+        'is_active': agent.user.is_active,
+    }
+
+
+def _safe_log_activity(**kwargs):
+    """
+    تسجيل النشاط دون إفشال الطلب - الخطأ يُكتب في السجل بدلاً من تجاهله بصمت
+    """
+    try:
+        log_activity(**kwargs)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Failed to log {kwargs.get('action')} activity: {str(e)}")
+
 
 # ============================================================================
 # GROUP 1: AUTHENTICATION VIEWS
@@ -51,11 +94,7 @@ class LoginView(views.APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # التحقق من محاولات تسجيل الدخول الفاشلة (حسب الإجابة: 5 محاولات → 15 دقيقة)
-        recent_attempts = LoginAttempt.objects.filter(
-            username=username,
-            success=False,
-            attempt_time__gte=timezone.now() - timedelta(minutes=15)
-        ).count()
+        recent_attempts = LoginAttempt.recent_failed_count(username, minutes=15)
         
         if recent_attempts >= 5:
             return Response({
@@ -69,10 +108,10 @@ class LoginView(views.APIView):
             # التحقق من أن الحساب نشط
             if not user.is_active:
                 # تسجيل المحاولة الفاشلة
-                LoginAttempt.objects.create(
-                    username=username,
-                    ip_address=request.META.get('REMOTE_ADDR'),
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')[:255],
+                LoginAttempt.record(
+                    username,
+                    request.META.get('REMOTE_ADDR'),
+                    get_client_info(request)[1],
                     success=False
                 )
 
@@ -88,10 +127,10 @@ class LoginView(views.APIView):
             user.save()
 
             # تسجيل المحاولة الناجحة
-            LoginAttempt.objects.create(
-                username=username,
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')[:255],
+            LoginAttempt.record(
+                username,
+                request.META.get('REMOTE_ADDR'),
+                get_client_info(request)[1],
                 success=True
             )
 
@@ -111,7 +150,7 @@ class LoginView(views.APIView):
                     agent.is_online = True
                     agent.status = 'available'
                     agent.save()
-                except:
+                except Agent.DoesNotExist:
                     pass
 
             # إرجاع بيانات المستخدم
@@ -124,10 +163,10 @@ class LoginView(views.APIView):
 
         else:
             # فشل تسجيل الدخول
-            LoginAttempt.objects.create(
-                username=username,
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')[:255],
+            LoginAttempt.record(
+                username,
+                request.META.get('REMOTE_ADDR'),
+                get_client_info(request)[1],
                 success=False
             )
 
@@ -161,47 +200,18 @@ class LogoutView(views.APIView):
             )
 
             # تحديث حالة الموظف إذا كان موظفاً (حسب الإجابة س8: إعادة توزيع تلقائية)
-            if user.role == 'agent':
-                try:
-                    agent = user.agent
-                    agent.is_online = False
-                    agent.status = 'offline'
-
-                    # إعادة توزيع التذاكر النشطة
-                    active_tickets = Ticket.objects.filter(
-                        current_agent=agent,
-                        status='open'
-                    )
+            # ✅ agent محمّل مع المستخدم (CustomUserBackend.get_user) - بدون استعلام أو try/except
+            agent = getattr(user, 'agent', None)
+            if user.role == 'agent' and agent is not None:
+                agent.is_online = False
+                agent.status = 'offline'
 
-                    for ticket in active_tickets:
-                        # البحث عن موظف متاح
-                        new_agent = get_available_agent()
-
-                        if new_agent:
-                            # نقل التذكرة
-                            old_agent = ticket.current_agent
-                            ticket.current_agent = new_agent
-                            ticket.save()
-
-                            # تسجيل النقل
-                            TicketTransferLog.objects.create(
-                                ticket=ticket,
-                                from_agent=old_agent,
-                                to_agent=new_agent,
-                                transferred_by=user,
-                                reason='تسجيل خروج الموظف'
-                            )
-
-                            # تحديث عدد التذاكر
-                            new_agent.current_active_tickets += 1
-                            new_agent.save()
-
-                    # تصفير عدد التذاكر النشطة
-                    agent.current_active_tickets = 0
-                    agent.save()
+                # إعادة توزيع التذاكر النشطة (دفعة واحدة)
+                redistribute_agent_tickets(agent, transferred_by=user, reason='تسجيل خروج الموظف')
 
-                except:
-                    pass
+                # تصفير عدد التذاكر النشطة
+                agent.current_active_tickets = 0
+                agent.save()
 
         # استخدام Django's logout
         django_logout(request)
@@ -232,19 +242,16 @@ class ProfileView(views.APIView):
         # إضافة بيانات إضافية حسب الدور
         data = serializer.data
 
+        # ✅ agent/admin محمّلان مع المستخدم (CustomUserBackend.get_user)
         if user.role == 'agent':
-            try:
-                agent = user.agent
+            agent = getattr(user, 'agent', None)
+            if agent is not None:
                 data['agent'] = AgentSerializer(agent).data
-            except:
-                pass
 
         elif user.role == 'admin':
-            try:
-                admin = user.admin
+            admin = getattr(user, 'admin', None)
+            if admin is not None:
                 data['admin'] = AdminSerializer(admin).data
-            except:
-                pass
 
         return Response(data, status=status.HTTP_200_OK)
 
@@ -295,18 +302,14 @@ class UserViewSet(viewsets.ModelViewSet):
         user = serializer.save()
 
         # تسجيل النشاط
-        try:
-            current_user = self.request.user
-            if current_user and current_user.is_authenticated:
-                log_activity(
-                    user=current_user,
-                    action='create',
-                    entity_type='user',
-                    entity_id=user.id,
-                    request=self.request
-                )
-        except:
-            pass
+        if self.request.user.is_authenticated:
+            _safe_log_activity(
+                user=self.request.user,
+                action='create',
+                entity_type='user',
+                entity_id=user.id,
+                request=self.request
+            )
 
     @action(detail=True, methods=['post'])
     def force_logout(self, request, pk=None):
@@ -318,7 +321,7 @@ class UserViewSet(viewsets.ModelViewSet):
         user = agent.user
 
         # التحقق من الصلاحيات (مشرف أو مدير)
-        if request.user.role not in ['admin', 'manager', 'supervisor', 'agent_supervisor']:
+        if request.user.role not in SUPERVISOR_ROLES:
             return Response({
                 'success': False,
                 'error': 'غير مصرح لك بهذا الإجراء'
@@ -333,24 +336,19 @@ class UserViewSet(viewsets.ModelViewSet):
             agent.is_online = False
             agent.status = 'offline'
             
-            # إذا كان في استراحة، إنهاؤها
-            if agent.is_on_break:
-                agent.is_on_break = False
-                agent.break_started_at = None
+            # إذا كان في استراحة، إنهاؤها (إغلاق جلسة الاستراحة المفتوحة)
+            agent.end_break()
             
-            agent.save()
+            agent.save(update_fields=['is_online', 'status', 'updated_at'])
 
             # تسجيل النشاط
-            try:
-                log_activity(
-                    user=request.user,
-                    action='force_logout',
-                    entity_type='agent',
-                    entity_id=agent.id,
-                    request=request
-                )
-            except:
-                pass
+            _safe_log_activity(
+                user=request.user,
+                action='force_logout',
+                entity_type='agent',
+                entity_id=agent.id,
+                request=request
+            )
 
             serializer = self.get_serializer(agent)
             return Response({
@@ -395,17 +393,14 @@ class UserViewSet(viewsets.ModelViewSet):
             user.set_password(new_password)
             user.save()
 
-            try:
-                log_activity(
-                    user=request.user,
-                    action='reset_password',
-                    entity_type='user',
-                    entity_id=user.id,
-                    new_value=f'تم تغيير كلمة المرور للمستخدم {user.username}',
-                    request=request
-                )
-            except:
-                pass
+            _safe_log_activity(
+                user=request.user,
+                action='reset_password',
+                entity_type='user',
+                entity_id=user.id,
+                new_value=f'تم تغيير كلمة المرور للمستخدم {user.username}',
+                request=request
+            )
 
             return Response({
                 'success': True,
@@ -423,41 +418,38 @@ class AgentViewSet(viewsets.ModelViewSet):
     """
     إدارة الموظفين
     """
-    queryset = Agent.objects.select_related('user').all()
+    queryset = Agent.objects.all()
     serializer_class = AgentSerializer
     permission_classes = [IsAdmin]
 
+    # ✅ أعمدة المستخدم غير المعروضة في AgentSerializer (لا تُجلب في القوائم للقراءة فقط)
+    LIST_DEFERRED_FIELDS = ('user__password_hash', 'user__is_staff', 'user__is_superuser')
+
+    def get_queryset(self):
+        queryset = AgentSerializer.setup_eager_loading(super().get_queryset())
+        if self.action == 'list':
+            queryset = queryset.defer(*self.LIST_DEFERRED_FIELDS)
+        return queryset
+
     @action(detail=False, methods=['get'])
     def status_list(self, request):
         """
         Get status of all agents for real-time monitoring
         GET /api/agents/status_list/
         """
-        agents = Agent.objects.select_related('user').all()
+        # ✅ قواميس فقط (بدون بناء كائنات Agent/User وبدون JOIN)
+        agents = Agent.objects.values(
+            'id', 'user_id', 'is_online', 'status', 'current_active_tickets', 'max_capacity'
+        )
         data = []
         
         for agent in agents:
-            status_display = 'Offline'
-            status_class = 'badge-offline'
-            
-            if agent.is_online:
-                if agent.status == 'available':
-                    status_display = 'Online'
-                    status_class = 'badge-online'
-                else:
-                    status_display = 'Busy'
-                    status_class = 'badge-busy'
-            
-            data.append({
-                'id': agent.id,
-                'user_id': agent.user.id,
-                'is_online': agent.is_online,
-                'status': agent.status,
-                'status_display': status_display,
-                'status_class': status_class,
-                'current_active_tickets': agent.current_active_tickets,
-                'max_capacity': agent.max_capacity
-            })
+            status_display, status_class = AGENT_STATUS_BADGES.get(
+                (agent['is_online'], agent['status']), OFFLINE_STATUS_BADGE
+            )
+            agent['status_display'] = status_display
+            agent['status_class'] = status_class
+            data.append(agent)
             
         return Response(data)
 
@@ -468,11 +460,14 @@ class AgentViewSet(viewsets.ModelViewSet):
         GET /api/agents/activity_list/
         """
         # Check permissions
-        if request.user.role not in ['admin', 'manager', 'supervisor', 'agent_supervisor']:
+        if request.user.role not in SUPERVISOR_ROLES:
              return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
-        agents = Agent.objects.select_related('user').filter(user__is_active=True).order_by('user__full_name')
-        today = timezone.now().date()
+        agents = Agent.objects.select_related('user').with_break_state().filter(user__is_active=True).order_by('user__full_name')
+        # ✅ الوقت والمنطقة الزمنية مرة واحدة للطلب بدلاً من كل صف
+        now = timezone.now()
+        local_tz = timezone.get_current_timezone()
+        today = now.date()
         date_from_str = request.GET.get('date_from')
         date_to_str = request.GET.get('date_to')
         if date_from_str:
@@ -492,41 +487,65 @@ class AgentViewSet(viewsets.ModelViewSet):
         includes_today = (date_from <= today <= date_to)
         data = []
 
+        agents = list(agents)
+
+        agent_id_by_user = {agent.user_id: agent.id for agent in agents}
+        agent_ids = list(agent_id_by_user.values())
+        # ✅ حدود زمنية صريحة بدلاً من created_at__date حتى تُستخدم الفهارس المركبة
+        range_start = timezone.make_aware(datetime.combine(date_from, datetime.min.time()))
+        range_end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+        period_logs = ActivityLog.objects.filter(created_at__gte=range_start, created_at__lt=range_end)
+
+        # ✅ أول دخول وآخر خروج لكل موظف بتجميع شرطي في SQL
+        # (login/logout مسجلة على المستخدم، force_logout مسجلة على الموظف كـ entity)
+        session_times = {
+            row['agent_key']: (row['first_login'], row['last_logout'])
+            for row in period_logs.filter(
+                Q(user_id__in=list(agent_id_by_user), action__in=['login', 'logout']) |
+                Q(entity_type='agent', entity_id__in=agent_ids, action='force_logout')
+            ).annotate(
+                agent_key=Case(
+                    When(action='force_logout', then=F('entity_id')),
+                    default=F('user__agent__id'),
+                    output_field=IntegerField(),
+                )
+            ).values('agent_key').annotate(
+                first_login=Min(Case(When(action='login', then='created_at'))),
+                last_logout=Max(Case(When(action__in=['logout', 'force_logout'], then='created_at'))),
+            ).order_by()
+        }
+
+        # ✅ ربط كل break_end بالـ break_start السابق مباشرة عبر LAG في SQL
+        previous_log = {
+            'partition_by': [F('entity_id')],
+            'order_by': [F('created_at').asc(), F('id').asc()],
+        }
+        breaks_by_agent = defaultdict(list)
+        break_logs = period_logs.filter(
+            entity_type='agent', entity_id__in=agent_ids, action__in=['break_start', 'break_end']
+        ).annotate(
+            prev_action=Window(Lag('action'), **previous_log),
+            prev_created_at=Window(Lag('created_at'), **previous_log),
+        ).values_list('entity_id', 'action', 'prev_action', 'prev_created_at', 'created_at').order_by('created_at', 'id')
+        # ✅ iterator: قراءة السجلات على دفعات بدلاً من تحميل الفترة كاملة في الذاكرة
+        for agent_id, log_action, prev_action, break_start, break_end in break_logs.iterator(chunk_size=2000):
+            # فلترة action هنا وليس في SQL: شرط WHERE يُطبق قبل حساب LAG فيُسقط صفوف break_start
+            if log_action != 'break_end' or prev_action != 'break_start':
+                continue
+            breaks_by_agent[agent_id].append({
+                'start': break_start,
+                'end': break_end,
+                'duration': int((break_end - break_start).total_seconds() / 60)
+            })
+
         for agent in agents:
-            activities = ActivityLog.objects.filter(
-                created_at__date__range=[date_from, date_to]
-            ).filter(
-                Q(user=agent.user, action__in=['login', 'logout']) |
-                Q(entity_type='agent', entity_id=agent.id, action__in=['break_start', 'break_end', 'force_logout'])
-            ).order_by('created_at')
-            
-            login_time = None
-            logout_time = None
-            breaks = []
-            current_break_start = None
-            
-            for activity in activities:
-                if activity.action == 'login':
-                    if not login_time:
-                        login_time = activity.created_at
-                elif activity.action in ['logout', 'force_logout']:
-                    logout_time = activity.created_at
-                elif activity.action == 'break_start':
-                    current_break_start = activity.created_at
-                elif activity.action == 'break_end':
-                    if current_break_start:
-                        duration = (activity.created_at - current_break_start).total_seconds() / 60
-                        breaks.append({
-                            'start': current_break_start,
-                            'end': activity.created_at,
-                            'duration': int(duration)
-                        })
-                        current_break_start = None
+            login_time, logout_time = session_times.get(agent.id, (None, None))
+            breaks = breaks_by_agent[agent.id]
             
             if includes_today and agent.is_on_break and agent.break_started_at:
                 bs_date = agent.break_started_at.date()
                 if date_from <= bs_date <= date_to:
-                    duration = (timezone.now() - agent.break_started_at).total_seconds() / 60
+                    duration = (now - agent.break_started_at).total_seconds() / 60
                     breaks.append({
                         'start': agent.break_started_at,
                         'end': None,
@@ -536,14 +555,14 @@ class AgentViewSet(viewsets.ModelViewSet):
             
             # Format for JSON
             # Convert to local time before formatting
-            login_str = timezone.localtime(login_time).strftime('%I:%M %p') if login_time else None
-            logout_str = timezone.localtime(logout_time).strftime('%I:%M %p') if logout_time else None
+            login_str = login_time.astimezone(local_tz).strftime(ACTIVITY_TIME_FORMAT) if login_time else None
+            logout_str = logout_time.astimezone(local_tz).strftime(ACTIVITY_TIME_FORMAT) if logout_time else None
             
             breaks_data = []
             for b in breaks:
                 breaks_data.append({
-                    'start': timezone.localtime(b['start']).strftime('%I:%M %p'),
-                    'end': timezone.localtime(b['end']).strftime('%I:%M %p') if b['end'] else None,
+                    'start': b['start'].astimezone(local_tz).strftime(ACTIVITY_TIME_FORMAT),
+                    'end': b['end'].astimezone(local_tz).strftime(ACTIVITY_TIME_FORMAT) if b['end'] else None,
                     'duration': b['duration'],
                     'is_active': b.get('is_active', False)
                 })
@@ -615,11 +634,10 @@ class AgentViewSet(viewsets.ModelViewSet):
                 role = request.data.get('role', 'agent')
                 
                 # التحقق من صحة الدور
-                valid_roles = ['agent', 'admin', 'qa', 'supervisor', 'manager', 'agent_supervisor']
-                if role not in valid_roles:
+                if role not in VALID_CREATE_ROLES:
                     return Response({
                         'success': False,
-                        'error': f'الدور غير صحيح. الأدوار المتاحة: {", ".join(valid_roles)}'
+                        'error': f'الدور غير صحيح. الأدوار المتاحة: {", ".join(sorted(VALID_CREATE_ROLES))}'
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
                 # ✅ الحصول على الإعدادات
@@ -686,16 +704,13 @@ class AgentViewSet(viewsets.ModelViewSet):
                     serializer = UserSerializer(user)
 
                 # 3. تسجيل النشاط
-                try:
-                    log_activity(
-                        user=request.user,
-                        action='create',
-                        entity_type=entity_type,
-                        entity_id=entity_id,
-                        request=request
-                    )
-                except:
-                    pass
+                _safe_log_activity(
+                    user=request.user,
+                    action='create',
+                    entity_type=entity_type,
+                    entity_id=entity_id,
+                    request=request
+                )
 
                 # 4. إرجاع البيانات
                 role_names = {
@@ -724,11 +739,10 @@ class AgentViewSet(viewsets.ModelViewSet):
         الحصول على الموظفين المتاحين
         GET /api/agents/available/
         """
-        available_agents = Agent.objects.filter(
-            is_online=True,
-            status='available',
-            current_active_tickets__lt=F('max_capacity')
-        ).select_related('user')
+        # ✅ السعة المتاحة محسوبة في SQL (with_availability) - الأكثر سعة أولاً
+        available_agents = AgentSerializer.setup_eager_loading(
+            Agent.objects.available()
+        ).defer(*self.LIST_DEFERRED_FIELDS).order_by('-available_capacity', 'id')
 
         serializer = self.get_serializer(available_agents, many=True)
         return Response(serializer.data)
@@ -830,30 +844,26 @@ class AgentViewSet(viewsets.ModelViewSet):
 
         try:
             user.is_active = is_active
-            user.save()
+            user.save(update_fields=['is_active', 'updated_at'])
 
             # إذا تم تعطيل الموظف، تحديث حالته
             if not is_active:
                 agent.is_online = False
                 agent.status = 'offline'
-                agent.save()
+                agent.save(update_fields=['is_online', 'status', 'updated_at'])
 
             # تسجيل النشاط
-            try:
-                log_activity(
-                    user=request.user,
-                    action='update',
-                    entity_type='agent',
-                    entity_id=agent.id,
-                    request=request
-                )
-            except:
-                pass
+            _safe_log_activity(
+                user=request.user,
+                action='update',
+                entity_type='agent',
+                entity_id=agent.id,
+                request=request
+            )
 
-            serializer = self.get_serializer(agent)
             return Response({
                 'success': True,
-                'data': serializer.data,
+                'data': _agent_state_payload(agent),
                 'message': f'تم {"تفعيل" if is_active else "تعطيل"} الموظف بنجاح'
             })
 
@@ -901,63 +911,36 @@ class AgentViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # ✅ تحويل التذاكر المفتوحة لموظفين آخرين
-            from .utils import get_available_agent
-            open_tickets = Ticket.objects.filter(
-                current_agent=agent,
-                status='open'
-            )
-            
-            transferred_count = 0
-            for ticket in open_tickets:
-                # البحث عن موظف متاح
-                new_agent = get_available_agent()
-                if new_agent:
-                    # تحويل التذكرة
-                    ticket.current_agent = new_agent
-                    ticket.save()
-                    
-                    # إنشاء سجل التحويل
-                    TicketTransferLog.objects.create(
-                        ticket=ticket,
-                        from_agent=agent,
-                        to_agent=new_agent,
-                        reason='تحويل تلقائي - الموظف في استراحة',
-                        transferred_by=request.user
-                    )
-                    
-                    transferred_count += 1
-                    
-                    # تحديث عدد التذاكر للموظف الجديد
-                    new_agent.current_active_tickets = Ticket.objects.filter(
-                        current_agent=new_agent,
-                        status='open'
-                    ).count()
-                    if new_agent.current_active_tickets >= new_agent.max_capacity:
-                        new_agent.status = 'busy'
-                    new_agent.save()
-            
-            # تحديث حالة الموظف
-            agent.is_on_break = True
-            agent.break_started_at = timezone.now()
-            agent.status = 'on_break'
-            agent.current_active_tickets = 0  # ✅ تصفير عدد التذاكر
-            agent.save()
+            # ✅ قفل صف الموظف طوال التحويل وفتح الاستراحة (منع استراحتين متزامنتين)
+            with transaction.atomic():
+                agent = Agent.objects.select_for_update(of=('self',)).select_related('user').get(pk=agent.pk)
+                if agent.is_on_break:
+                    return Response({
+                        'success': False,
+                        'error': 'الموظف في استراحة بالفعل'
+                    }, status=status.HTTP_400_BAD_REQUEST)
 
-            # تسجيل النشاط
-            try:
-                log_activity(
-                    user=request.user,
-                    action='break_start',
-                    entity_type='agent',
-                    entity_id=agent.id,
-                    request=request
+                # ✅ تحويل التذاكر المفتوحة لموظفين آخرين (دفعة واحدة - Least Loaded)
+                transferred_count = redistribute_agent_tickets(
+                    agent,
+                    transferred_by=request.user,
+                    reason='تحويل تلقائي - الموظف في استراحة'
                 )
-            except Exception as log_error:
-                # Log the error but don't fail the request
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Failed to log break_start activity: {str(log_error)}")
+
+                # تحديث حالة الموظف + فتح جلسة استراحة جديدة
+                agent.start_break()
+                agent.status = 'on_break'
+                agent.current_active_tickets = 0  # ✅ تصفير عدد التذاكر
+                agent.save(update_fields=['status', 'current_active_tickets', 'updated_at'])
+
+            # تسجيل النشاط
+            _safe_log_activity(
+                user=request.user,
+                action='break_start',
+                entity_type='agent',
+                entity_id=agent.id,
+                request=request
+            )
 
             serializer = self.get_serializer(agent)
             message = f'تم بدء الاستراحة بنجاح. تم تحويل {transferred_count} تذكرة لموظفين آخرين.' if transferred_count > 0 else 'تم بدء الاستراحة بنجاح. لن تستقبل تذاكر جديدة حتى تنهي الاستراحة.'
@@ -1016,53 +999,30 @@ class AgentViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            from .models import AgentBreakSession
-
-            # حساب مدة الاستراحة
-            break_minutes = 0
-            break_seconds = 0
-            break_start_time = agent.break_started_at
-
-            if agent.break_started_at:
-                break_duration = timezone.now() - agent.break_started_at
-                break_seconds = int(break_duration.total_seconds())
-                break_minutes = int(break_seconds / 60)
-                agent.total_break_minutes_today += break_minutes
-
-                # ✅ إنشاء سجل جلسة الاستراحة
-                AgentBreakSession.objects.create(
-                    agent=agent,
-                    break_start_time=break_start_time,
-                    break_end_time=timezone.now(),
-                    break_duration_seconds=break_seconds
-                )
+            # ✅ قفل صف الموظف أثناء إغلاق الاستراحة وتحديد الحالة
+            with transaction.atomic():
+                agent = Agent.objects.select_for_update(of=('self',)).select_related('user').get(pk=agent.pk)
 
-            # تحديث حالة الموظف
-            agent.is_on_break = False
-            agent.break_started_at = None
+                # ✅ إغلاق جلسة الاستراحة المفتوحة وحساب مدتها
+                session = agent.end_break()
+                break_minutes = int(session.break_duration_seconds / 60) if session else 0
 
-            # تحديد الحالة بناءً على عدد التذاكر
-            if agent.current_active_tickets >= agent.max_capacity:
-                agent.status = 'busy'
-            else:
-                agent.status = 'available'
+                # تحديد الحالة بناءً على عدد التذاكر
+                if agent.current_active_tickets >= agent.max_capacity:
+                    agent.status = 'busy'
+                else:
+                    agent.status = 'available'
 
-            agent.save()
+                agent.save(update_fields=['status', 'updated_at'])
 
             # تسجيل النشاط
-            try:
-                log_activity(
-                    user=request.user,
-                    action='break_end',
-                    entity_type='agent',
-                    entity_id=agent.id,
-                    request=request
-                )
-            except Exception as log_error:
-                # Log the error but don't fail the request
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Failed to log break_end activity: {str(log_error)}")
+            _safe_log_activity(
+                user=request.user,
+                action='break_end',
+                entity_type='agent',
+                entity_id=agent.id,
+                request=request
+            )
 
             serializer = self.get_serializer(agent)
             return Response({
@@ -1090,44 +1050,43 @@ class AgentViewSet(viewsets.ModelViewSet):
         user = agent.user
 
         # التحقق من الصلاحيات (مشرف أو مدير)
-        if request.user.role not in ['admin', 'manager', 'supervisor', 'agent_supervisor']:
+        if request.user.role not in SUPERVISOR_ROLES:
             return Response({
                 'success': False,
                 'error': 'غير مصرح لك بهذا الإجراء'
             }, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            # تحديث حالة المستخدم
-            user.is_online = False
-            user.save(update_fields=['is_online'])
+            # ✅ قفل صف الموظف حتى يُطبَّق الخروج وإغلاق الاستراحة معاً
+            with transaction.atomic():
+                agent = Agent.objects.select_for_update(of=('self',)).select_related('user').get(pk=agent.pk)
+                user = agent.user
 
-            # تحديث حالة الموظف
-            agent.is_online = False
-            agent.status = 'offline'
-            
-            # إذا كان في استراحة، إنهاؤها
-            if agent.is_on_break:
-                agent.is_on_break = False
-                agent.break_started_at = None
-            
-            agent.save()
+                # تحديث حالة المستخدم
+                user.is_online = False
+                user.save(update_fields=['is_online'])
+
+                # تحديث حالة الموظف
+                agent.is_online = False
+                agent.status = 'offline'
+
+                # إذا كان في استراحة، إنهاؤها (إغلاق جلسة الاستراحة المفتوحة)
+                agent.end_break()
+
+                agent.save(update_fields=['is_online', 'status', 'updated_at'])
 
             # تسجيل النشاط
-            try:
-                log_activity(
-                    user=request.user,
-                    action='force_logout',
-                    entity_type='agent',
-                    entity_id=agent.id,
-                    request=request
-                )
-            except:
-                pass
+            _safe_log_activity(
+                user=request.user,
+                action='force_logout',
+                entity_type='agent',
+                entity_id=agent.id,
+                request=request
+            )
 
-            serializer = self.get_serializer(agent)
             return Response({
                 'success': True,
-                'data': serializer.data,
+                'data': _agent_state_payload(agent),
                 'message': f'تم تسجيل خروج الموظف {user.full_name} بنجاح'
             })
 
@@ -1171,17 +1130,14 @@ class AgentViewSet(viewsets.ModelViewSet):
             user.save()
 
             # تسجيل النشاط
-            try:
-                log_activity(
-                    user=request.user,
-                    action='update',
-                    entity_type='agent',
-                    entity_id=agent.id,
-                    details={'action': 'password_reset'},
-                    request=request
-                )
-            except:
-                pass
+            _safe_log_activity(
+                user=request.user,
+                action='update',
+                entity_type='agent',
+                entity_id=agent.id,
+                details={'action': 'password_reset'},
+                request=request
+            )
 
             return Response({
                 'success': True,
@@ -1199,16 +1155,21 @@ class AgentViewSet(viewsets.ModelViewSet):
 # GROUP 3: CUSTOMER MANAGEMENT VIEWS
 # ============================================================================
 
+# ✅ GET شرطي لقوائم العملاء والتذاكر (ETag من محتوى الاستجابة + If-None-Match => 304)
+# لوحات المتابعة تستطلع هذه القوائم باستمرار - الاستجابة غير المتغيرة لا تُرسل من جديد
+# (ETag من المحتوى وليس من max(updated_at) لأن بعض التحديثات تتم بـ .update() بدون updated_at
+# والقوائم تعرض بيانات مرتبطة مثل اسم العميل والموظف والتصنيفات)
+@method_decorator(conditional_page, name='list')
 class CustomerViewSet(viewsets.ModelViewSet):
     """
     إدارة العملاء
     """
-    queryset = Customer.objects.prefetch_related('tags', 'notes_list').all()
+    queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAdminOrAgent]
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = CustomerSerializer.setup_eager_loading(super().get_queryset())
 
         # البحث
         search = self.request.query_params.get('search', None)
@@ -1242,18 +1203,14 @@ class CustomerViewSet(viewsets.ModelViewSet):
         customer.save()
 
         # تسجيل النشاط
-        try:
-            user = request.user
-            if user and user.is_authenticated:
-                log_activity(
-                    user=user,
-                    action='block',
-                    entity_type='customer',
-                    entity_id=customer.id,
-                    request=request
-                )
-        except:
-            pass
+        if request.user.is_authenticated:
+            _safe_log_activity(
+                user=request.user,
+                action='block',
+                entity_type='customer',
+                entity_id=customer.id,
+                request=request
+            )
 
         return Response({
             'message': 'تم حظر العميل بنجاح'
@@ -1270,18 +1227,14 @@ class CustomerViewSet(viewsets.ModelViewSet):
         customer.save()
 
         # تسجيل النشاط
-        try:
-            user = request.user
-            if user and user.is_authenticated:
-                log_activity(
-                    user=user,
-                    action='unblock',
-                    entity_type='customer',
-                    entity_id=customer.id,
-                    request=request
-                )
-        except:
-            pass
+        if request.user.is_authenticated:
+            _safe_log_activity(
+                user=request.user,
+                action='unblock',
+                entity_type='customer',
+                entity_id=customer.id,
+                request=request
+            )
 
         return Response({
             'message': 'تم إلغاء حظر العميل بنجاح'
@@ -1292,18 +1245,32 @@ class CustomerViewSet(viewsets.ModelViewSet):
 # GROUP 4: TICKET MANAGEMENT VIEWS (CORE)
 # ============================================================================
 
+# ✅ GET شرطي لقائمة التذاكر (انظر CustomerViewSet)
+@method_decorator(conditional_page, name='list')
 class TicketViewSet(viewsets.ModelViewSet):
     """
     إدارة التذاكر (قلب النظام)
     """
-    queryset = Ticket.objects.select_related(
-        'customer', 'assigned_agent__user', 'current_agent__user'
-    ).prefetch_related('state_changes', 'transfers').all()
-    serializer_class = TicketSerializer
+    queryset = Ticket.objects.all()
+    serializer_class = TicketDetailSerializer
     permission_classes = [IsAdminOrAgent]
 
+    def get_serializer_class(self):
+        # القوائم والتفاصيل بدون السجلات المتداخلة - السجلات من /history/ فقط
+        if self.action == 'list':
+            return TicketListSerializer
+        return TicketDetailSerializer
+
+    @cached_property
+    def _agent(self):
+        """
+        ملف الموظف للمستخدم الحالي - يُحسب مرة واحدة لكل طلب (نسخة الـ ViewSet لكل طلب)
+        ✅ request.user محمّل مع agent عبر CustomUserBackend.get_user فلا استعلام إضافي
+        """
+        return getattr(self.request.user, 'agent', None)
+
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = self.get_serializer_class().setup_eager_loading(super().get_queryset())
         user = self.request.user
 
         if not user or not user.is_authenticated:
@@ -1311,32 +1278,33 @@ class TicketViewSet(viewsets.ModelViewSet):
 
         # الموظفون: التذاكر المعينة لهم + التذاكر المغلقة للعملاء الذين يشاهدونها
         if user.role == 'agent':
-            try:
-                agent = user.agent
-                
-                # التصفية حسب العميل (إذا كان محدداً في المعاملات)
-                customer_id = self.request.query_params.get('customer', None)
-                
-                if customer_id:
-                    # إذا كان يشاهد محادثة عميل معين، اعرض:
-                    # 1. التذاكر المفتوحة المعينة له
-                    # 2. جميع التذاكر المغلقة لهذا العميل (حتى لو لم تكن معينة له)
-                    queryset = queryset.filter(
-                        Q(customer_id=customer_id) & 
-                        (
-                            Q(assigned_agent=agent) | 
-                            Q(current_agent=agent) | 
-                            Q(status='closed')
-                        )
-                    )
-                else:
-                    # عرض عام: فقط التذاكر المعينة له
-                    queryset = queryset.filter(
-                        Q(assigned_agent=agent) | Q(current_agent=agent)
-                    )
-            except:
+            agent = self._agent
+            if agent is None:
+                return queryset.none()
+            # التصفية حسب العميل (إذا كان محدداً في المعاملات)
+            customer_id = self.request.query_params.get('customer', None)
+            if customer_id and not customer_id.isdigit():
+                # معرف غير صالح (مثل undefined من الواجهة) - لا تذاكر
                 return queryset.none()
 
+            if customer_id:
+                # إذا كان يشاهد محادثة عميل معين، اعرض:
+                # 1. التذاكر المفتوحة المعينة له
+                # 2. جميع التذاكر المغلقة لهذا العميل (حتى لو لم تكن معينة له)
+                queryset = queryset.filter(
+                    Q(customer_id=customer_id) & 
+                    (
+                        Q(assigned_agent=agent) | 
+                        Q(current_agent=agent) | 
+                        Q(status='closed')
+                    )
+                )
+            else:
+                # عرض عام: فقط التذاكر المعينة له
+                queryset = queryset.filter(
+                    Q(assigned_agent=agent) | Q(current_agent=agent)
+                )
+
         # المديرون: جميع التذاكر
         # (لا حاجة لتصفية)
         else:
@@ -1371,6 +1339,20 @@ class TicketViewSet(viewsets.ModelViewSet):
 
         return queryset.order_by('-created_at')
 
+    def list(self, request, *args, **kwargs):
+        """
+        القائمة تُقرأ عبر .values() مباشرة دون بناء كائنات Ticket والعلاقات المرتبطة
+        """
+        queryset = TicketListSerializer.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = TicketListSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = TicketListSerializer(queryset, many=True)
+        return Response(serializer.data)
+
     def retrieve(self, request, *args, **kwargs):
         """
         استرجاع تذكرة محددة - مع التحقق من الصلاحيات
@@ -1380,23 +1362,34 @@ class TicketViewSet(viewsets.ModelViewSet):
         # التحقق من صلاحية الوصول
         user = request.user
         if user.role == 'agent':
-            try:
-                agent = user.agent
-                # تحقق من أن التذكرة معينة لهذا الموظف
-                if instance.assigned_agent != agent and instance.current_agent != agent:
-                    return Response(
-                        {'detail': 'ليس لديك صلاحية الوصول لهذه التذكرة'},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
-            except:
+            agent = self._agent
+            if agent is None:
                 return Response(
                     {'detail': 'خطأ في التحقق من الصلاحيات'},
                     status=status.HTTP_403_FORBIDDEN
                 )
+            # تحقق من أن التذكرة معينة لهذا الموظف (مقارنة المعرفات بدون تحميل العلاقات)
+            if agent.id not in (instance.assigned_agent_id, instance.current_agent_id):
+                return Response(
+                    {'detail': 'ليس لديك صلاحية الوصول لهذه التذكرة'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        سجلات الحالة والنقل للتذكرة
+        GET /api/tickets/{id}/history/
+        """
+        ticket = self.get_object()
+        return Response({
+            'state_logs': TicketStateLogSerializer(ticket.state_changes.all(), many=True).data,
+            'transfer_logs': TicketTransferLogSerializer(ticket.transfers.all(), many=True).data,
+        })
+
     def perform_create(self, serializer):
         """
         إنشاء تذكرة جديدة مع توزيع تلقائي
@@ -1404,51 +1397,40 @@ class TicketViewSet(viewsets.ModelViewSet):
         # توليد رقم التذكرة
         ticket_number = generate_ticket_number()
 
-        # البحث عن موظف متاح
-        agent = get_available_agent()
-
-        if not agent:
-            # لا يوجد موظف متاح
-            ticket = serializer.save(
-                ticket_number=ticket_number,
-                status='open'
-            )
-        else:
-            # تعيين التذكرة للموظف
-            ticket = serializer.save(
-                ticket_number=ticket_number,
-                assigned_agent=agent,
-                current_agent=agent,
-                status='open'
-            )
-
-            # تحديث عدد التذاكر النشطة
-            agent.current_active_tickets += 1
-            if agent.current_active_tickets >= agent.max_capacity:
-                agent.status = 'busy'
-            agent.save()
+        # ✅ الحجز والإنشاء في معاملة واحدة: قفل صف الموظف (SKIP LOCKED) يبقى حتى حفظ التذكرة
+        # وفشل الحفظ يلغي زيادة العداد بدلاً من ترك الموظف بتذكرة وهمية
+        with transaction.atomic():
+            # حجز موظف متاح (يزيد عداد تذاكره ذرياً)
+            agent = claim_available_agent()
+
+            if not agent:
+                # لا يوجد موظف متاح
+                ticket = serializer.save(
+                    ticket_number=ticket_number,
+                    status='open'
+                )
+            else:
+                # تعيين التذكرة للموظف
+                ticket = serializer.save(
+                    ticket_number=ticket_number,
+                    assigned_agent=agent,
+                    current_agent=agent,
+                    status='open'
+                )
 
         # تسجيل النشاط
-        try:
-            user = self.request.user
-            if user and user.is_authenticated:
-                log_activity(
-                    user=user,
-                    action='create',
-                    entity_type='ticket',
-                    entity_id=ticket.id,
-                    request=self.request
-                )
-        except:
-            pass
+        if self.request.user.is_authenticated:
+            _safe_log_activity(
+                user=self.request.user,
+                action='create',
+                entity_type='ticket',
+                entity_id=ticket.id,
+                request=self.request
+            )
 
         # تحديث KPI للموظف تلقائياً
         if agent:
-            try:
-                from .utils import calculate_agent_kpi
-                calculate_agent_kpi(agent)
-            except:
-                pass
+            schedule_agent_kpi_recalculation(agent)
 
     @action(detail=False, methods=['post'])
     def close_all_open(self, request):
@@ -1462,9 +1444,12 @@ class TicketViewSet(viewsets.ModelViewSet):
                 'error': 'ليس لديك صلاحية لتنفيذ هذا الإجراء'
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # الحصول على جميع التذاكر المفتوحة
-        open_tickets = Ticket.objects.filter(status__in=['open', 'pending'])
-        count = open_tickets.count()
+        # الحصول على جميع التذاكر المفتوحة (الأعمدة المطلوبة للإغلاق فقط)
+        tickets = list(
+            Ticket.objects.filter(status__in=['open', 'pending'])
+            .only('id', 'status', 'created_at', 'current_agent', 'assigned_agent')
+        )
+        count = len(tickets)
         
         if count == 0:
             return Response({
@@ -1472,50 +1457,58 @@ class TicketViewSet(viewsets.ModelViewSet):
                 'closed_count': 0
             })
         
-        # إغلاق جميع التذاكر
-        for ticket in open_tickets:
-            old_status = ticket.status
+        # ✅ إغلاق جميع التذاكر دفعة واحدة: bulk_update + bulk_create + UPDATE واحد للعدادات
+        now = timezone.now()
+        state_logs = []
+        released = Counter()
+        for ticket in tickets:
+            # تسجيل تغيير الحالة
+            state_logs.append(TicketStateLog(
+                ticket=ticket,
+                changed_by=request.user,
+                old_state=ticket.status,
+                new_state='closed',
+                reason='إغلاق جماعي'
+            ))
+            
             ticket.status = 'closed'
-            ticket.closed_at = timezone.now()
+            ticket.closed_at = now
             ticket.closure_reason = 'إغلاق جماعي بواسطة المدير'
             ticket.closed_by_user = request.user
+            ticket.updated_at = now
             
             # حساب وقت المعالجة
             if ticket.created_at:
-                handling_time = timezone.now() - ticket.created_at
-                ticket.handling_time_seconds = int(handling_time.total_seconds())
-            
-            ticket.save()
+                ticket.handling_time_seconds = int((now - ticket.created_at).total_seconds())
             
-            # تحديث عدد التذاكر النشطة للموظف
-            if ticket.current_agent:
-                agent = ticket.current_agent
-                agent.current_active_tickets = max(0, agent.current_active_tickets - 1)
-                if agent.current_active_tickets < agent.max_capacity:
-                    agent.status = 'available'
-                agent.save()
-            
-            # تسجيل تغيير الحالة
-            TicketStateLog.objects.create(
-                ticket=ticket,
-                changed_by=request.user,
-                old_state=old_status,
-                new_state='closed',
-                reason='إغلاق جماعي'
+            if ticket.current_agent_id:
+                released[ticket.current_agent_id] += 1
+        
+        with transaction.atomic():
+            Ticket.objects.bulk_update(
+                tickets,
+                ['status', 'closed_at', 'closure_reason', 'closed_by_user',
+                 'handling_time_seconds', 'updated_at'],
+                batch_size=500
             )
+            TicketStateLog.objects.bulk_create(state_logs, batch_size=500)
+            
+            # تحديث عدد التذاكر النشطة للموظفين
+            Agent.objects.release_active_tickets(released)
+        
+        # ✅ bulk_update لا يرسل post_save - جدولة KPI للموظفين المعنيين مرة واحدة
+        assigned_ids = {ticket.assigned_agent_id for ticket in tickets if ticket.assigned_agent_id}
+        for agent in Agent.objects.filter(pk__in=assigned_ids):
+            schedule_agent_kpi_recalculation(agent)
         
         # تسجيل النشاط
-        try:
-            log_activity(
-                user=request.user,
-                action='bulk_close_tickets',
-                entity_type='ticket',
-                entity_id=None,
-                request=request
-            )
-        except Exception as e:
-            # تجاهل أخطاء التسجيل
-            pass
+        _safe_log_activity(
+            user=request.user,
+            action='bulk_close_tickets',
+            entity_type='ticket',
+            entity_id=None,
+            request=request
+        )
         
         return Response({
             'success': True,
@@ -1538,9 +1531,11 @@ class TicketViewSet(viewsets.ModelViewSet):
 
         # إغلاق التذكرة
         old_status = ticket.status
+        now = timezone.now()
         ticket.status = 'closed'
-        ticket.closed_at = timezone.now()
+        ticket.closed_at = now
         ticket.closure_reason = request.data.get('reason', '')
+        ticket.updated_at = now
 
         user = request.user
         if user and user.is_authenticated:
@@ -1548,53 +1543,52 @@ class TicketViewSet(viewsets.ModelViewSet):
 
         # حساب وقت المعالجة
         if ticket.created_at:
-            handling_time = timezone.now() - ticket.created_at
+            handling_time = now - ticket.created_at
             ticket.handling_time_seconds = int(handling_time.total_seconds())
 
-        ticket.save()
-
-        # تحديث عدد التذاكر النشطة للموظف
-        if ticket.current_agent:
-            agent = ticket.current_agent
-            agent.current_active_tickets = max(0, agent.current_active_tickets - 1)
-
-            # تحديث الحالة
-            if agent.current_active_tickets < agent.max_capacity:
-                agent.status = 'available'
+        with transaction.atomic():
+            # ✅ UPDATE واحد للأعمدة المتغيرة فقط، ومشروط بأن التذكرة ما زالت مفتوحة
+            # (إغلاقان متزامنان لا يُنقصان العداد مرتين)
+            closed = Ticket.objects.filter(pk=ticket.pk).exclude(status='closed').update(
+                status=ticket.status,
+                closed_at=ticket.closed_at,
+                closure_reason=ticket.closure_reason,
+                closed_by_user=ticket.closed_by_user,
+                handling_time_seconds=ticket.handling_time_seconds,
+                updated_at=ticket.updated_at,
+            )
+            if not closed:
+                return Response({
+                    'error': 'التذكرة مغلقة بالفعل'
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-            agent.save()
+            # تحديث عدد التذاكر النشطة للموظف
+            if ticket.current_agent:
+                # ✅ إنقاص ذري مع تحديث الحالة
+                ticket.current_agent.adjust_active_tickets(-1)
 
-        # تسجيل تغيير الحالة
-        try:
-            user = request.user
-            if user and user.is_authenticated:
-                TicketStateLog.objects.create(
-                    ticket=ticket,
-                    changed_by=user,
-                    old_state=old_status,
-                    new_state='closed',
-                    reason=ticket.closure_reason
-                )
+            # تسجيل تغيير الحالة (مع الإغلاق في نفس المعاملة)
+            TicketStateLog.objects.create(
+                ticket=ticket,
+                changed_by=request.user,
+                old_state=old_status,
+                new_state='closed',
+                reason=ticket.closure_reason
+            )
 
-                log_activity(
-                    user=user,
-                    action='close',
-                    entity_type='ticket',
-                    entity_id=ticket.id,
-                    old_value=old_status,
-                    new_value='closed',
-                    request=request
-                )
-        except:
-            pass
+        _safe_log_activity(
+            user=request.user,
+            action='close',
+            entity_type='ticket',
+            entity_id=ticket.id,
+            old_value=old_status,
+            new_value='closed',
+            request=request
+        )
 
         # تحديث KPI للموظف تلقائياً
         if ticket.assigned_agent:
-            try:
-                from .utils import calculate_agent_kpi
-                calculate_agent_kpi(ticket.assigned_agent)
-            except:
-                pass
+            schedule_agent_kpi_recalculation(ticket.assigned_agent)
 
         return Response({
             'message': 'تم إغلاق التذكرة بنجاح'
@@ -1631,50 +1625,42 @@ class TicketViewSet(viewsets.ModelViewSet):
         # نقل التذكرة
         old_agent = ticket.current_agent
         ticket.current_agent = new_agent
-        ticket.save()
+        ticket.updated_at = timezone.now()
 
-        # تحديث عدد التذاكر
-        if old_agent:
-            old_agent.current_active_tickets = max(0, old_agent.current_active_tickets - 1)
-            if old_agent.current_active_tickets < old_agent.max_capacity:
-                old_agent.status = 'available'
-            old_agent.save()
+        with transaction.atomic():
+            # ✅ UPDATE للعمودين المتغيرين فقط بدلاً من حفظ الصف كاملاً
+            Ticket.objects.filter(pk=ticket.pk).update(
+                current_agent=new_agent,
+                updated_at=ticket.updated_at,
+            )
 
-        new_agent.current_active_tickets += 1
-        if new_agent.current_active_tickets >= new_agent.max_capacity:
-            new_agent.status = 'busy'
-        new_agent.save()
+            # تحديث عدد التذاكر (ذرياً عبر F)
+            if old_agent:
+                old_agent.adjust_active_tickets(-1)
 
-        # تسجيل النقل
-        try:
-            user = request.user
-            if user and user.is_authenticated:
-                TicketTransferLog.objects.create(
-                    ticket=ticket,
-                    from_agent=old_agent,
-                    to_agent=new_agent,
-                    transferred_by=user,
-                    reason=reason
-                )
+            new_agent.adjust_active_tickets(1)
 
-                log_activity(
-                    user=user,
-                    action='transfer',
-                    entity_type='ticket',
-                entity_id=ticket.id,
-                request=request
+            # تسجيل النقل (مع النقل في نفس المعاملة)
+            TicketTransferLog.objects.create(
+                ticket=ticket,
+                from_agent=old_agent,
+                to_agent=new_agent,
+                transferred_by=request.user,
+                reason=reason
             )
-        except:
-            pass
+
+        _safe_log_activity(
+            user=request.user,
+            action='transfer',
+            entity_type='ticket',
+            entity_id=ticket.id,
+            request=request
+        )
 
         # تحديث KPI للموظفين (القديم والجديد)
-        try:
-            from .utils import calculate_agent_kpi
-            if old_agent:
-                calculate_agent_kpi(old_agent)
-            calculate_agent_kpi(new_agent)
-        except:
-            pass
+        if old_agent:
+            schedule_agent_kpi_recalculation(old_agent)
+        schedule_agent_kpi_recalculation(new_agent)
 
         return Response({
             'message': 'تم نقل التذكرة بنجاح'
@@ -1706,17 +1692,17 @@ def conversations_list_api(request):
             'error': 'الموظف غير موجود'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    from .utils import update_ticket_delay_status
-    
-    all_open_tickets = Ticket.objects.filter(status='open')
-    for ticket in all_open_tickets:
-        update_ticket_delay_status(ticket)
+    bulk_update_delay_status()
     
     # الحصول على التذاكر المفتوحة المعينة لهذا الموظف فقط
     all_tickets = Ticket.objects.filter(
         current_agent=agent,
         status='open'
-    ).select_related('customer').order_by('-last_message_at')
+    ).select_related('customer').only(
+        # ✅ الأعمدة المستخدمة في التجميع فقط
+        'id', 'ticket_number', 'status', 'priority', 'is_delayed', 'last_message_at',
+        'customer__id', 'customer__name', 'customer__phone_number'
+    ).order_by('-last_message_at')
     
     # تجميع التذاكر حسب العميل
     customers_map = {}
@@ -1766,10 +1752,10 @@ def conversations_list_api(request):
                 
                 # الحصول على آخر رسالة
                 try:
-                    last_message = Message.objects.filter(ticket=ticket).order_by('-created_at').first()
+                    last_message = Message.objects.for_list(50).filter(ticket=ticket).order_by('-created_at').first()
                     if last_message:
-                        customers_map[customer_id]['last_message_text'] = last_message.message_text[:50] or '📷 صورة'
-                except:
+                        customers_map[customer_id]['last_message_text'] = last_message.preview or '📷 صورة'
+                except Exception:
                     pass
     
     # تحويل الخريطة إلى قائمة وترتيبها
@@ -1821,7 +1807,7 @@ def transfer_ticket_api(request):
     
     try:
         customer = Customer.objects.get(id=customer_id)
-        to_agent = Agent.objects.get(id=to_agent_id)
+        to_agent = Agent.objects.select_related('user').get(id=to_agent_id)
     except Customer.DoesNotExist:
         return Response({
             'error': 'العميل غير موجود'
@@ -1839,48 +1825,44 @@ def transfer_ticket_api(request):
         status='open'
     )
     
-    if not open_tickets.exists():
+    tickets = list(open_tickets.only('id', 'ticket_number', 'current_agent', 'has_real_transfer'))
+    if not tickets:
         return Response({
             'error': 'لا توجد تذاكر مفتوحة للتحويل لهذا العميل'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    # تحويل جميع التذاكر المفتوحة
+    # تحويل جميع التذاكر المفتوحة (دفعة واحدة)
+    now = timezone.now()
+    transfer_logs = []
     transferred_tickets = []
-    for ticket in open_tickets:
-        # تحديث التذكرة
+    for ticket in tickets:
         ticket.current_agent = to_agent
-        ticket.save()
+        ticket.updated_at = now
         
-        # إنشاء سجل التحويل
-        transfer_log = TicketTransferLog.objects.create(
+        # سجل التحويل
+        transfer_log = TicketTransferLog(
             ticket=ticket,
             from_agent=from_agent,
             to_agent=to_agent,
             reason=note if note else 'تحويل من الموظف',
             transferred_by=request.user
         )
+        if transfer_log.is_real_transfer:
+            ticket.has_real_transfer = True  # ✅ bulk_create لا يستدعي TicketTransferLog.save
+        transfer_logs.append(transfer_log)
         
         transferred_tickets.append({
             'ticket_id': ticket.id,
             'ticket_number': ticket.ticket_number
         })
     
-    # تحديث عدد التذاكر للموظفين
-    from_agent.current_active_tickets = Ticket.objects.filter(
-        current_agent=from_agent,
-        status='open'
-    ).count()
-    if from_agent.current_active_tickets < from_agent.max_capacity:
-        from_agent.status = 'available'
-    from_agent.save()
-    
-    to_agent.current_active_tickets = Ticket.objects.filter(
-        current_agent=to_agent,
-        status='open'
-    ).count()
-    if to_agent.current_active_tickets >= to_agent.max_capacity:
-        to_agent.status = 'busy'
-    to_agent.save()
+    with transaction.atomic():
+        Ticket.objects.bulk_update(tickets, ['current_agent', 'has_real_transfer', 'updated_at'])
+        TicketTransferLog.objects.bulk_create(transfer_logs)
+        
+        # ✅ تعديل عدادات الموظفين ذرياً بعدد التذاكر المنقولة بدلاً من COUNT لكل موظف
+        from_agent.adjust_active_tickets(-len(tickets))
+        to_agent.adjust_active_tickets(len(tickets))
     
     return Response({
         'success': True,
@@ -1915,8 +1897,7 @@ def available_agents_api(request):
         agents = Agent.objects.filter(
             user__is_active=True,
             is_online=True,  # ✅ فقط المتصلين
-            is_on_break=False  # ✅ ليسوا في استراحة
-        ).exclude(user=request.user).select_related('user')
+        ).not_on_break().exclude(user=request.user).select_related('user')  # ✅ ليسوا في استراحة
         
         print(f"DEBUG: Found {agents.count()} available agents (online and not on break)")
         
@@ -2006,11 +1987,7 @@ def all_conversations_api(request):
     - offset: نقطة البداية (افتراضي: 0)
     """
     try:
-        from .utils import update_ticket_delay_status
-        
-        all_open_tickets = Ticket.objects.filter(status='open')
-        for ticket in all_open_tickets:
-            update_ticket_delay_status(ticket)
+        bulk_update_delay_status()
         
         # المعاملات
         search_query = request.GET.get('search', '').strip()
@@ -2050,7 +2027,7 @@ def all_conversations_api(request):
             
             # Check if search matches message content
             message_matches = tickets_query.filter(
-                Q(messages__message_text__icontains=search_query)
+                id__in=Message.objects.search(search_query).values('ticket_id')
             )
             
             # Combine both searches
@@ -2072,11 +2049,11 @@ def all_conversations_api(request):
         conversations = []
         for ticket in tickets:
             # آخر رسالة
-            last_message = Message.objects.filter(ticket=ticket).order_by('-created_at').first()
+            last_message = Message.objects.for_list().filter(ticket=ticket).order_by('-created_at').first()
             last_message_text = ''
             if last_message:
-                if last_message.message_text:
-                    last_message_text = last_message.message_text[:100]
+                if last_message.preview:
+                    last_message_text = last_message.preview
                 else:
                     last_message_text = f"📷 {last_message.message_type}"
             
@@ -2084,9 +2061,8 @@ def all_conversations_api(request):
             matching_messages = []
             if search_query and search_in_messages:
                 matching_msgs = Message.objects.filter(
-                    ticket=ticket,
-                    message_text__icontains=search_query
-                ).order_by('-created_at')[:3]  # أحدث 3 رسائل مطابقة
+                    ticket=ticket
+                ).search(search_query).order_by('-created_at')[:3]  # أحدث 3 رسائل مطابقة
                 
                 for msg in matching_msgs:
                     if msg.message_text:
@@ -24,12 +24,12 @@ class AgentKPIViewSet(viewsets.ReadOnlyModelViewSet):
     """
     عرض مؤشرات الأداء اليومية
     """
-    queryset = AgentKPI.objects.select_related('agent__user').all()
+    queryset = AgentKPI.objects.all()
     serializer_class = AgentKPISerializer
     permission_classes = [CanViewAnalytics]
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = AgentKPISerializer.setup_eager_loading(super().get_queryset())
         user = self.request.user
 
         if not user or not user.is_authenticated:
@@ -57,17 +57,31 @@ class AgentKPIViewSet(viewsets.ReadOnlyModelViewSet):
 
         return queryset.order_by('-kpi_date')
 
+    def list(self, request, *args, **kwargs):
+        """
+        القائمة تُقرأ عبر .values() مباشرة دون بناء كائنات AgentKPI
+        """
+        queryset = AgentKPIListSerializer.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = AgentKPIListSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = AgentKPIListSerializer(queryset, many=True)
+        return Response(serializer.data)
+
 
 class AgentKPIMonthlyViewSet(viewsets.ReadOnlyModelViewSet):
     """
     عرض مؤشرات الأداء الشهرية
     """
-    queryset = AgentKPIMonthly.objects.select_related('agent__user').all()
+    queryset = AgentKPIMonthly.objects.all()
     serializer_class = AgentKPIMonthlySerializer
     permission_classes = [CanViewAnalytics]
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = AgentKPIMonthlySerializer.setup_eager_loading(super().get_queryset())
         user = self.request.user
 
         if not user or not user.is_authenticated:
@@ -153,28 +167,34 @@ class DashboardView(views.APIView):
         today = timezone.now().date()
         
         # إحصائيات عامة
-        total_tickets = Ticket.objects.count()
-        open_tickets = Ticket.objects.filter(status='open').count()
-        delayed_tickets = Ticket.objects.filter(is_delayed=True).count()
-        closed_today = Ticket.objects.filter(
-            status='closed',
-            closed_at__date=today
-        ).count()
+        # ✅ استعلام واحد بعدّ شرطي بدلاً من COUNT لكل مؤشر
+        ticket_stats = Ticket.objects.aggregate(
+            total=Count('id'),
+            open=Count('id', filter=Q(status='open')),
+            delayed=Count('id', filter=Q(is_delayed=True)),
+            closed_today=Count('id', filter=Q(status='closed', closed_at__date=today)),
+        )
+        total_tickets = ticket_stats['total']
+        open_tickets = ticket_stats['open']
+        delayed_tickets = ticket_stats['delayed']
+        closed_today = ticket_stats['closed_today']
         
         # إحصائيات الموظفين
-        total_agents = Agent.objects.count()
-        online_agents = Agent.objects.filter(is_online=True).count()
-        available_agents = Agent.objects.filter(
-            is_online=True,
-            status='available',
-            current_active_tickets__lt=F('max_capacity')
-        ).count()
+        agent_stats = Agent.objects.aggregate(
+            total=Count('id'),
+            online=Count('id', filter=Q(is_online=True)),
+        )
+        total_agents = agent_stats['total']
+        online_agents = agent_stats['online']
+        available_agents = Agent.objects.available().count()
         
         # إحصائيات العملاء
-        total_customers = Customer.objects.count()
-        new_customers_today = Customer.objects.filter(
-            created_at__date=today
-        ).count()
+        customer_stats = Customer.objects.aggregate(
+            total=Count('id'),
+            new_today=Count('id', filter=Q(created_at__date=today)),
+        )
+        total_customers = customer_stats['total']
+        new_customers_today = customer_stats['new_today']
         
         # متوسط وقت الاستجابة
         avg_response_time = Ticket.objects.filter(
@@ -230,13 +250,17 @@ class DashboardView(views.APIView):
             Q(assigned_agent=agent) | Q(current_agent=agent)
         )
         
-        total_tickets = my_tickets.count()
-        open_tickets = my_tickets.filter(status='open').count()
-        delayed_tickets = my_tickets.filter(is_delayed=True).count()
-        closed_today = my_tickets.filter(
-            status='closed',
-            closed_at__date=today
-        ).count()
+        # ✅ استعلام واحد بعدّ شرطي بدلاً من COUNT لكل مؤشر
+        ticket_stats = my_tickets.aggregate(
+            total=Count('id'),
+            open=Count('id', filter=Q(status='open')),
+            delayed=Count('id', filter=Q(is_delayed=True)),
+            closed_today=Count('id', filter=Q(status='closed', closed_at__date=today)),
+        )
+        total_tickets = ticket_stats['total']
+        open_tickets = ticket_stats['open']
+        delayed_tickets = ticket_stats['delayed']
+        closed_today = ticket_stats['closed_today']
         
         # مؤشرات الأداء
         kpi_data = calculate_agent_kpi(agent, today)
@@ -367,24 +391,31 @@ class ReportsView(views.APIView):
                 'score': stat['avg_score']
             })
 
+        # ✅ كل مؤشرات التذاكر في استعلام واحد
+        ticket_stats = tickets.aggregate(
+            total=Count('id'),
+            open=Count('id', filter=Q(status='open')),
+            closed=Count('id', filter=Q(status='closed')),
+            delayed=Count('id', filter=Q(is_delayed=True)),
+            avg_response_time=Avg('response_time_seconds'),
+            avg_handling_time=Avg('handling_time_seconds'),
+        )
+
         return {
             'period': {
                 'from': date_from,
                 'to': date_to,
             },
             'tickets': {
-                'total': tickets.count(),
-                'open': tickets.filter(status='open').count(),
-                'closed': tickets.filter(status='closed').count(),
-                'delayed': tickets.filter(is_delayed=True).count(),
+                'total': ticket_stats['total'],
+                'open': ticket_stats['open'],
+                'closed': ticket_stats['closed'],
+                'delayed': ticket_stats['delayed'],
             },
             'performance': {
-                'avg_response_time': tickets.filter(
-                    response_time_seconds__isnull=False
-                ).aggregate(Avg('response_time_seconds'))['response_time_seconds__avg'] or 0,
-                'avg_handling_time': tickets.filter(
-                    handling_time_seconds__isnull=False
-                ).aggregate(Avg('handling_time_seconds'))['handling_time_seconds__avg'] or 0,
+                # Avg يتجاهل القيم الفارغة
+                'avg_response_time': ticket_stats['avg_response_time'] or 0,
+                'avg_handling_time': ticket_stats['avg_handling_time'] or 0,
             },
             'agents': agents_data
         }
@@ -430,6 +461,11 @@ class ReportsView(views.APIView):
             created_at__gte=start_datetime,
             created_at__lte=end_datetime
         )
+        customer_stats = customers.aggregate(
+            total=Count('id'),
+            regular=Count('id', filter=Q(customer_type='regular')),
+            vip=Count('id', filter=Q(customer_type='vip')),
+        )
         
         return {
             'period': {
@@ -437,10 +473,10 @@ class ReportsView(views.APIView):
                 'to': date_to,
             },
             'customers': {
-                'total': customers.count(),
-                'new': customers.count(),
-                'regular': customers.filter(customer_type='regular').count(),
-                'vip': customers.filter(customer_type='vip').count(),
+                'total': customer_stats['total'],
+                'new': customer_stats['total'],
+                'regular': customer_stats['regular'],
+                'vip': customer_stats['vip'],
             }
         }
 
@@ -455,7 +491,9 @@ class ReportsView(views.APIView):
         tickets = Ticket.objects.filter(
             created_at__gte=start_datetime,
             created_at__lte=end_datetime
-        ).select_related('assigned_agent__user', 'customer').order_by('assigned_agent__user__full_name', '-created_at')
+        ).select_related('assigned_agent__user', 'customer').only(
+            'ticket_number', 'created_at', 'assigned_agent__user__full_name', 'customer__name'
+        ).order_by('assigned_agent__user__full_name', '-created_at')
 
         data = []
         for ticket in tickets:
@@ -15,6 +15,7 @@ from django.contrib.auth import authenticate, login as auth_login, logout as aut
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
+from django.db.models import Count, Q
 from datetime import timedelta
 
 from .models import (
@@ -23,7 +24,7 @@ from .models import (
     LoginAttempt
 )
 from .permissions import IsAdmin, IsAgent
-from .utils import generate_ticket_number, log_activity
+from .utils import generate_ticket_number, log_activity, get_client_info
 
 
 # ============================================
@@ -63,11 +64,7 @@ def login_view(request):
             return render(request, 'login.html')
         
         # التحقق من محاولات تسجيل الدخول الفاشلة
-        recent_attempts = LoginAttempt.objects.filter(
-            username=username,
-            success=False,
-            attempt_time__gte=timezone.now() - timedelta(minutes=15)
-        ).count()
+        recent_attempts = LoginAttempt.recent_failed_count(username, minutes=15)
         
         if recent_attempts >= 5:
             messages.error(request, 'تم تجاوز عدد المحاولات المسموح بها. يرجى المحاولة بعد 15 دقيقة')
@@ -96,10 +93,10 @@ def login_view(request):
                 user.agent.save(update_fields=['is_online', 'status'])
 
             # تسجيل المحاولة الناجحة
-            LoginAttempt.objects.create(
-                username=username,
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', ''),
+            LoginAttempt.record(
+                username,
+                request.META.get('REMOTE_ADDR'),
+                get_client_info(request)[1],
                 success=True
             )
 
@@ -121,10 +118,10 @@ def login_view(request):
                 return redirect('agent-conversations')
         else:
             # تسجيل الدخول فاشل
-            LoginAttempt.objects.create(
-                username=username,
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', ''),
+            LoginAttempt.record(
+                username,
+                request.META.get('REMOTE_ADDR'),
+                get_client_info(request)[1],
                 success=False
             )
             
@@ -191,16 +188,22 @@ def admin_dashboard(request):
         messages.error(request, 'ليس لديك صلاحية للوصول لهذه الصفحة')
         return redirect('agent-conversations')
     
-    from .utils import update_ticket_delay_status
+    from .utils import bulk_update_delay_status
     
-    for ticket in Ticket.objects.filter(status='open'):
-        update_ticket_delay_status(ticket)
+    bulk_update_delay_status()
     
     # إحصائيات
-    open_tickets = Ticket.objects.filter(status='open').count()
-    pending_tickets = Ticket.objects.filter(status='pending').count()
-    closed_tickets = Ticket.objects.filter(status='closed').count()
-    delayed_tickets = Ticket.objects.filter(is_delayed=True, status__in=['open', 'pending']).count()
+    # ✅ استعلام واحد بعدّ شرطي بدلاً من أربعة
+    ticket_stats = Ticket.objects.aggregate(
+        open=Count('id', filter=Q(status='open')),
+        pending=Count('id', filter=Q(status='pending')),
+        closed=Count('id', filter=Q(status='closed')),
+        delayed=Count('id', filter=Q(is_delayed=True, status__in=['open', 'pending'])),
+    )
+    open_tickets = ticket_stats['open']
+    pending_tickets = ticket_stats['pending']
+    closed_tickets = ticket_stats['closed']
+    delayed_tickets = ticket_stats['delayed']
     
     # Active customers (customers with open or pending tickets)
     active_customers = Customer.objects.filter(
@@ -294,12 +297,11 @@ def admin_tickets(request):
         messages.error(request, 'ليس لديك صلاحية للوصول لهذه الصفحة')
         return redirect('agent-conversations')
     
-    from .utils import update_ticket_delay_status
+    from .utils import bulk_update_delay_status
     from django.utils import timezone
     from datetime import datetime, time
     
-    for ticket in Ticket.objects.filter(status='open'):
-        update_ticket_delay_status(ticket)
+    bulk_update_delay_status()
     
     tickets = Ticket.objects.select_related('customer', 'assigned_agent__user').prefetch_related('transfers').order_by('-created_at')
 
@@ -417,7 +419,6 @@ def admin_agent_management(request):
         return redirect('admin-dashboard')
     
     from .models import ActivityLog
-    from django.db.models import Q
     
     # Get date range
     date_from_str = request.GET.get('date_from')
@@ -442,17 +443,22 @@ def admin_agent_management(request):
         date_to = today
 
     # الحصول على جميع الموظفين
-    agents = Agent.objects.select_related('user').filter(user__is_active=True).order_by('user__full_name')
+    agents = Agent.objects.select_related('user').with_break_state().filter(user__is_active=True).order_by('user__full_name')
     
+    # ✅ نطاق نصف مفتوح [بداية date_from، بداية اليوم التالي لـ date_to) بدلاً من created_at__date
+    # حتى يستخدم الاستعلام فهرس created_at مباشرة
+    range_start = timezone.make_aware(timezone.datetime.combine(date_from, timezone.datetime.min.time()))
+    range_end = timezone.make_aware(timezone.datetime.combine(date_to + timedelta(days=1), timezone.datetime.min.time()))
+
     agents_data = []
     for agent in agents:
         # الحصول على النشاط في الفترة المحددة
         activities = ActivityLog.objects.filter(
-            created_at__date__range=[date_from, date_to]
+            created_at__gte=range_start, created_at__lt=range_end
         ).filter(
             Q(user=agent.user, action__in=['login', 'logout']) |
             Q(entity_type='agent', entity_id=agent.id, action__in=['break_start', 'break_end', 'force_logout'])
-        ).order_by('created_at')
+        ).only('id', 'action', 'created_at').order_by('created_at')  # ✅ بدون old_value/new_value/user_agent
         
         # استخراج أوقات الدخول والخروج والاستراحة
         login_time = None
@@ -460,7 +466,7 @@ def admin_agent_management(request):
         breaks = []
         current_break_start = None
         
-        for activity in activities:
+        for activity in activities.iterator(chunk_size=2000):  # ✅ دفعات بدلاً من تحميل كل السجلات
             if activity.action == 'login':
                 # نأخذ أول تسجيل دخول
                 if not login_time:
@@ -642,7 +648,7 @@ def agent_conversations(request):
     
     agent = Agent.objects.get(user=request.user)
     
-    from .utils import check_ticket_delay, update_ticket_delay_status
+    from .utils import check_ticket_delay, bulk_update_delay_status
     import logging
     logger = logging.getLogger(__name__)
     
@@ -652,16 +658,13 @@ def agent_conversations(request):
         status='open'
     ).select_related('customer').order_by('-last_message_at')
     
+    # تحديث وحفظ حالة التأخير لكل تذاكر الموظف دفعة واحدة (قبل تحميل القائمة)
+    bulk_update_delay_status(all_tickets)
+    
     # تجميع التذاكر حسب العميل
     customers_map = {}
     for ticket in all_tickets:
-        # تحديث وحفظ حالة التأخير
-        is_delayed_now = check_ticket_delay(ticket)
-        logger.info(f"Ticket #{ticket.id}: last_customer_msg={ticket.last_customer_message_at}, last_agent_msg={ticket.last_agent_message_at}, is_delayed={is_delayed_now}")
-        
-        update_ticket_delay_status(ticket)
-        # إعادة تحميل من الـ database للحصول على القيمة المحدثة
-        ticket.refresh_from_db()
+        logger.info(f"Ticket #{ticket.id}: last_customer_msg={ticket.last_customer_message_at}, last_agent_msg={ticket.last_agent_message_at}, is_delayed={ticket.is_delayed}")
         
         customer_id = ticket.customer.id
         if customer_id not in customers_map:
@@ -10,7 +10,7 @@ from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Q, F
 from django.conf import settings
 from django.core.files.storage import default_storage
 
@@ -28,7 +28,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     """
     إدارة الرسائل
     """
-    queryset = Message.objects.select_related('ticket__customer').all()
+    queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAdminOrAgent]
     pagination_class = None  # ✅ إلغاء pagination - عرض كل الرسائل
@@ -60,7 +60,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = MessageSerializer.setup_eager_loading(super().get_queryset())
         
         # التصفية حسب التذكرة
         ticket_id = self.request.query_params.get('ticket', None)
@@ -75,7 +75,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         # البحث في النص
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(message_text__icontains=search)
+            queryset = queryset.search(search)
         
         return queryset.order_by('created_at')
     
@@ -89,6 +89,13 @@ class MessageViewSet(viewsets.ModelViewSet):
         try:
             # Handle image upload
             image_file = self.request.FILES.get('image')
+
+            max_size = settings.FILE_UPLOAD_MAX_SIZE
+            size_error = f'حجم الصورة يجب أن يكون أقل من {max_size // (1024 * 1024)} ميجابايت'
+
+            # ✅ QuotaUploadHandler أوقف رفع ملف أكبر من الحد - الملف غير موجود في FILES
+            if getattr(self.request, 'upload_quota_exceeded', False):
+                raise ValueError(size_error)
             
             # Prepare base kwargs
             kwargs = {
@@ -101,9 +108,9 @@ class MessageViewSet(viewsets.ModelViewSet):
             message_type = 'text'
             
             if image_file:
-                # Validate file size (max 5MB)
-                if image_file.size > 5 * 1024 * 1024:
-                    raise ValueError('حجم الصورة يجب أن يكون أقل من 5 ميجابايت')
+                # Validate file size (FILE_UPLOAD_MAX_SIZE)
+                if image_file.size > max_size:
+                    raise ValueError(size_error)
                 
                 # Create unique filename
                 ext = os.path.splitext(image_file.name)[1]
@@ -134,40 +141,33 @@ class MessageViewSet(viewsets.ModelViewSet):
 
         # تحديث آخر رسالة في التذكرة
         ticket = message.ticket
-        ticket.last_message_at = timezone.now()
-        ticket.messages_count += 1
+        now = timezone.now()
+        updates = {'last_message_at': now}
 
         if message.sender_type == 'customer':
-            ticket.last_customer_message_at = timezone.now()
-
-            # فحص التأخير
-            update_ticket_delay_status(ticket)
+            updates['last_customer_message_at'] = now
 
         elif message.sender_type == 'agent':
-            ticket.last_agent_message_at = timezone.now()
+            updates['last_agent_message_at'] = now
 
             # حساب وقت الاستجابة (إذا كانت أول رسالة من الموظف)
             if not ticket.first_response_at:
-                ticket.first_response_at = timezone.now()
+                updates['first_response_at'] = now
 
                 if ticket.created_at:
-                    response_time = timezone.now() - ticket.created_at
-                    ticket.response_time_seconds = int(response_time.total_seconds())
+                    response_time = now - ticket.created_at
+                    updates['response_time_seconds'] = int(response_time.total_seconds())
+
+        for field, value in updates.items():
+            setattr(ticket, field, value)
 
-            # إلغاء حالة التأخير
-            if ticket.is_delayed:
-                update_ticket_delay_status(ticket)
+        # فحص التأخير (للعميل) أو إلغاؤه (للموظف)
+        if message.sender_type == 'customer' or (message.sender_type == 'agent' and ticket.is_delayed):
+            update_ticket_delay_status(ticket)
 
-        ticket.save()
+        # ✅ عداد الرسائل ذرياً (UPDATE ... SET messages_count = messages_count + 1)
+        ticket.increment_messages_count(**updates)
 
-        # إنشاء فهرس البحث
-        if message.message_text:
-            MessageSearchIndex.objects.create(
-                message=message,
-                customer=ticket.customer,
-                search_text=message.message_text
-            )
-        
         # تسجيل النشاط
         try:
             user = self.request.user
@@ -241,11 +241,8 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         # تحديث KPI للموظف تلقائياً (عند إرسال رسالة من الموظف)
         if message.sender_type == 'agent' and ticket.assigned_agent:
-            try:
-                from .utils import calculate_agent_kpi
-                calculate_agent_kpi(ticket.assigned_agent)
-            except:
-                pass
+            from .utils import schedule_agent_kpi_recalculation
+            schedule_agent_kpi_recalculation(ticket.assigned_agent)
     
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
@@ -342,38 +339,36 @@ def customer_messages_api(request, customer_id):
         
         tickets = tickets_query.order_by('-created_at')
         
-        # تجميع جميع الرسائل من جميع التذاكر
+        # ✅ تجميع جميع الرسائل من جميع التذاكر في استعلام واحد مرتب زمنياً
+        # iterator() يستخدم server-side cursor بدلاً من تحميل كل النتائج في الذاكرة
+        messages = Message.objects.filter(ticket__in=tickets).select_related('ticket', 'sender').only(
+            'id', 'message_text', 'message_type', 'media_url', 'mime_type', 'sender_type',
+            'created_at', 'is_read',
+            'ticket__id', 'ticket__ticket_number', 'ticket__status',
+            'sender__full_name', 'sender__username',
+        ).order_by('created_at', 'id')
+
         all_messages = []
-        for ticket in tickets:
-            try:
-                messages = Message.objects.filter(ticket=ticket).order_by('created_at')
-                for message in messages:
-                    # Get sender name from sender relationship if it's an agent
-                    sender_name = ''
-                    if message.sender_type == 'agent' and message.sender:
-                        sender_name = message.sender.full_name or message.sender.username
-                    elif message.sender_type == 'customer' and hasattr(message, 'sender_name') and message.sender_name:
-                        sender_name = message.sender_name
-                    
-                    all_messages.append({
-                        'id': message.id,
-                        'message_text': message.message_text,
-                        'message_type': message.message_type,
-                        'media_url': message.media_url,
-                        'mime_type': message.mime_type,
-                        'sender_type': message.sender_type,
-                        'sender_name': sender_name,
-                        'created_at': message.created_at.isoformat(),
-                        'is_read': message.is_read,
-                        'ticket_id': ticket.id,
-                        'ticket_number': ticket.ticket_number,
-                        'ticket_status': ticket.status
-                    })
-            except Exception as e:
-                continue
-        
-        # ترتيب الرسائل حسب الوقت
-        all_messages.sort(key=lambda x: x['created_at'])
+        for message in messages.iterator(chunk_size=2000):
+            # Get sender name from sender relationship if it's an agent
+            sender_name = ''
+            if message.sender_type == 'agent' and message.sender:
+                sender_name = message.sender.full_name or message.sender.username
+
+            all_messages.append({
+                'id': message.id,
+                'message_text': message.message_text,
+                'message_type': message.message_type,
+                'media_url': message.media_url,
+                'mime_type': message.mime_type,
+                'sender_type': message.sender_type,
+                'sender_name': sender_name,
+                'created_at': message.created_at.isoformat(),
+                'is_read': message.is_read,
+                'ticket_id': message.ticket.id,
+                'ticket_number': message.ticket.ticket_number,
+                'ticket_status': message.ticket.status
+            })
         
         return Response({
             'messages': all_messages,
@@ -501,12 +496,12 @@ class AgentTemplateViewSet(viewsets.ModelViewSet):
         POST /api/agent-templates/{id}/use/
         """
         template = self.get_object()
-        template.usage_count += 1
-        template.save()
+        # ✅ زيادة ذرية بدون read-modify-write
+        AgentTemplate.objects.filter(pk=template.pk).update(usage_count=F('usage_count') + 1)
         
         return Response({
             'message': 'تم استخدام القالب',
-            'usage_count': template.usage_count
+            'usage_count': template.usage_count + 1
         })
 
 
@@ -5,6 +5,7 @@ WhatsApp Webhook Views
 يستقبل الرسائل من WPPConnect ويعالجها
 """
 
+import collections
 import logging
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
@@ -17,14 +18,16 @@ from rest_framework import status
 
 from .models import Customer, Ticket, Message, User, Agent
 from .utils import (
+    NON_DIGITS_RE,
     normalize_phone_number,
+    get_customer_by_wa_id,
     generate_ticket_number,
-    get_available_agent,
-    assign_ticket_to_agent,
+    claim_available_agent,
     log_activity,
     send_welcome_message,
     handle_menu_selection,
-    should_send_welcome_message
+    should_send_welcome_message,
+    get_ticket_for_webhook
 )
 from .whatsapp_driver import get_whatsapp_driver
 from .message_queue import get_message_queue  # ✅ استيراد Message Queue
@@ -121,12 +124,11 @@ def whatsapp_webhook(request):
                 }
             )
         else:
-            try:
-                customer = Customer.objects.get(wa_id=whatsapp_id)
-                created = False
-            except Customer.DoesNotExist:
+            customer = get_customer_by_wa_id(whatsapp_id)
+            created = False
+            if customer is None:
                 # Generate a unique placeholder: 201000 + last 6 digits from wa_id
-                lid_digits = ''.join(ch for ch in whatsapp_id.split('@')[0] if ch.isdigit())
+                lid_digits = NON_DIGITS_RE.sub('', whatsapp_id.split('@')[0])
                 placeholder_suffix = lid_digits[-6:] if len(lid_digits) >= 6 else f"{lid_digits:0>6}"
                 placeholder_phone = f"201000{placeholder_suffix}"
                 customer, created = Customer.objects.get_or_create(
@@ -160,8 +162,8 @@ def whatsapp_webhook(request):
             # إنشاء تذكرة جديدة
             logger.info(f"Creating new ticket for {customer.phone_number}")
             
-            # الحصول على موظف متاح
-            available_agent = get_available_agent()
+            # حجز موظف متاح (يزيد عداد تذاكره ذرياً)
+            available_agent = claim_available_agent()
             
             # إنشاء التذكرة
             ticket_number = generate_ticket_number()
@@ -183,34 +185,46 @@ def whatsapp_webhook(request):
                     ticket_number=ticket_number,
                     customer=customer,
                     assigned_agent=available_agent,
+                    current_agent=available_agent,
                     status='open',
                     priority='low',  # أولوية منخفضة حتى يختار العميل
                     category='general'
                 )
             
-            # تحديث عداد التذاكر للعميل
-            customer.total_tickets_count += 1
-            customer.last_contact_date = timezone.now()
-            customer.save(update_fields=['total_tickets_count', 'last_contact_date'])
+            # تحديث عداد التذاكر للعميل (ذرياً)
+            customer.increment_tickets_count()
             
-            # تعيين التذكرة للموظف (إذا كان متاح)
             if available_agent:
-                assign_ticket_to_agent(open_ticket, available_agent)
                 logger.info(f"Ticket created: {open_ticket.ticket_number} - Agent: {available_agent.user.username}")
             else:
                 logger.info(f"Ticket created: {open_ticket.ticket_number} - No agent available (Admin can handle it)")
         
+        message_fields = dict(
+            ticket=open_ticket,
+            sender=None,  # من العميل
+            sender_type='customer',  # ✅ إضافة sender_type
+            direction='incoming',
+            message_text=message_text,
+            message_type=message_type,
+            delivery_status='delivered',
+            media_url=media_url,
+            mime_type=mime_type
+        )
+
         # ✅ التحقق من عدم وجود رسالة مكررة
         if id_ext:
-            existing_message = Message.objects.filter(whatsapp_message_id=id_ext).first()
-            if existing_message:
+            # ✅ بحث + إنشاء عبر القيد الفريد uq_wa_msg_id_notnull (آمن ضد التزامن)
+            message, created = Message.objects.get_or_create(
+                whatsapp_message_id=id_ext, defaults=message_fields
+            )
+            if not created:
                 logger.warning(f"⚠️ Duplicate message detected: {id_ext} - Skipping")
                 return JsonResponse({
                     'success': True,
                     'duplicate': True,
                     'ticket_id': open_ticket.id,
                     'ticket_number': open_ticket.ticket_number,
-                    'message_id': existing_message.id,
+                    'message_id': message.id,
                     'message': 'Message already exists - skipped'
                 })
         else:
@@ -235,44 +249,27 @@ def whatsapp_webhook(request):
                     'message': 'Duplicate message by content - skipped'
                 })
 
-        # حفظ الرسالة
-        message = Message.objects.create(
-            ticket=open_ticket,
-            sender=None,  # من العميل
-            sender_type='customer',  # ✅ إضافة sender_type
-            direction='incoming',
-            message_text=message_text,
-            message_type=message_type,
-            whatsapp_message_id=id_ext,
-            delivery_status='delivered',
-            media_url=media_url,
-            mime_type=mime_type
-        )
+            # حفظ الرسالة
+            message = Message.objects.create(**message_fields)
 
         logger.info(f"✅ Message saved: {message.id}")
         
-        # تحديث آخر رسالة في التذكرة
-        open_ticket.last_message_at = timezone.now()
-        open_ticket.last_customer_message_at = timezone.now()
-        open_ticket.messages_count += 1
-        open_ticket.save(update_fields=['last_message_at', 'last_customer_message_at', 'messages_count'])
+        # تحديث آخر رسالة في التذكرة (عداد ذري)
+        now = timezone.now()
+        open_ticket.increment_messages_count(from_customer=True, last_message_at=now, last_customer_message_at=now)
         
         # ✅ معالجة رسالة الترحيب والقائمة المنسدلة
         try:
-            # ✅ تحديث التذكرة من قاعدة البيانات للحصول على أحدث حالة
-            open_ticket.refresh_from_db()
+            # ✅ إعادة تحميل التذكرة بأحدث حالة مع الموظف والمستخدم (refresh_from_db يُسقط العلاقات المحمّلة)
+            open_ticket = get_ticket_for_webhook(open_ticket.pk)
             logger.info(f"Processing message from {customer.phone_number} - Ticket {open_ticket.ticket_number}: category={open_ticket.category}, classified_at={open_ticket.category_selected_at}")
             
-            # ✅ عد الرسائل مرة واحدة لاستخدامها في كل من الترحيب واختيار القائمة
-            messages_count = Message.objects.filter(ticket=open_ticket, sender_type='customer').count()
+            # ✅ عداد رسائل العميل (محمّل مع التذكرة - بدون COUNT)
+            messages_count = open_ticket.customer_message_count
             logger.info(f"Total customer messages in ticket {open_ticket.ticket_number}: {messages_count}")
             
-            # ✅ التحقق من وجود رسالة ترحيب سابقة
-            welcome_message_exists = Message.objects.filter(
-                ticket=open_ticket,
-                sender_type='agent',
-                message_text__contains='مرحباً بك في صيدليات خليفة'
-            ).exists()
+            # ✅ التحقق من وجود رسالة ترحيب سابقة (محمّل مع التذكرة - بدون استعلام)
+            welcome_message_exists = open_ticket.welcome_sent
             
             # التحقق من إرسال رسالة ترحيب للعملاء الجدد (فقط للرسالة الأولى)
             if messages_count == 1 and not welcome_message_exists and should_send_welcome_message(customer, message_text, open_ticket):
@@ -296,9 +293,7 @@ def whatsapp_webhook(request):
                         logger.info(f"✅ Menu selection processed successfully for {customer.phone_number}: {menu_selection_result.get('message')}")
                         # تحديث تصنيف التذكرة حسب الاختيار
                         if 'category' in menu_selection_result:
-                            # ✅ التصنيف تم بالفعل في handle_menu_selection - لا حاجة لإعادة الحفظ
-                            # تحديث التذكرة من قاعدة البيانات للتأكد من الحفظ
-                            open_ticket.refresh_from_db()
+                            # ✅ التصنيف تم بالفعل في handle_menu_selection (وحُدّثت قيم التذكرة في الذاكرة)
                             logger.info(f"✅ Ticket {open_ticket.ticket_number} category updated successfully: category={open_ticket.category}, priority={open_ticket.priority}, category_selected_at={open_ticket.category_selected_at}")
                     
                     elif menu_selection_result.get('message') == 'invalid_selection':
@@ -673,6 +668,10 @@ def whatsapp_cloud_webhook(request):
             logger.warning(f"Invalid webhook object: {data.get('object')}")
             return JsonResponse({'success': False, 'error': 'Invalid object'}, status=400)
         
+        # ✅ تجميع الرسائل وإدراجها دفعة واحدة - التكرار يمنعه قيد uq_wa_msg_id_notnull
+        pending_messages = []
+        touched_customer_ids = set()
+        
         # معالجة كل entry
         for entry in data.get('entry', []):
             for change in entry.get('changes', []):
@@ -764,20 +763,19 @@ def whatsapp_cloud_webhook(request):
                         if should_send_welcome_message(customer):
                             send_welcome_message(customer)
                     
-                    # حفظ الرسالة
-                    Message.objects.create(
+                    # إضافة الرسالة للدفعة (تُحفظ بعد انتهاء المعالجة)
+                    pending_messages.append(Message(
                         ticket=active_ticket,
                         sender_type='customer',
                         message_text=message_text,
                         message_type=message_type,
-                        id_ext=message_id,
+                        whatsapp_message_id=message_id,
                         media_url=media_url,
                         mime_type=mime_type,
                         delivery_status='received',
                         sent_at=timezone.datetime.fromtimestamp(timestamp, tz=timezone.utc) if timestamp else timezone.now()
-                    )
-                    
-                    logger.info(f"✅ Message saved for ticket {active_ticket.ticket_number}")
+                    ))
+                    touched_customer_ids.add(customer.id)
                     
                     # معالجة اختيار القائمة إذا كانت التذكرة في انتظار الفئة
                     if active_ticket.status == 'pending' and not active_ticket.category:
@@ -785,6 +783,31 @@ def whatsapp_cloud_webhook(request):
                         if menu_result.get('success'):
                             logger.info(f"✅ Menu selection processed for {customer.phone_number}")
         
+        if pending_messages:
+            # ✅ الرسائل المحفوظة مسبقاً (إعادة إرسال نفس الـ webhook) لا تُحسب في عدادات التذاكر
+            seen_ids = set(Message.objects.filter(
+                whatsapp_message_id__in=[m.whatsapp_message_id for m in pending_messages if m.whatsapp_message_id]
+            ).values_list('whatsapp_message_id', flat=True))
+            new_messages = []
+            for pending in pending_messages:
+                if pending.whatsapp_message_id:
+                    if pending.whatsapp_message_id in seen_ids:
+                        continue
+                    seen_ids.add(pending.whatsapp_message_id)
+                new_messages.append(pending)
+
+            # bulk_create لا يطلق post_save، لذا نحدّث last_contact_date يدوياً
+            Message.objects.bulk_create(new_messages, ignore_conflicts=True, batch_size=500)
+            now = timezone.now()
+            Customer.objects.filter(id__in=touched_customer_ids).update(last_contact_date=now)
+
+            # ✅ عدادات الرسائل لكل تذكرة (UPDATE واحد لكل تذكرة) - مثل باقي الـ webhooks
+            for ticket, count in collections.Counter(m.ticket for m in new_messages).items():
+                ticket.increment_messages_count(
+                    from_customer=True, count=count, last_message_at=now, last_customer_message_at=now
+                )
+            logger.info(f"✅ {len(new_messages)} Cloud API message(s) saved")
+        
         return JsonResponse({'success': True, 'message': 'Webhook processed'})
         
     except json.JSONDecodeError as e:
@@ -882,11 +905,10 @@ def elmujib_webhook(request):
                 }
             )
         else:
-            try:
-                customer = Customer.objects.get(wa_id=whatsapp_id)
-                created = False
-            except Customer.DoesNotExist:
-                lid_digits = ''.join(ch for ch in (whatsapp_id or '').split('@')[0] if ch.isdigit())
+            customer = get_customer_by_wa_id(whatsapp_id)
+            created = False
+            if customer is None:
+                lid_digits = NON_DIGITS_RE.sub('', (whatsapp_id or '').split('@')[0])
                 placeholder_suffix = lid_digits[-6:] if len(lid_digits) >= 6 else f"{lid_digits:0>6}"
                 placeholder_phone = f"201000{placeholder_suffix}"
                 customer, created = Customer.objects.get_or_create(
@@ -907,7 +929,7 @@ def elmujib_webhook(request):
         ).first()
 
         if not open_ticket:
-            available_agent = get_available_agent()
+            available_agent = claim_available_agent()
             ticket_number = generate_ticket_number()
             if not available_agent:
                 open_ticket = Ticket.objects.create(
@@ -923,25 +945,36 @@ def elmujib_webhook(request):
                     ticket_number=ticket_number,
                     customer=customer,
                     assigned_agent=available_agent,
+                    current_agent=available_agent,
                     status='open',
                     priority='low',
                     category='general'
                 )
-            customer.total_tickets_count += 1
-            customer.last_contact_date = timezone.now()
-            customer.save(update_fields=['total_tickets_count', 'last_contact_date'])
-            if available_agent:
-                assign_ticket_to_agent(open_ticket, available_agent)
+            customer.increment_tickets_count()
+
+        message_fields = dict(
+            ticket=open_ticket,
+            sender=None,
+            sender_type='customer',
+            direction='incoming',
+            message_text=message_text,
+            message_type=message_type or 'text',
+            delivery_status='delivered',
+            media_url=media_url,
+            mime_type=mime_type
+        )
 
         if message_id:
-            existing_message = Message.objects.filter(whatsapp_message_id=message_id).first()
-            if existing_message:
+            message, created = Message.objects.get_or_create(
+                whatsapp_message_id=message_id, defaults=message_fields
+            )
+            if not created:
                 return JsonResponse({
                     'success': True,
                     'duplicate': True,
                     'ticket_id': open_ticket.id,
                     'ticket_number': open_ticket.ticket_number,
-                    'message_id': existing_message.id,
+                    'message_id': message.id,
                     'message': 'Message already exists - skipped'
                 })
         else:
@@ -961,33 +994,15 @@ def elmujib_webhook(request):
                     'message_id': recent_duplicate.id,
                     'message': 'Duplicate message by content - skipped'
                 })
+            message = Message.objects.create(**message_fields)
 
-        message = Message.objects.create(
-            ticket=open_ticket,
-            sender=None,
-            sender_type='customer',
-            direction='incoming',
-            message_text=message_text,
-            message_type=message_type or 'text',
-            whatsapp_message_id=message_id,
-            delivery_status='delivered',
-            media_url=media_url,
-            mime_type=mime_type
-        )
-
-        open_ticket.last_message_at = timezone.now()
-        open_ticket.last_customer_message_at = timezone.now()
-        open_ticket.messages_count += 1
-        open_ticket.save(update_fields=['last_message_at', 'last_customer_message_at', 'messages_count'])
+        now = timezone.now()
+        open_ticket.increment_messages_count(from_customer=True, last_message_at=now, last_customer_message_at=now)
 
         try:
-            open_ticket.refresh_from_db()
-            messages_count = Message.objects.filter(ticket=open_ticket, sender_type='customer').count()
-            welcome_message_exists = Message.objects.filter(
-                ticket=open_ticket,
-                sender_type='agent',
-                message_text__contains='مرحباً بك في صيدليات خليفة'
-            ).exists()
+            open_ticket = get_ticket_for_webhook(open_ticket.pk)
+            messages_count = open_ticket.customer_message_count
+            welcome_message_exists = open_ticket.welcome_sent
             if messages_count == 1 and not welcome_message_exists and should_send_welcome_message(customer, message_text, open_ticket):
                 send_welcome_message(customer, open_ticket)
             elif messages_count >= 2 or (messages_count == 1 and welcome_message_exists):
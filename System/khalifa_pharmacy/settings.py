@@ -51,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'conversations.middleware.PermanentSessionMiddleware',  # جلسة دائمة
     'conversations.middleware.UserActivityMiddleware',  # تتبع نشاط المستخدم
+    'conversations.middleware.ActivityLogBufferMiddleware',  # حفظ سجلات النشاط دفعة واحدة
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -126,6 +127,30 @@ else:
         }
     }
 
+# Cache
+# ✅ REDIS_URL => cache مشترك بين كل عمليات gunicorn (يتطلب حزمة redis - انظر requirements.txt)
+# بدونه LocMemCache لكل عملية: ما يُمسح أو يُكتب في عملية لا تراه باقي العمليات
+REDIS_URL = os.getenv('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# ✅ أعمدة include في الفهارس المركبة مدعومة على PostgreSQL فقط
+# والفهارس/القيود الجزئية (condition) غير مدعومة على MySQL
+# ويتم تجاهلها بأمان على القواعد الأخرى
+SILENCED_SYSTEM_CHECKS = ['models.W036', 'models.W037', 'models.W040']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -136,6 +161,22 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',  # Default backend
 ]
 
+# Password Hashers
+# ✅ Argon2 أولاً إذا كانت argon2-cffi مثبتة (أسرع في التحقق بنفس مستوى الأمان)
+# كلمات المرور القديمة (PBKDF2) يُعاد تشفيرها تلقائياً عند أول تسجيل دخول ناجح
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+try:
+    import argon2  # noqa: F401
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(2))
+except ImportError:
+    pass
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -189,6 +230,14 @@ STATICFILES_DIRS = [
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# ✅ حد رفع الملفات (صور الرسائل): يتم إيقاف الرفع فور تجاوزه
+FILE_UPLOAD_MAX_SIZE = 5 * 1024 * 1024  # 5MB لكل ملف
+FILE_UPLOAD_HANDLERS = [
+    'conversations.upload_handlers.QuotaUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -301,6 +350,13 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
 }
 
+# ✅ ترميز JSON عبر orjson إذا كانت مثبتة (أسرع من json القياسي)
+try:
+    import orjson  # noqa: F401
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(0, 'conversations.renderers.ORJSONRenderer')
+except ImportError:
+    pass
+
 # Throttling (Rate Limiting)
 if DEBUG:
     REST_FRAMEWORK.update({
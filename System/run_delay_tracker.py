@@ -7,24 +7,13 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
 django.setup()
 
 from conversations.models import Ticket
-from conversations.utils import update_ticket_delay_status
+from conversations.utils import bulk_update_delay_status
 
 def check_and_update_delays():
-    open_tickets = Ticket.objects.filter(status='open')
+    newly_delayed, no_longer_delayed = bulk_update_delay_status()
     
-    updated_count = 0
-    delayed_count = 0
-    
-    for ticket in open_tickets:
-        old_delayed_status = ticket.is_delayed
-        update_ticket_delay_status(ticket)
-        ticket.refresh_from_db()
-        
-        if ticket.is_delayed != old_delayed_status:
-            updated_count += 1
-        
-        if ticket.is_delayed:
-            delayed_count += 1
+    updated_count = newly_delayed + no_longer_delayed
+    delayed_count = Ticket.objects.filter(status='open', is_delayed=True).count()
     
     return updated_count, delayed_count
 
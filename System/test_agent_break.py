@@ -45,15 +45,15 @@ def test_agent_break_system():
     print("📊 اختبار 1: التأكد من أن الموظفين متاحين")
     print("-" * 60)
     
+    agent1.end_break()  # إغلاق أي جلسة استراحة مفتوحة
     agent1.is_online = True
     agent1.status = 'available'
-    agent1.is_on_break = False
     agent1.current_active_tickets = 0
     agent1.save()
     
+    agent2.end_break()
     agent2.is_online = True
     agent2.status = 'available'
-    agent2.is_on_break = False
     agent2.current_active_tickets = 0
     agent2.save()
     
@@ -77,8 +77,7 @@ def test_agent_break_system():
     print("📊 اختبار 3: وضع الموظف 1 في استراحة")
     print("-" * 60)
     
-    agent1.is_on_break = True
-    agent1.break_started_at = timezone.now()
+    agent1.start_break()
     agent1.status = 'on_break'
     agent1.save()
     
@@ -106,8 +105,7 @@ def test_agent_break_system():
     print("📊 اختبار 5: وضع جميع الموظفين في استراحة")
     print("-" * 60)
     
-    agent2.is_on_break = True
-    agent2.break_started_at = timezone.now()
+    agent2.start_break()
     agent2.status = 'on_break'
     agent2.save()
     
@@ -131,14 +129,10 @@ def test_agent_break_system():
     print("📊 اختبار 7: إنهاء استراحة الموظف 1")
     print("-" * 60)
     
-    # حساب مدة الاستراحة
-    if agent1.break_started_at:
-        break_duration = timezone.now() - agent1.break_started_at
-        break_minutes = int(break_duration.total_seconds() / 60)
-        agent1.total_break_minutes_today += break_minutes
+    # إنهاء الجلسة يحسب مدتها (تُضاف تلقائياً لإجمالي اليوم)
+    session = agent1.end_break()
+    break_minutes = int(session.break_duration_seconds / 60) if session else 0
     
-    agent1.is_on_break = False
-    agent1.break_started_at = None
     agent1.status = 'available'
     agent1.save()
     
@@ -163,8 +157,7 @@ def test_agent_break_system():
     print()
     
     # 10. إعادة الموظف 2 للعمل
-    agent2.is_on_break = False
-    agent2.break_started_at = None
+    agent2.end_break()
     agent2.status = 'available'
     agent2.save()
     
@@ -42,13 +42,10 @@ def test_break_error_handling():
         print(f"   - الموظف: {agent.user.username}")
         
         # التأكد من أن الموظف ليس في استراحة
-        agent.is_on_break = False
-        agent.break_started_at = None
-        agent.save()
+        agent.end_break()
         
         # محاولة أخذ استراحة للمرة الأولى
-        agent.is_on_break = True
-        agent.save()
+        session = agent.start_break()
         print(f"   - الموظف الآن في استراحة")
         
         # محاولة أخذ استراحة للمرة الثانية (يجب أن يفشل)
@@ -64,8 +61,8 @@ def test_break_error_handling():
             print(f"   ❌ لم يتم اكتشاف الاستراحة المزدوجة")
         
         # إعادة الموظف للحالة الطبيعية
-        agent.is_on_break = False
-        agent.save()
+        agent.end_break()
+        session.delete()
         
     except Exception as e:
         print(f"   ❌ خطأ في الاختبار: {str(e)}")
@@ -80,9 +77,7 @@ def test_break_error_handling():
         agent = Agent.objects.filter(is_online=True).first()
         
         # التأكد من أن الموظف ليس في استراحة
-        agent.is_on_break = False
-        agent.break_started_at = None
-        agent.save()
+        agent.end_break()
         
         print(f"   - الموظف: {agent.user.username}")
         print(f"   - الموظف ليس في استراحة")
@@ -138,11 +133,11 @@ def test_break_error_handling():
         
         agent = Agent.objects.filter(is_online=True).first()
         
-        # بدء استراحة
-        agent.is_on_break = True
-        agent.break_started_at = timezone.now() - timedelta(minutes=5)
-        agent.total_break_minutes_today = 0
-        agent.save()
+        # بدء استراحة (جلسة مفتوحة بدأت قبل 5 دقائق)
+        agent.end_break()
+        session = agent.start_break()
+        session.break_start_time = timezone.now() - timedelta(minutes=5)
+        session.save(update_fields=['break_start_time'])
         
         print(f"   - الموظف: {agent.user.username}")
         print(f"   - بدأت الاستراحة منذ: 5 دقائق")
@@ -159,10 +154,9 @@ def test_break_error_handling():
             else:
                 print(f"   ⚠️  الحساب قد يكون غير دقيق")
         
-        # إعادة الموظف للحالة الطبيعية
-        agent.is_on_break = False
-        agent.break_started_at = None
-        agent.save()
+        # إعادة الموظف للحالة الطبيعية (وحذف جلسة الاختبار حتى لا تُحسب في KPI)
+        agent.end_break()
+        session.delete()
         
     except Exception as e:
         print(f"   ❌ خطأ في الاختبار: {str(e)}")
@@ -13,7 +13,6 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khalifa_pharmacy.settings')
 django.setup()
 
 from conversations.models import Agent, User
-from django.utils import timezone
 
 
 def test_agent_break_state():
@@ -23,8 +22,8 @@ def test_agent_break_state():
     print("🧪 اختبار حالة الاستراحة للموظف")
     print("=" * 60)
     
-    # Get all agents
-    agents = Agent.objects.all()
+    # Get all agents (مع حالة الاستراحة محملة مسبقاً من AgentBreakSession)
+    agents = Agent.objects.with_break_state().select_related('user')
     
     if not agents.exists():
         print("❌ لا يوجد موظفين في النظام")
@@ -46,11 +45,8 @@ def test_agent_break_state():
         if agent.is_on_break and agent.status != 'on_break':
             print(f"   ⚠️  تحذير: is_on_break=True لكن status={agent.status}")
         
-        if not agent.is_on_break and agent.break_started_at:
-            print(f"   ⚠️  تحذير: is_on_break=False لكن break_started_at موجود")
-        
-        if agent.is_on_break and not agent.break_started_at:
-            print(f"   ⚠️  تحذير: is_on_break=True لكن break_started_at غير موجود")
+        if not agent.is_on_break and agent.status == 'on_break':
+            print(f"   ⚠️  تحذير: status=on_break لكن لا توجد جلسة استراحة مفتوحة")
         
         print()
     
@@ -68,33 +64,25 @@ def fix_inconsistent_states():
     
     fixed_count = 0
     
-    # Fix agents with is_on_break=False but break_started_at exists
-    agents_to_fix = Agent.objects.filter(is_on_break=False).exclude(break_started_at=None)
-    if agents_to_fix.exists():
-        print(f"🔧 إصلاح {agents_to_fix.count()} موظف لديهم break_started_at بدون is_on_break")
-        for agent in agents_to_fix:
-            print(f"   - {agent.user.username}: مسح break_started_at")
-            agent.break_started_at = None
-            agent.save()
-            fixed_count += 1
-    
-    # Fix agents with is_on_break=True but status != 'on_break'
-    agents_to_fix = Agent.objects.filter(is_on_break=True).exclude(status='on_break')
+    # حالة الاستراحة مشتقة من جلسة AgentBreakSession المفتوحة - الإصلاح يخص status فقط
+
+    # Fix agents with an open break session but status != 'on_break'
+    agents_to_fix = Agent.objects.filter(break_sessions__break_end_time__isnull=True).exclude(status='on_break')
     if agents_to_fix.exists():
-        print(f"🔧 إصلاح {agents_to_fix.count()} موظف لديهم is_on_break=True لكن status خاطئ")
+        print(f"🔧 إصلاح {agents_to_fix.count()} موظف في استراحة لكن status خاطئ")
         for agent in agents_to_fix:
             print(f"   - {agent.user.username}: تحديث status إلى 'on_break'")
             agent.status = 'on_break'
             agent.save()
             fixed_count += 1
     
-    # Fix agents with is_on_break=True but no break_started_at
-    agents_to_fix = Agent.objects.filter(is_on_break=True, break_started_at=None)
+    # Fix agents with status='on_break' but no open break session
+    agents_to_fix = Agent.objects.not_on_break().filter(status='on_break')
     if agents_to_fix.exists():
-        print(f"🔧 إصلاح {agents_to_fix.count()} موظف لديهم is_on_break=True بدون break_started_at")
+        print(f"🔧 إصلاح {agents_to_fix.count()} موظف لديهم status=on_break بدون جلسة استراحة مفتوحة")
         for agent in agents_to_fix:
-            print(f"   - {agent.user.username}: تعيين break_started_at إلى الآن")
-            agent.break_started_at = timezone.now()
+            print(f"   - {agent.user.username}: تحديث status إلى 'available'")
+            agent.status = 'available'
             agent.save()
             fixed_count += 1
     
@@ -113,19 +101,18 @@ def reset_all_breaks():
     print("🔄 إعادة تعيين جميع الاستراحات")
     print("=" * 60 + "\n")
     
-    agents_on_break = Agent.objects.filter(is_on_break=True)
+    agents_on_break = list(Agent.objects.filter(break_sessions__break_end_time__isnull=True))
     
-    if not agents_on_break.exists():
+    if not agents_on_break:
         print("✅ لا يوجد موظفين في استراحة")
     else:
-        print(f"🔄 إعادة تعيين {agents_on_break.count()} موظف في استراحة")
+        print(f"🔄 إعادة تعيين {len(agents_on_break)} موظف في استراحة")
         for agent in agents_on_break:
             print(f"   - {agent.user.username}")
-            agent.is_on_break = False
-            agent.break_started_at = None
+            agent.end_break()
             agent.status = 'available'
             agent.save()
-        print(f"\n✅ تم إعادة تعيين {agents_on_break.count()} موظف")
+        print(f"\n✅ تم إعادة تعيين {len(agents_on_break)} موظف")
     
     print("=" * 60)
 
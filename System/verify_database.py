@@ -26,8 +26,7 @@ from conversations.models import (
     TicketTransferLog, TicketStateLog, MessageDeliveryLog,
     CustomerTag, CustomerNote, AgentKPI, AgentKPIMonthly,
     GlobalTemplate, AgentTemplate, AutoReplyTrigger,
-    ResponseTimeTracking, AgentDelayEvent, AgentBreakSession,
-    MessageSearchIndex
+    ResponseTimeTracking, AgentDelayEvent, AgentBreakSession
 )
 
 
@@ -64,7 +63,6 @@ class DatabaseVerifier:
             ('Response Time Tracking', ResponseTimeTracking),
             ('Agent Delay Events', AgentDelayEvent),
             ('Agent Break Sessions', AgentBreakSession),
-            ('Message Search Index', MessageSearchIndex),
         ]
     
     def print_section(self, title):